@@ -1,38 +1,75 @@
+import argparse
+import asyncio
+import hashlib
 import json
+import logging
+from contextlib import nullcontext
 from pathlib import Path
 from schemas import GraphState, UserRequest
-from graph import build_graph
+from config import BATCH_CONCURRENCY, CHECKPOINT_PATH, GRAPH_TOPOLOGY, SENTIMENT_CACHE_ENABLED
 
-def save_graph_diagrams(app, out_dir="diagrams"):
+# graph/nodes/batch/stream (а с ними langgraph, langchain, openai) импортируются
+# в командах: `--help` и ошибки аргументов не должны ждать их загрузки
+
+
+def graph_hash(g) -> str:
+    """Хэш структуры графа: узлы и рёбра, без учёта порядка добавления."""
+    nodes = sorted(g.nodes)
+    edges = sorted((e.source, e.target, e.conditional, str(e.data or "")) for e in g.edges)
+    return hashlib.sha256(json.dumps([nodes, edges]).encode("utf-8")).hexdigest()
+
+
+def save_graph_diagrams(app, out_dir="diagrams", png=False, force=False):
+    """
+    graph.mmd (и graph.png при png=True — рендер через внешний сервис mermaid)
+    перерисовываются, только если структура графа изменилась с прошлого раза.
+    Хэши отрисованных файлов — в graph.hash.json.
+    """
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
     g = app.get_graph(xray=True)
+    digest = graph_hash(g)
+    stamp_path = out_dir / "graph.hash.json"
+    stamp = json.loads(stamp_path.read_text()) if stamp_path.exists() else {}
+
+    targets = [("mmd", lambda p: p.write_text(g.draw_mermaid(), encoding="utf-8"))]
+    if png:
+        targets.append(("png", lambda p: p.write_bytes(g.draw_mermaid_png())))
 
-    mermaid_str = g.draw_mermaid()
-    (out_dir / "graph.mmd").write_text(mermaid_str, encoding="utf-8")
-    print(f"[mmd scheme] Mermaid saved: {out_dir/'graph.mmd'}")
+    for ext, render in targets:
+        path = out_dir / f"graph.{ext}"
+        if not force and path.exists() and stamp.get(ext) == digest:
+            print(f"[{ext} scheme] up to date: {path}")
+            continue
+        render(path)
+        stamp[ext] = digest
+        print(f"[{ext} scheme] saved: {path}")
 
-    png_bytes = g.draw_mermaid_png()
-    (out_dir / "graph.png").write_bytes(png_bytes)
-    print(f"[png scheme] PNG saved: {out_dir/'graph.png'}")
-   
+    stamp_path.write_text(json.dumps(stamp, indent=2) + "\n")
 
-def demo():
-    app = build_graph()
-    save_graph_diagrams(app)
 
-    init_state = GraphState(
-        user_request=UserRequest(
-            ticker="AMZN.US",
-            company_name="Amazon",
-            lookback_days=3,
-            event_window_days=1,
-            max_articles=3
-        )
-    )
+DEMO_REQUEST = UserRequest(
+    ticker="AMZN.US",
+    company_name="Amazon",
+    lookback_days=3,
+    event_window_days=1,
+    max_articles=3
+)
 
-    out = app.invoke(init_state)
+
+def print_report(out, run=None):
+    from adaptive import llm_limiter
+    from nodes import sentiment_cache
+    import cascade
+    import transport
+
+    print(f"[sentiment cache] {sentiment_cache.stats() if SENTIMENT_CACHE_ENABLED else 'disabled'}")
+    print(f"[http] {transport.metrics()}")
+    print(f"[llm limiter] {llm_limiter.stats()}")
+    print(f"[sentiment cascade] {cascade.stats()}")
+    if run is not None:
+        print(f"[metrics] {json.dumps(run.to_dict(), ensure_ascii=False)}")
 
     print("!!! Final report !!!")
     report = out.get("report")
@@ -42,5 +79,127 @@ def demo():
         print(json.dumps(report, indent=2, ensure_ascii=False))
 
 
+def _checkpointer(thread_id):
+    if not thread_id:
+        return nullcontext()
+    from checkpoint import sqlite_checkpointer
+    return sqlite_checkpointer(CHECKPOINT_PATH)
+
+
+def _acheckpointer(thread_id):
+    if not thread_id:
+        return nullcontext()
+    from checkpoint import async_sqlite_checkpointer
+    return async_sqlite_checkpointer(CHECKPOINT_PATH)
+
+
+def _initial_state(incremental):
+    if not incremental:
+        return GraphState(user_request=DEMO_REQUEST)
+    from incremental import initial_state
+    return initial_state(DEMO_REQUEST)
+
+
+def _save_snapshot(incremental, out):
+    if incremental:
+        from incremental import save_snapshot, snapshot_from
+        save_snapshot(snapshot_from(DEMO_REQUEST, out))
+
+
+def demo(thread_id=None, incremental=False):
+    from graph import build_graph, invoke_resumable
+    from budget import run_budget
+    import metrics
+
+    state = _initial_state(incremental)
+    with _checkpointer(thread_id) as checkpointer:
+        app = build_graph(checkpointer=checkpointer)
+        with metrics.run(DEMO_REQUEST.ticker) as m, run_budget():
+            out = invoke_resumable(app, state, thread_id) if thread_id else app.invoke(state)
+    _save_snapshot(incremental, out)
+    print_report(out, m)
+
+
+async def ademo(thread_id=None, incremental=False):
+    from graph import build_graph, ainvoke_resumable
+    from aio import aclose
+    from budget import run_budget
+    import metrics
+
+    state = _initial_state(incremental)
+    try:
+        async with _acheckpointer(thread_id) as checkpointer:
+            app = build_graph(use_async=True, checkpointer=checkpointer)
+            with metrics.run(DEMO_REQUEST.ticker) as m, run_budget():
+                out = await (ainvoke_resumable(app, state, thread_id) if thread_id else app.ainvoke(state))
+    finally:
+        await aclose()
+    _save_snapshot(incremental, out)
+    print_report(out, m)
+
+
+def stream_demo():
+    from stream import stream_events
+
+    # по событию на строку, JSONL — удобно для дашборда через pipe
+    for event in stream_events(DEMO_REQUEST):
+        print(event.model_dump_json(), flush=True)
+
+
+async def astream_demo():
+    from stream import astream_events
+    from aio import aclose
+
+    try:
+        async for event in astream_events(DEMO_REQUEST):
+            print(event.model_dump_json(), flush=True)
+    finally:
+        await aclose()
+
+
+def main():
+    # предупреждения библиотечных модулей — в stderr, stdout остаётся за отчётом и --stream
+    logging.basicConfig(format="[%(name)s] %(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(prog="lab1")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="демо через asyncio-граф")
+    parser.add_argument("--stream", action="store_true",
+                        help="печатать результаты по мере готовности (JSONL событий)")
+    parser.add_argument("--thread-id",
+                        help="чекпойнты в CHECKPOINT_PATH; повтор с тем же id продолжит упавший прогон")
+    parser.add_argument("--incremental", action="store_true",
+                        help="только новое с прошлого прогона по тикеру (снимки в INCREMENTAL_DIR), "
+                             "в том числе для batch: `--incremental batch ...`")
+    sub = parser.add_subparsers(dest="command")
+
+    b = sub.add_parser("batch", help="прогон по файлу тикеров, отчёты в JSONL")
+    b.add_argument("tickers", help="CSV ticker,company_name или JSONL UserRequest")
+    b.add_argument("out", help="куда писать отчёты (JSONL)")
+    b.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY)
+    b.add_argument("--run-id", help="чекпойнты по тикеру; повтор с тем же id доделает только упавшие")
+
+    d = sub.add_parser("diagram", help="схема графа в graph.mmd (+ graph.png), с кэшем по структуре")
+    d.add_argument("--out", default="diagrams")
+    d.add_argument("--png", action="store_true", help="ещё и PNG (внешний рендер mermaid)")
+    d.add_argument("--topology", default=GRAPH_TOPOLOGY, choices=("parallel", "react"))
+    d.add_argument("--force", action="store_true", help="перерисовать, даже если граф не менялся")
+
+    args = parser.parse_args()
+    if args.command == "diagram":
+        from graph import build_graph
+        save_graph_diagrams(build_graph(args.topology), args.out, args.png, args.force)
+    elif args.command == "batch":
+        from batch import load_requests, run_batch
+        requests, invalid = load_requests(args.tickers)
+        asyncio.run(run_batch(requests, args.out, args.concurrency, args.run_id,
+                              args.incremental, invalid))
+    elif args.stream:
+        asyncio.run(astream_demo()) if args.use_async else stream_demo()
+    elif args.use_async:
+        asyncio.run(ademo(args.thread_id, args.incremental))
+    else:
+        demo(args.thread_id, args.incremental)
+
+
 if __name__ == "__main__":
-    demo()
\ No newline at end of file
+    main()
\ No newline at end of file
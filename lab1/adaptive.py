@@ -0,0 +1,204 @@
+"""
+Адаптивный лимит одновременных LLM-вызовов (AIMD, как окно TCP).
+
+- Успешный ответ при полной загрузке и латентности не выше
+  baseline * LLM_LATENCY_TOLERANCE: limit += 1/limit (≈ +1 за «раунд»).
+- 429/5xx, таймаут, обрыв соединения: limit *= LLM_CONCURRENCY_BACKOFF.
+- Всплеск латентности: limit *= 0.9 — сервер начал копить очередь.
+Уменьшение не чаще раза за baseline-латентность: одна волна ошибок от
+запросов, отправленных до реакции, не обрушивает лимит до минимума.
+
+baseline — медленная EWMA латентности по виду запроса (модель ответа):
+батч на 10 статей и одиночная оценка сравниваются каждый со своей нормой.
+Последние латентности хранятся для квантилей (порог hedged-запросов).
+Один лимитер на процесс, общий для потоков пула и event loop'ов.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+from config import (
+    LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX,
+    LLM_LATENCY_TOLERANCE, LLM_CONCURRENCY_BACKOFF,
+)
+
+OVERLOAD_STATUSES = {408, 429, 500, 502, 503, 504}
+_SPIKE_BACKOFF = 0.9
+_EWMA_ALPHA = 0.1
+# квантиль по окну последних ответов; меньше _MIN_SAMPLES — оценки нет
+_WINDOW = 256
+_MIN_SAMPLES = 20
+
+
+def is_overload(e: BaseException) -> bool:
+    """Ошибка перегрузки бэкенда (а не запроса): повторять и снижать лимит."""
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status in OVERLOAD_STATUSES
+    name = type(e).__name__
+    return "Timeout" in name or "Connection" in name or "RateLimit" in name
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: float, min_limit: int, max_limit: int,
+                 tolerance: float, backoff: float):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self._inflight = 0
+        self._sync_waiting = 0
+        self._cond = threading.Condition()
+        self._waiters: deque = deque()  # (loop, future) async-ожидающих
+        self._baseline: dict[str, float] = {}
+        self._recent: dict[str, deque] = {}
+        self._last_decrease = 0.0
+        self._stats = {"increases": 0, "decreases": 0, "overloads": 0, "spikes": 0,
+                       "peak_limit": int(self.limit), "peak_inflight": 0}
+
+    def _cap(self) -> int:
+        return int(self.limit)
+
+    def _take(self):
+        self._inflight += 1
+        if self._inflight > self._stats["peak_inflight"]:
+            self._stats["peak_inflight"] = self._inflight
+
+    def acquire(self, timeout: float | None = None) -> float:
+        """Блокирующее ожидание слота; возвращает время ожидания, по timeout — TimeoutError."""
+        t0 = time.perf_counter()
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._sync_waiting += 1
+            try:
+                while self._inflight >= self._cap() or self._waiters:
+                    left = None if end is None else end - time.monotonic()
+                    if left is not None and left <= 0:
+                        # разбуженный, но уходящий поток не должен съесть notify
+                        self._wake()
+                        raise TimeoutError("no LLM slot before the deadline")
+                    self._cond.wait(left)
+            finally:
+                self._sync_waiting -= 1
+            self._take()
+        return time.perf_counter() - t0
+
+    async def aacquire(self, timeout: float | None = None) -> float:
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._inflight < self._cap() and not self._waiters:
+                self._take()
+                return 0.0
+            fut = loop.create_future()
+            entry = (loop, fut)
+            self._waiters.append(entry)
+        try:
+            # wait, а не wait_for: fut не отменяется, слот разбираем сами
+            done, _ = await asyncio.wait({fut}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not done:
+            self._abandon(entry)
+            raise TimeoutError("no LLM slot before the deadline")
+        return time.perf_counter() - t0
+
+    def _abandon(self, entry):
+        # ожидающий ушёл (отмена, таймаут): убрать из очереди или вернуть выданный слот
+        loop, fut = entry
+        fut.cancel()
+        with self._cond:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                self._wake()
+            elif not fut.cancelled():
+                # слот выдан и результат уже выставлен, но забрать его не успели;
+                # если не выставлен — fut отменён, и слот вернёт _granted
+                self._give_back()
+
+    def _granted(self, fut: asyncio.Future):
+        # в потоке loop'а ожидающего
+        if fut.cancelled():
+            with self._cond:
+                self._give_back()
+        elif not fut.done():
+            fut.set_result(None)
+
+    def _wake(self):
+        # под self._cond: раздать освободившиеся слоты — сначала async-очереди
+        # (у неё приоритет: синхронные ждут, пока она не пуста), затем потокам
+        while self._waiters and self._inflight < self._cap():
+            loop, fut = self._waiters.popleft()
+            self._take()
+            try:
+                loop.call_soon_threadsafe(self._granted, fut)
+            except RuntimeError:
+                # loop закрыт — ожидающего больше нет
+                self._inflight -= 1
+        if self._sync_waiting and not self._waiters:
+            self._cond.notify(max(1, self._cap() - self._inflight))
+
+    def _give_back(self):
+        self._inflight -= 1
+        self._wake()
+
+    def release(self, kind: str, latency: float | None, overloaded: bool = False):
+        """
+        Вернуть слот и учесть исход вызова: latency — для успешного ответа,
+        overloaded — ошибка перегрузки; прочие ошибки (400, битый запрос)
+        о нагрузке ничего не говорят и лимит не трогают.
+        """
+        now = time.monotonic()
+        with self._cond:
+            saturated = self._inflight >= self._cap() or bool(self._waiters) or self._sync_waiting > 0
+            base = self._baseline.get(kind)
+            if overloaded:
+                self._stats["overloads"] += 1
+                self._decrease(now, self.backoff, base)
+            elif latency is not None:
+                # норма ползёт и вверх: стабильно медленный бэкенд — новая норма
+                self._baseline[kind] = latency if base is None else base + _EWMA_ALPHA * (latency - base)
+                self._recent.setdefault(kind, deque(maxlen=_WINDOW)).append(latency)
+                if base is not None and latency > base * self.tolerance:
+                    self._stats["spikes"] += 1
+                    self._decrease(now, _SPIKE_BACKOFF, base)
+                elif saturated and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    self._stats["increases"] += 1
+                    self._stats["peak_limit"] = max(self._stats["peak_limit"], self._cap())
+            self._give_back()
+
+    def _decrease(self, now: float, factor: float, base: float | None):
+        if now - self._last_decrease < (base or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._stats["decreases"] += 1
+
+    def quantile(self, kind: str, q: float) -> float | None:
+        """Квантиль латентности успешных запросов вида kind по последним ответам."""
+        with self._cond:
+            xs = sorted(self._recent.get(kind, ()))
+        if len(xs) < _MIN_SAMPLES:
+            return None
+        return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+    def has_spare(self) -> bool:
+        """Есть свободный слот: дубль запроса не встанет в очередь за другими."""
+        with self._cond:
+            return self._inflight < self._cap() and not self._waiters and not self._sync_waiting
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"limit": round(self.limit, 2), "inflight": self._inflight,
+                    **self._stats,
+                    "baseline_s": {k: round(v, 3) for k, v in self._baseline.items()}}
+
+
+llm_limiter = AdaptiveLimiter(
+    LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX,
+    LLM_LATENCY_TOLERANCE, LLM_CONCURRENCY_BACKOFF,
+)
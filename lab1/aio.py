@@ -0,0 +1,43 @@
+import asyncio
+import weakref
+
+import httpx
+
+from config import ASYNC_CONCURRENCY, HTTP_TIMEOUT, HTTP_POOL_SIZE
+
+# asyncio-примитивы привязаны к event loop, поэтому держим по экземпляру на loop
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def limiter() -> asyncio.Semaphore:
+    """Общий на процесс лимит одновременных HTTP-вызовов (ASYNC_CONCURRENCY)."""
+    loop = asyncio.get_running_loop()
+    sem = _limiters.get(loop)
+    if sem is None:
+        sem = _limiters[loop] = asyncio.Semaphore(ASYNC_CONCURRENCY)
+    return sem
+
+
+def http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE,
+                                max_keepalive_connections=HTTP_POOL_SIZE),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+    return client
+
+
+async def aclose():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,153 @@
+import asyncio
+import csv
+import json
+import time
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from config import BATCH_CONCURRENCY, CHECKPOINT_PATH
+from schemas import GraphState, UserRequest
+from graph import build_graph, ainvoke_resumable
+from incremental import initial_state, save_snapshot, snapshot_from
+from adaptive import llm_limiter
+from aio import aclose
+from budget import run_budget
+import cascade
+import transport
+import metrics
+
+
+def _parse_line(line: str) -> UserRequest | None:
+    if line.startswith("{"):
+        return UserRequest.model_validate_json(line)
+    row = next(csv.reader([line]))
+    if row[0].strip().lower() == "ticker":
+        return None
+    fields = ["ticker", "company_name", "lookback_days", "event_window_days", "max_articles"]
+    return UserRequest(**{k: v.strip() for k, v in zip(fields, row) if v.strip()})
+
+
+def _row_error(e: ValueError) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in err['loc']) or '<row>'}: {err['msg']}"
+                         for err in e.errors())
+    return f"{type(e).__name__}: {e}"
+
+
+def load_requests(path: str) -> tuple[list[UserRequest], list[dict]]:
+    """
+    Файл тикеров: JSONL с полями UserRequest или CSV
+    `ticker,company_name[,lookback_days,event_window_days,max_articles]`
+    (заголовок необязателен, # — комментарий).
+    -> (запросы, битые строки): битая строка не роняет батч, а уходит
+    в результат как упавший элемент с номером строки.
+    """
+    reqs, invalid = [], []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                req = _parse_line(line)
+            except ValueError as e:
+                # ValidationError pydantic — тоже ValueError
+                invalid.append({"line": n, "input": line, "error": _row_error(e)})
+                continue
+            if req is not None:
+                reqs.append(req)
+    return reqs, invalid
+
+
+async def run_batch(requests: list[UserRequest], out_path: str,
+                    concurrency: int = BATCH_CONCURRENCY, run_id: str | None = None,
+                    incremental: bool = False, invalid: list[dict] = ()) -> dict:
+    """
+    Прогоняет один скомпилированный граф по всем запросам, не больше
+    concurrency одновременно. HTTP-клиент, LLM и кэши общие на процесс.
+    Каждый FinalReport дописывается в JSONL сразу по готовности,
+    вместе с метриками прогона (metrics.RunMetrics).
+
+    С run_id граф пишет чекпойнты (thread_id = run_id:ticker): повторный
+    запуск с тем же run_id берёт готовые отчёты из чекпойнтов, а упавшие
+    тикеры продолжает с последнего завершённого узла.
+
+    incremental — инкрементальный режим (incremental.py): по каждому тикеру
+    обрабатывается только новое с прошлого прогона.
+
+    invalid — битые строки файла тикеров (load_requests): пишутся в результат
+    упавшими элементами и считаются в failed.
+    """
+    stack = AsyncExitStack()
+    checkpointer = None
+    if run_id:
+        from checkpoint import async_sqlite_checkpointer
+        checkpointer = await stack.enter_async_context(async_sqlite_checkpointer(CHECKPOINT_PATH))
+    app = build_graph(use_async=True, checkpointer=checkpointer)
+    sem = asyncio.Semaphore(concurrency)
+    lock = asyncio.Lock()
+    stats = {"ok": 0, "failed": len(invalid), "elapsed": []}
+
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    out = open(out_path, "w", encoding="utf-8")
+    for rec in invalid:
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        print(f"[batch] line {rec['line']}: {rec['error']}")
+    out.flush()
+
+    async def one(req: UserRequest):
+        async with sem:
+            t0 = time.perf_counter()
+            rec = {"ticker": req.ticker, "company": req.company_name}
+            # бюджет — на тикер, а не на весь батч: ожидание семафора в него не входит
+            with metrics.run(req.ticker) as m, run_budget():
+                try:
+                    state = initial_state(req) if incremental else GraphState(user_request=req)
+                    if run_id:
+                        state = await ainvoke_resumable(app, state, f"{run_id}:{req.ticker}")
+                    else:
+                        state = await app.ainvoke(state)
+                    if incremental:
+                        save_snapshot(snapshot_from(req, state))
+                    rec["report"] = state["report"].model_dump()
+                    stats["ok"] += 1
+                except Exception as e:
+                    rec["error"] = f"{type(e).__name__}: {e}"
+                    stats["failed"] += 1
+            rec["elapsed_s"] = round(time.perf_counter() - t0, 3)
+            rec["metrics"] = m.to_dict()
+            stats["elapsed"].append(rec["elapsed_s"])
+
+        async with lock:
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+        status = "ok" if "report" in rec else rec["error"]
+        print(f"[batch] {req.ticker}: {rec['elapsed_s']:.2f}s {status}")
+
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(r) for r in requests))
+    finally:
+        out.close()
+        await stack.aclose()
+        await aclose()
+    wall = time.perf_counter() - t0
+
+    elapsed = sorted(stats["elapsed"])
+    summary = {
+        "tickers": len(requests),
+        "invalid_rows": len(invalid),
+        "ok": stats["ok"],
+        "failed": stats["failed"],
+        "wall_s": round(wall, 3),
+        "tickers_per_min": round(len(requests) / wall * 60, 2) if wall else 0.0,
+        "mean_ticker_s": round(sum(elapsed) / len(elapsed), 3) if elapsed else 0.0,
+        "p95_ticker_s": elapsed[int(0.95 * (len(elapsed) - 1))] if elapsed else 0.0,
+        "http": transport.metrics(),
+        "llm_limiter": llm_limiter.stats(),
+        "sentiment_cascade": cascade.stats(),
+    }
+    print(f"[batch] {json.dumps(summary)}")
+    return summary
@@ -0,0 +1,396 @@
+"""
+Офлайн-бенчмарки без живого LLM и GDELT/Stooq:
+
+    python lab1/bench.py run [--quick] [--only events,dedup,...] [--latency-ms 50 ...]
+    python lab1/bench.py compare [A] [B]
+
+run поднимает fake_server.py, направляет на него LITELLM_BASE_URL,
+GDELT_BASE и STOOQ_BASE (кэши выключены — меряем холодный путь) и гоняет
+наборы замеров. Каждый прогон дописывается одной JSON-строкой в
+BENCH_RESULTS вместе с коммитом; compare сравнивает медианы двух прогонов
+(по умолчанию — двух последних; A/B — префиксы коммитов).
+
+Модули lab1 импортируются только после настройки окружения: config читает
+переменные при импорте.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import fixtures
+from fake_server import FakeServerConfig, serve
+
+RESULTS_PATH = Path(os.getenv("BENCH_RESULTS", ".cache/bench/results.jsonl"))
+SUITES = ("parse", "events", "dedup", "views", "llm", "nodes", "e2e")
+
+
+def _bench_env(base_url: str):
+    os.environ.update({
+        "LITELLM_BASE_URL": base_url + "/v1",
+        "LITELLM_API_KEY": "bench",
+        "GDELT_BASE": base_url + "/gdelt",
+        "STOOQ_BASE": base_url + "/stooq",
+        "HTTP_RATE_LIMITS": "",
+        "HTTP_RATE_DEFAULT": "100000:100000",
+        "GDELT_CACHE_ENABLED": "0",
+        "SENTIMENT_CACHE_ENABLED": "0",
+        "PRICE_STORE_ENABLED": "0",
+        "PLANNER_MODE": "local",
+        "MAX_ARTICLES": "100000",
+        "METRICS_DIR": "",
+        "METRICS_PROM_PATH": "",
+    })
+
+
+def measure(name: str, params: dict, fn, repeat: int, warmup: int = 1) -> dict:
+    """fn() -> dict доп. показателей (или None); исключения считаются, а не роняют прогон."""
+    for _ in range(warmup):
+        try:
+            fn()
+        except Exception:
+            pass
+    times, errors, extra = [], 0, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        try:
+            extra = fn()
+        except Exception as e:
+            errors += 1
+            extra = {"last_error": f"{type(e).__name__}: {e}"[:200]}
+            continue
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    res = {
+        "name": name,
+        "params": params,
+        "repeat": repeat,
+        "errors": errors,
+        "min_s": round(times[0], 6) if times else None,
+        "median_s": round(statistics.median(times), 6) if times else None,
+        "p95_s": round(times[int(0.95 * (len(times) - 1))], 6) if times else None,
+    }
+    if extra:
+        res["extra"] = extra
+    med = f"{res['median_s'] * 1000:9.2f} ms" if times else "   failed"
+    print(f"[bench] {name:<24} {json.dumps(params):<36} median {med}  errors {errors}", flush=True)
+    return res
+
+
+def _articles(n: int):
+    from tools import _parse_gdelt
+    return _parse_gdelt(fixtures.gdelt_fixture(n))
+
+
+def _series(years: int):
+    from price_series import PriceSeries
+    s = PriceSeries("AMZN.US")
+    for line in fixtures.stooq_fixture(years).splitlines():
+        s.append_csv(line, "0000-00-00", "9999-99-99")
+    return s
+
+
+def _sentiments(arts):
+    from fake_server import _sentiment
+    from schemas import SentimentImpact
+    return [SentimentImpact(**_sentiment({"url": a.url, "title": a.title})) for a in arts]
+
+
+def suite_parse(sizes, years, repeat, server):
+    from tools import _parse_gdelt
+    out = []
+    for n in sizes:
+        data = fixtures.gdelt_fixture(n)
+        out.append(measure("parse_gdelt", {"articles": n}, lambda: _parse_gdelt(data) and None, repeat))
+    for y in years:
+        out.append(measure("parse_stooq_csv", {"years": y}, lambda: _series(y) and None, repeat))
+    return out
+
+
+def suite_events(sizes, years, repeat, server):
+    from schemas import EventReturnIn
+    from tools import compute_event_returns
+    out = []
+    for y in years:
+        series = _series(y)
+        for n in sizes:
+            inp = EventReturnIn(prices=series, articles=_articles(n), window_days=1, windows=[1, 3, 5])
+            out.append(measure("compute_event_returns", {"articles": n, "years": y},
+                               lambda: compute_event_returns(inp) and None, repeat))
+    return out
+
+
+def suite_dedup(sizes, years, repeat, server):
+    from dedup import cluster_articles
+    out = []
+    for n in sizes:
+        arts = _articles(n)
+
+        def run():
+            dups, _ = cluster_articles(arts, 0.9)
+            return {"duplicates": len(dups)}
+
+        out.append(measure("cluster_articles", {"articles": n}, run, repeat))
+    return out
+
+
+def suite_views(sizes, years, repeat, server):
+    from schemas import GraphState, UserRequest
+    from views import ArticleTable, impact_view
+    from llm_utils import estimate_tokens
+    out = []
+    for n in sizes:
+        arts = _articles(n)
+        state = GraphState(user_request=UserRequest(ticker="AMZN.US", company_name="Amazon"),
+                           articles=arts, sentiments=_sentiments(arts))
+
+        def run():
+            return {"tokens": estimate_tokens(impact_view(state, ArticleTable(state)))}
+
+        out.append(measure("impact_view", {"articles": n}, run, repeat))
+    return out
+
+
+def suite_llm(sizes, years, repeat, server):
+    import metrics
+    from nodes import get_llm, article_payload, _sj
+    from prompts import sentiment_prompt
+    from schemas import SentimentImpact
+    from llm_utils import invoke_and_parse
+    out = []
+    prompt = sentiment_prompt().format(article_json=_sj(article_payload(_articles(10)[0])))
+    base = server.config.malformed_rate
+    for rate in sorted({0.0, 0.2, base}):
+        server.config.malformed_rate = rate
+
+        def run():
+            with metrics.run() as m:
+                invoke_and_parse(get_llm(), SentimentImpact, prompt)
+            st = m.to_dict()["nodes"].get("-", {})
+            return {"attempts": st.get("llm_calls", 0), "parse_failures": st.get("parse_failures", 0)}
+
+        out.append(measure("invoke_and_parse", {"malformed_rate": rate}, run, repeat))
+    server.config.malformed_rate = base
+    return out
+
+
+def _planned(n: int):
+    from nodes import planner_node
+    from schemas import GraphState, UserRequest
+    state = GraphState(user_request=UserRequest(ticker="AMZN.US", company_name="Amazon", max_articles=n))
+    return state.model_copy(update=planner_node(state))
+
+
+def suite_nodes(sizes, years, repeat, server):
+    import nodes
+    from tools import GDELT_MAX_RECORDS
+    out = []
+
+    def step(state, fn):
+        return state.model_copy(update=fn(state))
+
+    for n in sizes:
+        server.config.gdelt_articles = n
+        state = _planned(min(n, GDELT_MAX_RECORDS))
+        out.append(measure("node.gdelt_search", {"articles": n},
+                           lambda: nodes.gdelt_search_node(state) and None, repeat))
+        state = step(state, nodes.gdelt_search_node)
+        state = step(state, nodes.stooq_prices_node)
+        out.append(measure("node.dedup", {"articles": len(state.articles)},
+                           lambda: nodes.dedup_node(state) and None, repeat))
+        state = step(state, nodes.dedup_node)
+        out.append(measure("node.event_returns", {"articles": len(state.articles)},
+                           lambda: nodes.event_returns_node(state) and None, repeat))
+        state = step(state, nodes.event_returns_node)
+        out.append(measure("node.sentiment_map", {"articles": len(state.articles)},
+                           lambda: nodes.sentiment_agent_map_node(state) and None, repeat))
+        state = step(state, nodes.sentiment_agent_map_node)
+        out.append(measure("node.impact", {"articles": len(state.articles)},
+                           lambda: nodes.impact_estimator_node(state) and None, repeat))
+        state = step(state, nodes.impact_estimator_node)
+        out.append(measure("node.writer", {"articles": len(state.articles)},
+                           lambda: nodes.reviewer_writer_node(state) and None, repeat))
+
+    for y in years:
+        server.config.price_years = y
+        state = _planned(10)
+        # окно запроса — lookback + 10 дней; годы фикстуры влияют только на размер ответа стенда
+        out.append(measure("node.stooq_prices", {"years": y},
+                           lambda: nodes.stooq_prices_node(state) and None, repeat))
+    server.config.price_years = 1
+    return out
+
+
+def suite_e2e(sizes, years, repeat, server):
+    import metrics
+    from aio import aclose
+    from graph import build_graph
+    from schemas import GraphState, UserRequest
+
+    def summary(m):
+        d = m.to_dict()["nodes"].values()
+        return {
+            "llm_calls": sum(x["llm_calls"] for x in d),
+            "prompt_tokens": sum(x["prompt_tokens"] for x in d),
+            "completion_tokens": sum(x["completion_tokens"] for x in d),
+            "hedges": sum(x["hedges"] for x in d),
+            "degraded": sum(x["degraded"] for x in d),
+        }
+
+    out = []
+    app, aapp = build_graph(), build_graph(use_async=True)
+    # один loop на все async-замеры: клиенты ChatOpenAI/httpx привязаны к loop, как и в проде
+    loop = asyncio.new_event_loop()
+    for n in sizes:
+        server.config.gdelt_articles = n
+        req = UserRequest(ticker="AMZN.US", company_name="Amazon", max_articles=min(n, 250))
+
+        def run_sync():
+            with metrics.run() as m:
+                app.invoke(GraphState(user_request=req))
+            return summary(m)
+
+        async def arun():
+            with metrics.run() as m:
+                await aapp.ainvoke(GraphState(user_request=req))
+            return summary(m)
+
+        out.append(measure("e2e.sync", {"articles": n}, run_sync, repeat))
+        out.append(measure("e2e.async", {"articles": n}, lambda: loop.run_until_complete(arun()), repeat))
+    loop.run_until_complete(aclose())
+    loop.close()
+    return out
+
+
+def _git(*args) -> str:
+    try:
+        r = subprocess.run(["git", *args], cwd=Path(__file__).parent, capture_output=True, text=True)
+        return r.stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(args) -> dict:
+    cfg = FakeServerConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, per_token_ms=args.per_token_ms,
+        error_rate=args.error_rate, malformed_rate=args.malformed_rate,
+        slow_rate=args.slow_rate, slow_ms=args.slow_ms, gdelt_latency_ms=args.gdelt_ms,
+    )
+    server = serve(cfg)
+    _bench_env(server.base_url)
+
+    quick = args.quick
+    sizes = {
+        "parse": (10, 1000) if quick else fixtures.GDELT_SIZES,
+        "events": (10, 1000) if quick else fixtures.GDELT_SIZES,
+        "dedup": (100, 1000) if quick else fixtures.GDELT_SIZES,
+        "views": (100, 1000) if quick else fixtures.GDELT_SIZES,
+        "llm": (),
+        "nodes": (10, 100) if quick else (10, 100, 1000),
+        "e2e": (10, 100) if quick else (10, 100, 1000),
+    }
+    years = (1, 30) if quick else fixtures.PRICE_YEARS
+    only = [s for s in (args.only.split(",") if args.only else SUITES) if s]
+
+    results = []
+    t0 = time.perf_counter()
+    try:
+        for name in only:
+            fn = globals()[f"suite_{name}"]
+            results += fn(sizes[name], years, args.repeat, server)
+    finally:
+        server.shutdown()
+
+    record = {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "server": cfg.model_dump(),
+        "suites": only,
+        "quick": quick,
+        "wall_s": round(time.perf_counter() - t0, 3),
+        "fake_server": server.stats,
+        "results": results,
+    }
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with RESULTS_PATH.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"[bench] {len(results)} results -> {RESULTS_PATH} ({record['commit']}"
+          f"{'+dirty' if record['dirty'] else ''})")
+    return record
+
+
+def _load() -> list[dict]:
+    if not RESULTS_PATH.exists():
+        return []
+    with RESULTS_PATH.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(a: str | None, b: str | None):
+    runs = _load()
+
+    def pick(prefix, default_idx):
+        if prefix is None:
+            return runs[default_idx] if len(runs) >= -default_idx else None
+        found = [r for r in runs if r["commit"].startswith(prefix)]
+        return found[-1] if found else None
+
+    ra, rb = pick(a, -2), pick(b, -1)
+    if ra is None or rb is None:
+        sys.exit("[bench] nothing to compare: need two runs in " + str(RESULTS_PATH))
+
+    def key(r):
+        return r["name"], json.dumps(r["params"], sort_keys=True)
+
+    base = {key(r): r for r in ra["results"]}
+    print(f"{'benchmark':<24} {'params':<36} {ra['commit']:>10} {rb['commit']:>10}  ratio")
+    for r in rb["results"]:
+        old = base.get(key(r))
+        if old is None or not old["median_s"] or not r["median_s"]:
+            continue
+        ratio = r["median_s"] / old["median_s"]
+        flag = "  <-- slower" if ratio > 1.1 else ""
+        print(f"{r['name']:<24} {key(r)[1]:<36} {old['median_s'] * 1000:8.2f}ms "
+              f"{r['median_s'] * 1000:8.2f}ms  {ratio:5.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="lab1/bench.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="прогнать бенчмарки на локальном стенде")
+    r.add_argument("--quick", action="store_true", help="меньшие размеры фикстур")
+    r.add_argument("--only", default="", help=f"наборы через запятую: {','.join(SUITES)}")
+    r.add_argument("--repeat", type=int, default=5)
+    r.add_argument("--latency-ms", type=float, default=50.0)
+    r.add_argument("--jitter-ms", type=float, default=10.0)
+    r.add_argument("--per-token-ms", type=float, default=0.0)
+    r.add_argument("--error-rate", type=float, default=0.0)
+    r.add_argument("--malformed-rate", type=float, default=0.0)
+    r.add_argument("--slow-rate", type=float, default=0.0, help="доля ответов LLM с хвостовой задержкой")
+    r.add_argument("--slow-ms", type=float, default=0.0)
+    r.add_argument("--gdelt-ms", type=float, default=0.0, help="задержка ответа GDELT на шард")
+
+    c = sub.add_parser("compare", help="сравнить медианы двух прогонов")
+    c.add_argument("a", nargs="?")
+    c.add_argument("b", nargs="?")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args.a, args.b)
+
+
+if __name__ == "__main__":
+    main()
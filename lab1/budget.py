@@ -0,0 +1,68 @@
+"""
+Бюджет времени прогона. Дедлайн лежит в contextvar (как метрики прогона в
+metrics.py): его видят узлы графа и потоки metrics.submit. Таймаут каждого
+LLM-вызова — остаток бюджета, но не больше LLM_TIMEOUT; оценка тональности
+оставляет долю RUN_BUDGET_RESERVE на impact и writer (stage). Кто не успел —
+DeadlineExceeded, и узел подставляет локальную оценку вместо ответа LLM.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from config import LLM_TIMEOUT, RUN_BUDGET_S
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("lab1_deadline", default=None)
+_total: contextvars.ContextVar[float] = contextvars.ContextVar("lab1_budget", default=0.0)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Бюджет прогона (этапа) исчерпан: повторять вызов бессмысленно."""
+
+
+@contextmanager
+def run_budget(seconds: float = RUN_BUDGET_S):
+    """Бюджет на прогон графа; seconds <= 0 — без бюджета, только LLM_TIMEOUT."""
+    if seconds <= 0:
+        yield
+        return
+    t1 = _deadline.set(time.monotonic() + seconds)
+    t2 = _total.set(seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(t1)
+        _total.reset(t2)
+
+
+@contextmanager
+def stage(reserve: float):
+    """Дедлайн этапа: конец бюджета минус доля reserve на следующие этапы."""
+    d = _deadline.get()
+    if d is None:
+        yield
+        return
+    token = _deadline.set(d - _total.get() * reserve)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+def call_timeout() -> tuple[float, bool]:
+    """(таймаут вызова, урезан ли он бюджетом); бюджета не осталось — DeadlineExceeded."""
+    left = remaining()
+    if left is None or left >= LLM_TIMEOUT:
+        return LLM_TIMEOUT, False
+    if left <= 0:
+        raise DeadlineExceeded("run budget exhausted")
+    return left, True
+
+
+def missed(e: BaseException) -> bool:
+    """Вызов не уложился в свой дедлайн (бюджет или LLM_TIMEOUT)."""
+    return isinstance(e, TimeoutError) or "Timeout" in type(e).__name__
@@ -0,0 +1,111 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TTLCache:
+    """
+    LRU-кэш в памяти с TTL на запись и опциональным sqlite-бэкендом
+    (второй уровень, переживает перезапуск). Значения должны сериализоваться в JSON.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, path: str | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._mem: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "key TEXT PRIMARY KEY, value TEXT, expires REAL, atime REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS kv_atime ON kv(atime)")
+            self._db.commit()
+            self._rows = self._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def _put_mem(self, key: str, expires: float, value):
+        self._mem[key] = (expires, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str, default=None):
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM kv WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._db.execute("UPDATE kv SET atime = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._put_mem(key, row[1], value)
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value, ttl: float | None = None):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put_mem(key, expires, value)
+            if self._db is None:
+                return
+            exists = self._db.execute("SELECT 1 FROM kv WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires, atime) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires, now),
+            )
+            if exists is None:
+                self._rows += 1
+            if self._rows > self.maxsize:
+                self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float):
+        # под self._lock: пачкой до 90% maxsize, чтобы не чистить на каждой записи;
+        # сначала протухшие, затем самые давние по доступу (индекс kv_atime)
+        target = int(self.maxsize * 0.9)
+        cur = self._db.execute("DELETE FROM kv WHERE expires <= ?", (now,))
+        self.evictions += cur.rowcount
+        self._rows -= cur.rowcount
+        if self._rows > target:
+            cur = self._db.execute(
+                "DELETE FROM kv WHERE key IN (SELECT key FROM kv ORDER BY atime LIMIT ?)",
+                (self._rows - target,),
+            )
+            self.evictions += cur.rowcount
+        self._rows = self._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "size": len(self._mem),
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,98 @@
+"""
+Каскад оценки тональности: сначала словарь (lexicon.py), в LLM — только
+статьи, где словарь не уверен (confidence < SENTIMENT_CASCADE_CONFIDENCE),
+и важные (importance >= SENTIMENT_CASCADE_IMPORTANCE: размер кластера
+почти-дубликатов, +2 за существенное событие в заголовке).
+
+Доля SENTIMENT_CASCADE_AUDIT решённых локально статей всё равно уходит в
+LLM (выбор по хэшу url — воспроизводимо): в отчёт идёт ответ LLM, а пара
+«словарь/LLM» копится в статистике согласия по корзинам confidence — по ней
+подбирается порог (stats()).
+"""
+import hashlib
+import threading
+from collections import defaultdict
+
+from config import SENTIMENT_CASCADE_CONFIDENCE, SENTIMENT_CASCADE_IMPORTANCE, SENTIMENT_CASCADE_AUDIT
+from lexicon import is_material, local_sentiment
+from schemas import SentimentImpact
+import metrics
+
+
+def importance(d: dict, weight: int) -> int:
+    return weight + (2 if is_material(d) else 0)
+
+
+def _audited(url: str) -> bool:
+    h = int.from_bytes(hashlib.sha256(url.encode("utf-8")).digest()[:4], "big")
+    return h / 2 ** 32 < SENTIMENT_CASCADE_AUDIT
+
+
+def route(d: dict, weight: int = 1) -> tuple[SentimentImpact, bool, bool]:
+    """(оценка словаря, отправить в LLM, сверка: локальное решение тоже уходит в LLM)."""
+    s = local_sentiment(d, source="lexicon")
+    escalate = s.confidence < SENTIMENT_CASCADE_CONFIDENCE or importance(d, weight) >= SENTIMENT_CASCADE_IMPORTANCE
+    return s, escalate, not escalate and _audited(d.get("url") or "")
+
+
+class _Stats:
+    """Процессные счётчики каскада и согласия словаря с LLM по корзинам confidence."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local = 0
+        self.escalated = 0
+        # корзина confidence (0.6, 0.7, ...) -> [сверено, совпал label, сумма |Δpolarity|]
+        self.buckets = defaultdict(lambda: [0, 0, 0.0])
+
+    def routed(self, local: int, escalated: int):
+        with self._lock:
+            self.local += local
+            self.escalated += escalated
+
+    def compare(self, lex: SentimentImpact, llm: SentimentImpact) -> bool:
+        agreed = lex.sentiment == llm.sentiment
+        with self._lock:
+            b = self.buckets[min(0.9, int(lex.confidence * 10) / 10)]
+            b[0] += 1
+            b[1] += agreed
+            b[2] += abs(lex.polarity - llm.polarity)
+        return agreed
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            n = sum(b[0] for b in self.buckets.values())
+            agreed = sum(b[1] for b in self.buckets.values())
+            total = self.local + self.escalated
+            return {
+                "local": self.local,
+                "escalated": self.escalated,
+                "local_share": round(self.local / total, 3) if total else 0.0,
+                "audited": n,
+                "agreement": round(agreed / n, 3) if n else None,
+                "by_confidence": {
+                    f"{k:.1f}": {"n": b[0], "agreement": round(b[1] / b[0], 3),
+                                 "mean_abs_polarity_diff": round(b[2] / b[0], 3)}
+                    for k, b in sorted(self.buckets.items())
+                },
+            }
+
+
+_stats = _Stats()
+
+
+def record(lex: SentimentImpact, llm: SentimentImpact):
+    """Сверка для статьи из выборки; подмена по дедлайну — не ответ LLM, пропускаем."""
+    if llm.source != "llm":
+        return
+    metrics.agreement("sentiment_cascade", 1, int(_stats.compare(lex, llm)))
+
+
+def routed(local: int, escalated: int):
+    """local — решено словарём (в т.ч. ушедшие на сверку), escalated — отправлено в LLM."""
+    _stats.routed(local, escalated)
+    metrics.cache("sentiment_cascade", hits=local, misses=escalated)
+
+
+def stats() -> dict:
+    return _stats.to_dict()
@@ -0,0 +1,85 @@
+"""
+SQLite-чекпойнтер для LangGraph: состояние графа сохраняется после каждого
+шага, и прогон с тем же thread_id продолжается с последнего завершённого
+узла (graph.invoke_resumable). Узлы, успевшие отработать в шаге, где упал
+соседний, повторно не запускаются — их записи лежат в writes.
+
+Хранилище — SqliteSaver / AsyncSqliteSaver из langgraph-checkpoint-sqlite;
+здесь только сериализатор для типов проекта и открытие соединения.
+AsyncSqliteSaver ходит в базу через aiosqlite и цикл событий не блокирует.
+"""
+import sqlite3
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+
+import aiosqlite
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from pydantic import BaseModel
+
+import schemas
+from price_series import PriceSeries
+
+_PRICES = "price_series"
+
+
+def _map_channels(checkpoint: Any, fn) -> Any:
+    if not isinstance(checkpoint, dict) or "channel_values" not in checkpoint:
+        return checkpoint
+    return {**checkpoint, "channel_values": {k: fn(v) for k, v in checkpoint["channel_values"].items()}}
+
+
+def _pack(v: Any) -> Any:
+    return {_PRICES: v.to_bytes()} if isinstance(v, PriceSeries) else v
+
+
+def _unpack(v: Any) -> Any:
+    if isinstance(v, dict) and v.keys() == {_PRICES}:
+        return PriceSeries.from_bytes(v[_PRICES])
+    return v
+
+
+class _Serde(JsonPlusSerializer):
+    """
+    msgpack, как по умолчанию в LangGraph, но модели schemas разрешены явно,
+    а PriceSeries (array-колонки, msgpack их не знает) пишется своим
+    бинарным форматом — без pickle: отдельной записью (writes) или, внутри
+    чекпойнта, байтами в channel_values.
+    """
+
+    def __init__(self):
+        models = [(schemas.__name__, name) for name, obj in vars(schemas).items()
+                  if isinstance(obj, type) and issubclass(obj, BaseModel)]
+        super().__init__(allowed_msgpack_modules=models)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if isinstance(obj, PriceSeries):
+            return _PRICES, obj.to_bytes()
+        return super().dumps_typed(_map_channels(obj, _pack))
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        if data[0] == _PRICES:
+            return PriceSeries.from_bytes(data[1])
+        return _map_channels(super().loads_typed(data), _unpack)
+
+
+@contextmanager
+def sqlite_checkpointer(path: str) -> Iterator[SqliteSaver]:
+    """Чекпойнтер для синхронного графа; соединение закрывается на выходе."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # check_same_thread=False безопасен: SqliteSaver сам берёт блокировку
+    conn = sqlite3.connect(path, check_same_thread=False)
+    try:
+        yield SqliteSaver(conn, serde=_Serde())
+    finally:
+        conn.close()
+
+
+@asynccontextmanager
+async def async_sqlite_checkpointer(path: str) -> AsyncIterator[AsyncSqliteSaver]:
+    """Чекпойнтер для async-графа; открывать внутри того цикла, где идёт прогон."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    async with aiosqlite.connect(path) as conn:
+        yield AsyncSqliteSaver(conn, serde=_Serde())
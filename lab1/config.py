@@ -1,7 +1,26 @@
 import os
-from dotenv import load_dotenv, find_dotenv
 
-load_dotenv(find_dotenv(usecwd=True))
+
+def _dotenv_path() -> str | None:
+    # вместо find_dotenv (разбор стека вызовов + импорт python-dotenv на каждый
+    # старт): DOTENV_PATH либо .env в текущем каталоге или выше
+    if os.getenv("DOTENV_PATH"):
+        return os.environ["DOTENV_PATH"]
+    d = os.getcwd()
+    while True:
+        p = os.path.join(d, ".env")
+        if os.path.isfile(p):
+            return p
+        parent = os.path.dirname(d)
+        if parent == d:
+            return None
+        d = parent
+
+
+_env = _dotenv_path()
+if _env:
+    from dotenv import load_dotenv
+    load_dotenv(_env)
 
 BASE_URL = os.getenv("LITELLM_BASE_URL", "http://a6k2.dgx:34000/v1")
 API_KEY = os.getenv("LITELLM_API_KEY", "") or "dummy_key"
@@ -13,6 +32,130 @@ STOOQ_BASE = os.getenv("STOOQ_BASE", "https://stooq.com/q/d/l/")
 
 HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
 HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# лимиты по хостам "host=rate[:burst]" (запросов в секунду); GDELT просит не чаще 1 раза в 5 с
+HTTP_RATE_LIMITS = os.getenv("HTTP_RATE_LIMITS", "api.gdeltproject.org=0.2:1,stooq.com=5:5")
+HTTP_RATE_DEFAULT = os.getenv("HTTP_RATE_DEFAULT", "10:10")
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+# сколько ответов держать для условных запросов (ETag / If-Modified-Since)
+HTTP_CONDITIONAL_CACHE = int(os.getenv("HTTP_CONDITIONAL_CACHE", "256"))
 
 EVENT_WINDOW_DAYS = int(os.getenv("EVENT_WINDOW_DAYS", "1"))
-MAX_ARTICLES = int(os.getenv("MAX_ARTICLES", "30"))
\ No newline at end of file
+# дополнительные окна событийной доходности, например "1,3,5"
+EVENT_WINDOWS = [int(w) for w in os.getenv("EVENT_WINDOWS", "1,3,5").split(",") if w.strip()]
+MAX_ARTICLES = int(os.getenv("MAX_ARTICLES", "30"))
+
+# local — маршрут и нормализация запроса без LLM (LLM только для неоднозначных запросов),
+# llm — планировщик через LLM на каждом шаге
+PLANNER_MODE = os.getenv("PLANNER_MODE", "local")
+
+# parallel — GDELT и Stooq параллельными ветками, react — цикл через planner
+GRAPH_TOPOLOGY = os.getenv("GRAPH_TOPOLOGY", "parallel")
+
+# локальный кэш дневных цен (см. price_store.py); PRICE_STORE_TTL — сколько
+# секунд доверяем бару текущего дня, прежде чем перезапросить его
+PRICE_STORE_ENABLED = os.getenv("PRICE_STORE_ENABLED", "1") == "1"
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", ".cache/prices")
+PRICE_STORE_TTL = float(os.getenv("PRICE_STORE_TTL", "3600"))
+
+# кэш поиска GDELT: окно режется на выровненные срезы (day/hour/week, none — без
+# нарезки), закрытые срезы живут GDELT_CACHE_TTL, текущий — GDELT_OPEN_SLICE_TTL;
+# GDELT_CACHE_PATH="" — только память
+GDELT_CACHE_ENABLED = os.getenv("GDELT_CACHE_ENABLED", "1") == "1"
+GDELT_CACHE_SLICE = os.getenv("GDELT_CACHE_SLICE", "day")
+GDELT_CACHE_TTL = float(os.getenv("GDELT_CACHE_TTL", "86400"))
+GDELT_OPEN_SLICE_TTL = float(os.getenv("GDELT_OPEN_SLICE_TTL", "300"))
+GDELT_CACHE_SIZE = int(os.getenv("GDELT_CACHE_SIZE", "2048"))
+GDELT_CACHE_PATH = os.getenv("GDELT_CACHE_PATH", ".cache/gdelt.sqlite")
+# шардированный поиск (tools._Shards): подряд идущие промахи кэша — один запрос,
+# ответ раскладывается по срезам; упёрся в страницу ArtList (250 записей) —
+# прогон делится пополам, половины идут параллельно, не больше
+# GDELT_SHARD_CONCURRENCY сразу (поверх HTTP_RATE_LIMITS); так max_articles
+# запроса ограничен GDELT_MAX_ARTICLES, а не одной страницей
+GDELT_SHARD_CONCURRENCY = int(os.getenv("GDELT_SHARD_CONCURRENCY", "8"))
+GDELT_MAX_ARTICLES = int(os.getenv("GDELT_MAX_ARTICLES", "1000"))
+
+# персистентный кэш SentimentImpact (ключ — хэш статьи, модели и версии промпта)
+SENTIMENT_CACHE_ENABLED = os.getenv("SENTIMENT_CACHE_ENABLED", "1") == "1"
+SENTIMENT_CACHE_TTL = float(os.getenv("SENTIMENT_CACHE_TTL", str(30 * 86400)))
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "100000"))
+SENTIMENT_CACHE_PATH = os.getenv("SENTIMENT_CACHE_PATH", ".cache/sentiment.sqlite")
+
+# батчевая оценка тональности: до SENTIMENT_BATCH_SIZE статей в одном запросе,
+# пока влезают в SENTIMENT_BATCH_TOKENS (1 — по статье на запрос)
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "10"))
+SENTIMENT_BATCH_TOKENS = int(os.getenv("SENTIMENT_BATCH_TOKENS", "6000"))
+
+# async-путь: общий лимит одновременных HTTP-вызовов на процесс
+# (LLM-вызовы ограничивает адаптивный лимит, см. LLM_CONCURRENCY_*)
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "32"))
+
+# пакетный прогон по списку тикеров: сколько анализов одновременно
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# склейка почти-дубликатов перед оценкой тональности (SimHash по title+snippet);
+# DEDUP_SIMILARITY — доля совпадающих бит хэша, с которой статьи считаются копиями
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.9"))
+
+# компактные представления state для impact/writer: минифицированная таблица
+# топ-PROMPT_VIEW_TOP_K статей по |polarity|*confidence в пределах
+# PROMPT_VIEW_TOKENS (оценка), остальное — агрегатами
+PROMPT_VIEW_TOKENS = int(os.getenv("PROMPT_VIEW_TOKENS", "2500"))
+PROMPT_VIEW_TOP_K = int(os.getenv("PROMPT_VIEW_TOP_K", "20"))
+
+# метрики прогона (metrics.py): JSON на прогон в METRICS_DIR и Prometheus-текст
+# в METRICS_PROM_PATH (textfile-коллектор); пусто — не писать
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", "")
+
+# ограничение формата ответа LLM: json_schema (схема pydantic-модели),
+# json_object или none; если бэкенд отвергает формат (HTTP 400), режим
+# понижается автоматически до конца процесса
+LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "json_schema")
+
+# чекпойнты графа (checkpoint.py): состояние после каждого узла, прогон с тем же
+# thread_id (`--thread-id`, `batch --run-id`) продолжается с места падения;
+# схема таблиц — langgraph-checkpoint-sqlite
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", ".cache/graph_checkpoints.sqlite")
+
+# инкрементальный режим (incremental.py, `--incremental`): снимок по тикеру в
+# INCREMENTAL_DIR, следующий прогон ищет в GDELT только окно с прошлого запуска
+# минус INCREMENTAL_OVERLAP_MIN минут (GDELT индексирует статьи с задержкой)
+INCREMENTAL_DIR = os.getenv("INCREMENTAL_DIR", ".cache/incremental")
+INCREMENTAL_OVERLAP_MIN = int(os.getenv("INCREMENTAL_OVERLAP_MIN", "60"))
+
+# адаптивный лимит одновременных LLM-вызовов (adaptive.py, AIMD): старт с
+# LLM_CONCURRENCY_INITIAL, +1 за «раунд» быстрых ответов до LLM_CONCURRENCY_MAX,
+# x LLM_CONCURRENCY_BACKOFF на 429/5xx/таймаут; ответ медленнее нормы в
+# LLM_LATENCY_TOLERANCE раз — признак очереди на сервере, лимит тоже снижается.
+# Ошибку перегрузки повторяем до LLM_OVERLOAD_RETRIES раз с паузой (Retry-After)
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "6"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "32"))
+LLM_CONCURRENCY_BACKOFF = float(os.getenv("LLM_CONCURRENCY_BACKOFF", "0.5"))
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0"))
+LLM_OVERLOAD_RETRIES = int(os.getenv("LLM_OVERLOAD_RETRIES", "3"))
+
+# бюджет времени прогона (budget.py): таймаут LLM-вызова — остаток бюджета, но
+# не больше LLM_TIMEOUT; оценка тональности оставляет долю RUN_BUDGET_RESERVE
+# на impact и writer. Не успевшие статьи получают локальную оценку
+# (source="fallback"), impact и writer — локальный текст. 0 — без бюджета
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+RUN_BUDGET_S = float(os.getenv("RUN_BUDGET_S", "180"))
+RUN_BUDGET_RESERVE = float(os.getenv("RUN_BUDGET_RESERVE", "0.25"))
+
+# hedged-запросы: если ответа нет дольше квантиля LLM_HEDGE_QUANTILE латентности
+# этого вида запроса (по последним ответам), уходит дубль и берётся первый
+# ответ; при полном лимите параллельности дубль не шлётся. 0 — выключено
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0"))
+
+# каскад оценки тональности (cascade.py): словарь решает сам, если уверен
+# (confidence >= SENTIMENT_CASCADE_CONFIDENCE) и статья не важна (размер
+# кластера дубликатов +2 за существенное событие < SENTIMENT_CASCADE_IMPORTANCE);
+# доля SENTIMENT_CASCADE_AUDIT локальных решений сверяется с LLM
+SENTIMENT_CASCADE_ENABLED = os.getenv("SENTIMENT_CASCADE_ENABLED", "1") == "1"
+SENTIMENT_CASCADE_CONFIDENCE = float(os.getenv("SENTIMENT_CASCADE_CONFIDENCE", "0.6"))
+SENTIMENT_CASCADE_IMPORTANCE = int(os.getenv("SENTIMENT_CASCADE_IMPORTANCE", "3"))
+SENTIMENT_CASCADE_AUDIT = float(os.getenv("SENTIMENT_CASCADE_AUDIT", "0.1"))
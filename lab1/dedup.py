@@ -0,0 +1,78 @@
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from schemas import Article
+
+BITS = 64
+_WORD_RE = re.compile(r"\w+", re.U)
+# хвост синдицированного заголовка: " - Reuters", " | Yahoo Finance"
+_SOURCE_SUFFIX_RE = re.compile(r"\s+[-|–—]\s+[^-|–—]{1,40}$")
+
+
+def _features(text: str) -> Counter:
+    words = _WORD_RE.findall(text.lower())
+    feats = Counter(words)
+    feats.update(" ".join(p) for p in zip(words, words[1:]))
+    return feats
+
+
+def simhash(text: str) -> int:
+    """64-битный SimHash по словам и биграммам (веса — частоты)."""
+    acc = [0] * BITS
+    for feat, w in _features(text).items():
+        h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(BITS):
+            acc[i] += w if h >> i & 1 else -w
+    return sum(1 << i for i in range(BITS) if acc[i] > 0)
+
+
+def article_text(a: Article) -> str:
+    return f"{_SOURCE_SUFFIX_RE.sub('', a.title)} {a.snippet or ''}"
+
+
+def cluster_articles(articles: List[Article], similarity: float
+                     ) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """
+    Склейка почти-дубликатов: статьи с расстоянием Хэмминга SimHash
+    <= (1 - similarity) * 64 попадают в кластер первой такой статьи.
+    Кандидаты ищутся по полосам хэша: при d допустимых отличиях хотя бы
+    одна из d+1 полос совпадает целиком, так что поиск точный.
+
+    Возвращает (дубликат url -> url представителя, представитель url -> размер кластера).
+    """
+    max_dist = max(0, round((1 - similarity) * BITS))
+    n_bands = max_dist + 1
+    width = BITS // n_bands
+    bands = [(i * width, BITS if i == n_bands - 1 else (i + 1) * width) for i in range(n_bands)]
+
+    index: List[Dict[int, List[Tuple[int, str]]]] = [{} for _ in bands]
+    duplicates: Dict[str, str] = {}
+    weights: Dict[str, int] = {}
+
+    for a in articles:
+        if a.url in duplicates or a.url in weights:
+            continue
+        h = simhash(article_text(a))
+        keys = [(h >> lo) & ((1 << (hi - lo)) - 1) for lo, hi in bands]
+
+        rep = None
+        for b, k in enumerate(keys):
+            for rh, rurl in index[b].get(k, ()):
+                if bin(h ^ rh).count("1") <= max_dist:
+                    rep = rurl
+                    break
+            if rep:
+                break
+
+        if rep is not None:
+            duplicates[a.url] = rep
+            weights[rep] += 1
+            continue
+
+        weights[a.url] = 1
+        for b, k in enumerate(keys):
+            index[b].setdefault(k, []).append((h, a.url))
+
+    return duplicates, weights
@@ -0,0 +1,83 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# как в исходной версии: ищем торговый день не дальше 6 календарных дней
+MAX_GAP_DAYS = 6
+
+
+def to_ordinal(s: str) -> Optional[int]:
+    try:
+        return datetime.fromisoformat(s).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+class EventReturnEngine:
+    """
+    Событийные доходности по отсортированному ряду (ordinal даты, close).
+    Ряд индексируется один раз; pre/post для каждой уникальной даты события
+    ищутся бинарным поиском, сразу для нескольких окон.
+    """
+
+    def __init__(self, ordinals: Sequence[int], closes: Sequence[float]):
+        if any(a > b for a, b in zip(ordinals, ordinals[1:])):
+            pairs = sorted(zip(ordinals, closes))
+            ordinals = [p[0] for p in pairs]
+            closes = [p[1] for p in pairs]
+        self.ordinals = ordinals
+        self.closes = closes
+
+    def close_on_or_before(self, d: int) -> Optional[float]:
+        i = bisect_right(self.ordinals, d) - 1
+        if i >= 0 and d - self.ordinals[i] <= MAX_GAP_DAYS:
+            return self.closes[i]
+        return None
+
+    def close_on_or_after(self, d: int) -> Optional[float]:
+        i = bisect_left(self.ordinals, d)
+        if i < len(self.ordinals) and self.ordinals[i] - d <= MAX_GAP_DAYS:
+            return self.closes[i]
+        return None
+
+    def touches(self, event: int, windows: Iterable[int], since: int) -> bool:
+        """
+        Зависит ли доходность события от баров с датой >= since (новых или
+        переписанных): pre-бар в этой зоне или post-бар ещё не найден до неё.
+        """
+        for w in windows:
+            if event - w >= since:
+                return True
+            i = bisect_left(self.ordinals, event + w)
+            if i == len(self.ordinals) or self.ordinals[i] >= since:
+                return True
+        return False
+
+    def resolve(self, events: Iterable[int], windows: Iterable[int]
+                ) -> Dict[int, Dict[int, Tuple[Optional[float], Optional[float], Optional[float]]]]:
+        """
+        {window: {event_ordinal: (pre_close, post_close, return_pct)}} —
+        по одному проходу на уникальную дату события и окно.
+        """
+        uniq = sorted(set(events))
+        out = {}
+        for w in dict.fromkeys(windows):
+            res = {}
+            for e in uniq:
+                pre = self.close_on_or_before(e - w)
+                post = self.close_on_or_after(e + w)
+                ret = round((post / pre - 1) * 100, 3) if pre and post else None
+                res[e] = (pre, post, ret)
+            out[w] = res
+        return out
+
+
+def event_ordinals(datetimes: List[str]) -> List[Optional[int]]:
+    """Парсинг дат статей с кэшем: в выдаче GDELT даты сильно повторяются."""
+    cache: Dict[str, Optional[int]] = {}
+    out = []
+    for s in datetimes:
+        if s not in cache:
+            cache[s] = to_ordinal(s)
+        out.append(cache[s])
+    return out
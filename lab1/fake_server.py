@@ -0,0 +1,250 @@
+"""
+Локальный стенд для бенчмарков: OpenAI-совместимый /v1/chat/completions
+и подмены GDELT (/gdelt) и Stooq (/stooq) на фикстурах (fixtures.py).
+
+Задержка, доля ошибок (HTTP 500/429) и доля битого JSON настраиваются
+через FakeServerConfig и меняются на лету (server.config). Только stdlib +
+pydantic: модуль не импортирует config.
+"""
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from pydantic import BaseModel
+
+import fixtures
+
+
+class FakeServerConfig(BaseModel):
+    latency_ms: float = 50.0
+    jitter_ms: float = 10.0
+    # имитация декодирования: + per_token_ms на каждый токен ответа
+    per_token_ms: float = 0.0
+    # хвост латентности: доля slow_rate ответов задерживается ещё на slow_ms
+    slow_rate: float = 0.0
+    slow_ms: float = 0.0
+    error_rate: float = 0.0
+    malformed_rate: float = 0.0
+    # бэкенд без поддержки response_format: 400 на такие запросы
+    reject_response_format: bool = False
+    gdelt_articles: int = 100
+    # задержка ответа /gdelt (шардированный поиск)
+    gdelt_latency_ms: float = 0.0
+    price_years: int = 1
+    seed: int = 0
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _score(url: str) -> tuple[float, float]:
+    # детерминированная «оценка» по url: одинаковые статьи — одинаковый ответ
+    h = hashlib.sha256(url.encode("utf-8")).digest()
+    return round(h[0] / 127.5 - 1, 2), round(0.3 + h[1] / 255 * 0.7, 2)
+
+
+def _sentiment(a: dict) -> dict:
+    pol, conf = _score(a.get("url") or a.get("title") or "")
+    label = "positive" if pol > 0.2 else "negative" if pol < -0.2 else "neutral"
+    return {
+        "url": a.get("url"), "title": a.get("title"),
+        "sentiment": label, "polarity": pol,
+        "expected_impact": {"positive": "up", "negative": "down"}.get(label, "neutral"),
+        "confidence": conf, "rationale": "synthetic",
+    }
+
+
+_IDS_RE = re.compile(r'\["(a\d+)"')
+
+
+def answer(system: str, user: str) -> str:
+    """Ответ по типу промпта (ищем маркеры из prompts.py)."""
+    if "Planner" in system:
+        req = (json.loads(user).get("user_request") or {}) if user.strip().startswith("{") else {}
+        return json.dumps({
+            "normalized_request": req or {"ticker": "AMZN.US", "company_name": "Amazon"},
+            "strategy": "fetch news and prices, compute event returns",
+            "next_call": {"tool_name": "gdelt_search", "tool_args": {}},
+        })
+    if "NewsSentimentAgent" in system:
+        data = json.loads(user)
+        if isinstance(data, list):
+            return json.dumps({"items": [_sentiment(a) for a in data]}, ensure_ascii=False)
+        return json.dumps(_sentiment(data), ensure_ascii=False)
+    if "ImpactEstimatorAgent" in system:
+        ids = _IDS_RE.findall(user)
+        return json.dumps({
+            "strongest_positive": ids[:2], "strongest_negative": ids[2:4],
+            "overall_assessment": "Synthetic assessment. " * 4,
+        })
+    return json.dumps({"window": "synthetic window", "conclusion": "Synthetic conclusion. " * 5})
+
+
+def _split_prompt(messages: list) -> tuple[str, str]:
+    system = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    if system:
+        return system, messages[-1].get("content") or ""
+    # ChatPromptTemplate.format() -> одна строка "System: ...\nHuman: ...";
+    # при перезапросе за ней идут плохой ответ и сообщение об ошибке
+    system, _, user = (messages[0].get("content") or "").partition("\nHuman: ")
+    return system, user
+
+
+def _malformed(text: str, r: float) -> str:
+    kind = int(r * 3)
+    if kind == 0:
+        return text[: max(1, len(text) // 2)]  # обрезанный ответ
+    if kind == 1:
+        return "Sure! Here is the result:\n```json\n" + text.replace('"', "'") + "\n```"
+    return text.rstrip("}") + ",}"  # висячая запятая
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, config: FakeServerConfig):
+        super().__init__(addr, _Handler)
+        self.config = config
+        self.rnd = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"chat": 0, "gdelt": 0, "stooq": 0, "errors": 0, "malformed": 0,
+                      "reasks": 0, "response_format": 0}
+        self._fixtures = {}
+
+    def fixture(self, kind: str, size: int):
+        # разбор 10k-фикстуры на каждый запрос исказил бы замер
+        key = (kind, size)
+        with self.lock:
+            data = self._fixtures.get(key)
+        if data is None:
+            data = fixtures.gdelt_fixture(size) if kind == "gdelt" else fixtures.stooq_fixture(size)
+            with self.lock:
+                self._fixtures[key] = data
+        return data
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.rnd.random()
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeServer
+
+    def setup(self):
+        super().setup()
+        # заголовки и тело уходят отдельными write: без NODELAY Nagle + delayed ACK дают ~40 мс
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: str, ctype: str = "application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # клиент не дождался (таймаут по бюджету, отменённый дубль hedged-запроса)
+            self.close_connection = True
+
+    def _maybe_fail(self) -> bool:
+        cfg = self.server.config
+        if cfg.error_rate and self.server.roll() < cfg.error_rate:
+            self.server.count("errors")
+            status = 429 if self.server.roll() < 0.5 else 500
+            self._send(status, json.dumps({"error": {"message": "synthetic failure"}}))
+            return True
+        return False
+
+    def do_GET(self):
+        u = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        cfg = self.server.config
+        if u.path == "/gdelt":
+            self.server.count("gdelt")
+            if self._maybe_fail():
+                return
+            if cfg.gdelt_latency_ms:
+                time.sleep(cfg.gdelt_latency_ms / 1000)
+            data = fixtures.gdelt_slice(
+                self.server.fixture("gdelt", cfg.gdelt_articles),
+                q.get("startdatetime"), q.get("enddatetime"), int(q.get("maxrecords", 250)),
+            )
+            self._send(200, json.dumps(data, ensure_ascii=False))
+        elif u.path == "/stooq":
+            self.server.count("stooq")
+            if self._maybe_fail():
+                return
+            body = fixtures.stooq_slice(self.server.fixture("stooq", cfg.price_years), q.get("d1"), q.get("d2"))
+            self._send(200, body, "text/csv")
+        else:
+            self._send(404, "{}")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, "{}")
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        cfg = self.server.config
+        self.server.count("chat")
+
+        if req.get("response_format"):
+            self.server.count("response_format")
+            if cfg.reject_response_format:
+                self._send(400, json.dumps({"error": {"message": "response_format is not supported"}}))
+                return
+        messages = req.get("messages") or []
+        if len(messages) > 1 and messages[-2].get("role") == "assistant":
+            self.server.count("reasks")
+        system, user = _split_prompt(messages)
+        content = answer(system, user)
+        if cfg.malformed_rate and self.server.roll() < cfg.malformed_rate:
+            self.server.count("malformed")
+            content = _malformed(content, self.server.roll())
+
+        prompt_tokens = _tokens(system + user)
+        completion_tokens = _tokens(content)
+        delay = cfg.latency_ms + self.server.roll() * cfg.jitter_ms + cfg.per_token_ms * completion_tokens
+        if cfg.slow_rate and self.server.roll() < cfg.slow_rate:
+            delay += cfg.slow_ms
+        time.sleep(delay / 1000)
+        if self._maybe_fail():
+            return
+
+        self._send(200, json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, ensure_ascii=False))
+
+
+def serve(config: FakeServerConfig | None = None, host: str = "127.0.0.1", port: int = 0) -> FakeServer:
+    """Поднимает стенд в фоновом потоке; port=0 — свободный порт (server.base_url)."""
+    server = FakeServer((host, port), config or FakeServerConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
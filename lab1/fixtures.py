@@ -0,0 +1,144 @@
+"""
+Фикстуры GDELT/Stooq для офлайн-бенчмарков (bench.py, fake_server.py).
+
+Данные генерируются детерминированно (seed) в «сыром» формате API — JSON
+ArtList и CSV Stooq — и сохраняются в FIXTURES_DIR, так что повторные прогоны
+и разные коммиты видят одни и те же байты. Если положить в каталог
+настоящую запись (gdelt_<n>.json / stooq_<years>y.csv), она будет
+использована как есть. Модуль не импортирует config: bench.py загружает его
+до того, как выставит переменные окружения.
+"""
+import json
+import math
+import os
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+FIXTURES_DIR = Path(os.getenv("BENCH_FIXTURES_DIR", ".cache/bench/fixtures"))
+
+GDELT_SIZES = (10, 100, 1000, 10000)
+PRICE_YEARS = (1, 10, 30)
+
+_SUBJECTS = ["shares", "stock", "revenue", "profit", "guidance", "cloud unit", "retail sales",
+             "ad business", "logistics network", "AI division", "board", "CEO"]
+_VERBS = ["jump", "slide", "beat estimates", "miss forecasts", "surge", "face probe",
+          "expand", "cut jobs", "hit record", "stall", "rebound", "draw criticism"]
+_TAILS = ["after earnings", "amid antitrust scrutiny", "as demand cools", "on strong outlook",
+          "in Europe", "ahead of holiday season", "after analyst upgrade", "on supply issues"]
+_SOURCES = ["Reuters", "Bloomberg", "Yahoo Finance", "MarketWatch", "CNBC"]
+
+
+def _path(name: str) -> Path:
+    return FIXTURES_DIR / name
+
+
+def _load_or_build(name: str, build) -> str:
+    p = _path(name)
+    if p.exists():
+        return p.read_text(encoding="utf-8")
+    text = build()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(p.suffix + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    tmp.replace(p)
+    return text
+
+
+def _build_gdelt(n: int, days: int, seed: int, company: str) -> str:
+    rnd = random.Random(seed * 1_000_003 + n)
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    arts = []
+    for i in range(n):
+        # ~15% — синдицированные копии уже выданной статьи
+        if arts and rnd.random() < 0.15:
+            src = rnd.choice(arts)
+            title = f"{src['title']} - {rnd.choice(_SOURCES)}"
+            snippet = src["snippet"]
+        else:
+            title = f"{company} {rnd.choice(_SUBJECTS)} {rnd.choice(_VERBS)} {rnd.choice(_TAILS)}"
+            snippet = f"{title}. " + " ".join(rnd.choice(_TAILS) for _ in range(4))
+        seen = end - timedelta(seconds=rnd.randrange(days * 86400))
+        arts.append({
+            "url": f"https://news.example/{seed}/{n}/{i}",
+            "title": title,
+            "seendate": seen.strftime("%Y%m%dT%H%M%SZ"),
+            "sourcecountry": "United States",
+            "language": "English",
+            "snippet": snippet,
+        })
+    return json.dumps({"articles": arts}, ensure_ascii=False)
+
+
+def gdelt_fixture(n: int, days: int = 7, seed: int = 1, company: str = "Amazon") -> dict:
+    """
+    Ответ GDELT ArtList на n статей за последние days дней. Сохранённая
+    фикстура сдвигается на целое число дней так, чтобы последняя статья
+    пришлась на сегодня — иначе старая запись выпала бы из окна поиска.
+    """
+    data = json.loads(_load_or_build(f"gdelt_{n}.json", lambda: _build_gdelt(n, days, seed, company)))
+    fmt = "%Y%m%dT%H%M%SZ"
+    seen = [datetime.strptime(a["seendate"], fmt) for a in data["articles"]]
+    if seen:
+        shift = timedelta(days=(datetime.utcnow().date() - max(seen).date()).days)
+        for a, dt in zip(data["articles"], seen):
+            a["seendate"] = (dt + shift).strftime(fmt)
+    return data
+
+
+def _build_stooq(years: int, seed: int) -> str:
+    rnd = random.Random(seed * 7919 + years)
+    end = date.today()
+    d = end - timedelta(days=int(years * 365.25))
+    close = 100.0
+    lines = ["Date,Open,High,Low,Close,Volume"]
+    while d <= end:
+        if d.weekday() < 5:
+            o = close
+            close = max(1.0, close * math.exp(rnd.gauss(0.0003, 0.02)))
+            hi = max(o, close) * (1 + abs(rnd.gauss(0, 0.005)))
+            lo = min(o, close) * (1 - abs(rnd.gauss(0, 0.005)))
+            vol = int(rnd.lognormvariate(15, 0.4))
+            lines.append(f"{d.isoformat()},{o:.4f},{hi:.4f},{lo:.4f},{close:.4f},{vol}")
+        d += timedelta(days=1)
+    return "\n".join(lines) + "\n"
+
+
+def stooq_fixture(years: int, seed: int = 1) -> str:
+    """
+    CSV Stooq `Date,Open,High,Low,Close,Volume` за years лет до сегодня.
+    Даты сохранённой записи сдвигаются на целое число недель (дни недели
+    не меняются), чтобы ряд доходил до текущей недели.
+    """
+    text = _load_or_build(f"stooq_{years}y.csv", lambda: _build_stooq(years, seed))
+    lines = text.splitlines()
+    if len(lines) < 2:
+        return text
+    last = date.fromisoformat(lines[-1][:10])
+    weeks = (date.today() - last).days // 7
+    if weeks <= 0:
+        return text
+    shift = timedelta(weeks=weeks)
+    out = [lines[0]]
+    for ln in lines[1:]:
+        out.append((date.fromisoformat(ln[:10]) + shift).isoformat() + ln[10:])
+    return "\n".join(out) + "\n"
+
+
+def stooq_slice(csv_text: str, d1: str | None, d2: str | None) -> str:
+    """Как Stooq с d1/d2 (YYYYMMDD): заголовок + строки в диапазоне."""
+    lines = csv_text.splitlines()
+    lo = f"{d1[:4]}-{d1[4:6]}-{d1[6:8]}" if d1 else ""
+    hi = f"{d2[:4]}-{d2[4:6]}-{d2[6:8]}" if d2 else "9999"
+    body = [ln for ln in lines[1:] if lo <= ln[:10] <= hi]
+    return "\n".join([lines[0], *body]) + "\n" if body else "No data"
+
+
+def gdelt_slice(data: dict, start: str | None, end: str | None, limit: int) -> dict:
+    """Как GDELT: статьи с seendate в [start, end] (YYYYMMDDHHMMSS), не больше limit."""
+    def ts(a):
+        return a["seendate"].replace("T", "").replace("Z", "")
+
+    arts = [a for a in data["articles"]
+            if (not start or ts(a) >= start) and (not end or ts(a) <= end)]
+    return {"articles": arts[:limit]}
@@ -1,7 +1,8 @@
-import requests
-from config import GDELT_BASE, HTTP_TIMEOUT
+from config import GDELT_BASE
+from transport import get_json, aget_json
 
 def gdelt_get(params):
-    r = requests.get(GDELT_BASE, params=params, timeout=HTTP_TIMEOUT)
-    r.raise_for_status()
-    return r.json()
\ No newline at end of file
+    return get_json(GDELT_BASE, params)
+
+async def agdelt_get(params):
+    return await aget_json(GDELT_BASE, params)
@@ -1,11 +1,38 @@
 from typing import Literal
 from langgraph.graph import StateGraph, END
+from config import GRAPH_TOPOLOGY
 from schemas import GraphState
+import metrics
 from nodes import (
     planner_node, gdelt_search_node, stooq_prices_node, event_returns_node,
-    sentiment_agent_map_node, impact_estimator_node, reviewer_writer_node
+    sentiment_agent_map_node, impact_estimator_node, reviewer_writer_node, dedup_node,
+    aplanner_node, agdelt_search_node, astooq_prices_node, aevent_returns_node,
+    asentiment_agent_map_node, aimpact_estimator_node, areviewer_writer_node, adedup_node,
 )
 
+NODES = {
+    "planner": planner_node,
+    "gdelt_search": gdelt_search_node,
+    "dedup": dedup_node,
+    "stooq_prices": stooq_prices_node,
+    "event_returns": event_returns_node,
+    "sentiment_map": sentiment_agent_map_node,
+    "impact": impact_estimator_node,
+    "writer": reviewer_writer_node,
+}
+
+# для app.ainvoke / app.astream: те же узлы на asyncio
+ASYNC_NODES = {
+    "planner": aplanner_node,
+    "gdelt_search": agdelt_search_node,
+    "dedup": adedup_node,
+    "stooq_prices": astooq_prices_node,
+    "event_returns": aevent_returns_node,
+    "sentiment_map": asentiment_agent_map_node,
+    "impact": aimpact_estimator_node,
+    "writer": areviewer_writer_node,
+}
+
 ROUTE_MAP = {
     "gdelt_search": "gdelt_search",
     "stooq_prices": "stooq_prices",
@@ -38,28 +65,71 @@ def route_from_planner(state: GraphState) -> Literal[
     return "sentiment_map"
 
 
-def build_graph():
+def build_graph(topology: str = GRAPH_TOPOLOGY, use_async: bool = False, checkpointer=None):
+    """
+    checkpointer (например, checkpoint.sqlite_checkpointer) сохраняет состояние
+    после каждого узла; запускать такой граф — через invoke_resumable.
+    """
     g = StateGraph(GraphState)
 
-    g.add_node("planner", planner_node)
-    g.add_node("gdelt_search", gdelt_search_node)
-    g.add_node("stooq_prices", stooq_prices_node)
-    g.add_node("event_returns", event_returns_node)
-
-    g.add_node("sentiment_map", sentiment_agent_map_node)
-    g.add_node("impact", impact_estimator_node)
-    g.add_node("writer", reviewer_writer_node)
+    for name, fn in (ASYNC_NODES if use_async else NODES).items():
+        g.add_node(name, metrics.instrument(name, fn))
 
     g.set_entry_point("planner")
 
-    g.add_conditional_edges("planner", route_from_planner, ROUTE_MAP)
+    if topology == "parallel":
+        # planner только нормализует запрос; новости и цены качаются параллельно,
+        # sentiment_map стартует сразу после склейки дубликатов
+        g.add_edge("planner", "gdelt_search")
+        g.add_edge("planner", "stooq_prices")
+        g.add_edge("gdelt_search", "dedup")
+        g.add_edge(["dedup", "stooq_prices"], "event_returns")
+        g.add_edge("dedup", "sentiment_map")
+        g.add_edge(["sentiment_map", "event_returns"], "impact")
+    else:
+        g.add_conditional_edges("planner", route_from_planner, ROUTE_MAP)
+
+        g.add_edge("gdelt_search", "dedup")
+        g.add_edge("dedup", "planner")
+        g.add_edge("stooq_prices", "planner")
+        g.add_edge("event_returns", "planner")
 
-    g.add_edge("gdelt_search", "planner")
-    g.add_edge("stooq_prices", "planner")
-    g.add_edge("event_returns", "planner")
+        g.add_edge("sentiment_map", "impact")
 
-    g.add_edge("sentiment_map", "impact")
     g.add_edge("impact", "writer")
     g.add_edge("writer", END)
 
-    return g.compile()
+    return g.compile(checkpointer=checkpointer)
+
+
+def _resume_input(snap, state: GraphState):
+    # None — продолжить с чекпойнта; иначе прогон с нуля
+    if snap.values and snap.values.get("user_request") != state.user_request:
+        raise ValueError(
+            f"thread already holds a run for {snap.values.get('user_request')!r}; "
+            "use another thread_id for a different request"
+        )
+    return None if snap.values else state
+
+
+def invoke_resumable(app, state: GraphState, thread_id: str) -> dict:
+    """
+    app.invoke с чекпойнтами по thread_id. Упавший прогон продолжается с
+    последнего завершённого узла, завершённый отдаётся из чекпойнта без
+    вызовов; новый запрос под тем же thread_id — ValueError.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    snap = app.get_state(config)
+    inp = _resume_input(snap, state)
+    if snap.values and not snap.next:
+        return snap.values
+    return app.invoke(inp, config)
+
+
+async def ainvoke_resumable(app, state: GraphState, thread_id: str) -> dict:
+    config = {"configurable": {"thread_id": thread_id}}
+    snap = await app.aget_state(config)
+    inp = _resume_input(snap, state)
+    if snap.values and not snap.next:
+        return snap.values
+    return await app.ainvoke(inp, config)
@@ -0,0 +1,65 @@
+"""
+Инкрементальный режим для регулярных перезапусков (например, раз в час с
+тем же lookback). По тикеру хранится TickerSnapshot, и следующий прогон:
+- ищет в GDELT только окно с прошлого запуска, старые статьи берёт из снимка;
+- отдаёт в LLM только статьи без оценки в снимке;
+- пересчитывает доходности только там, куда дотянулись новые бары;
+- если ничего не изменилось, берёт ImpactSummary и FinalReport из снимка.
+
+Снимки — JSON в INCREMENTAL_DIR, по файлу на тикер. Другие параметры
+запроса или окна доходностей — снимок не используется, прогон полный.
+"""
+import re
+from pathlib import Path
+
+from config import INCREMENTAL_DIR, EVENT_WINDOWS
+from schemas import GraphState, TickerSnapshot, UserRequest
+
+
+def _path(ticker: str) -> Path:
+    return Path(INCREMENTAL_DIR) / (re.sub(r"[^A-Za-z0-9._-]", "_", ticker) + ".json")
+
+
+def load_snapshot(req: UserRequest) -> TickerSnapshot | None:
+    p = _path(req.ticker)
+    if not p.exists():
+        return None
+    try:
+        snap = TickerSnapshot.model_validate_json(p.read_text(encoding="utf-8"))
+    except ValueError:
+        # битый или старый формат — просто полный прогон
+        return None
+    if snap.request != req or snap.windows != EVENT_WINDOWS:
+        return None
+    return snap
+
+
+def save_snapshot(snap: TickerSnapshot):
+    p = _path(snap.request.ticker)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(snap.model_dump_json(), encoding="utf-8")
+    tmp.replace(p)
+
+
+def initial_state(req: UserRequest) -> GraphState:
+    """Входное состояние графа со снимком прошлого прогона, если он подходит."""
+    return GraphState(user_request=req, snapshot=load_snapshot(req))
+
+
+def snapshot_from(req: UserRequest, out: dict) -> TickerSnapshot:
+    """Снимок из итогового состояния графа (результат app.invoke)."""
+    prices = out.get("prices")
+    has_bars = prices is not None and len(prices) > 0
+    er = out.get("event_returns")
+    return TickerSnapshot(
+        request=req,
+        windows=EVENT_WINDOWS,
+        searched_through=out.get("searched_through") or "",
+        articles=out.get("articles") or [],
+        sentiments=out.get("sentiments") or [],
+        event_returns=er.event_returns if er else [],
+        bars_through=prices.dates[-1] if has_bars else None,
+        last_close=prices.close[-1] if has_bars else None,
+        report=out.get("report"),
+    )
@@ -0,0 +1,99 @@
+"""
+Локальная оценка тональности заголовка по финансовому словарю (в духе
+Loughran-McDonald, сокращённо). Грубо, но мгновенно и без сети: первая
+ступень каскада (cascade.py) и подмена ответа LLM, не уложившегося в
+дедлайн (budget.py).
+"""
+import re
+
+from schemas import SentimentImpact
+
+POSITIVE = frozenset("""
+beat beats beating record records surge surges surged soar soars soared jump jumps jumped
+rally rallies rallied gain gains gained rise rises rising rose climb climbs climbed
+growth grow grows grew profit profits profitable upgrade upgrades upgraded outperform
+outperforms strong stronger strongest boost boosts boosted expand expands expansion
+win wins won award awarded approve approves approved approval launch launches launched
+breakthrough innovative innovation partnership partners deal deals acquire acquires
+exceed exceeds exceeded raise raises raised bullish optimism optimistic recover recovers
+recovery rebound rebounds rebounded dividend buyback buybacks success successful
+""".split())
+
+NEGATIVE = frozenset("""
+miss misses missed fall falls fell plunge plunges plunged drop drops dropped slump slumps
+slumped tumble tumbles tumbled sink sinks sank decline declines declined loss losses
+lose loses lost weak weaker weakest downgrade downgrades downgraded underperform cut cuts
+layoff layoffs fire fires fired lawsuit lawsuits sue sues sued probe probes investigation
+fine fined penalty penalties recall recalls recalled breach breaches hack hacked outage
+outages strike strikes fraud bankruptcy bankrupt default defaults warning warns warned
+risk risks bearish concern concerns crisis delay delays delayed halt halts halted ban
+bans banned antitrust scandal resign resigns resigned slowdown shortfall
+""".split())
+
+# шаблонные заголовки без новости: сделки фондов, котировки, подборки
+_BOILERPLATE_RE = re.compile(
+    r"\b(?:shares? (?:of|in)|(?:stake|position|holdings?) in|stock (?:price|quote|forecast)|13f"
+    r"|market (?:cap|wrap|update)|live updates?|what to (?:know|watch)|stocks? to (?:watch|buy)"
+    r"|pre-?market movers?|options? activity|short interest|trading volume)\b",
+    re.I,
+)
+# существенные события: важнее для отчёта, чем уверенность словаря
+_MATERIAL_RE = re.compile(
+    r"\b(?:earnings|guidance|merger|acquisitions?|acquires?|takeover|buyout|lawsuit|antitrust"
+    r"|fda|sec|bankrupt\w*|ceo|cfo|layoffs?|recall|dividend|buyback|split)\b",
+    re.I,
+)
+
+_NEGATIONS = frozenset({"not", "no", "never", "without", "fails", "failed", "isn't", "doesn't", "didn't"})
+_WORD_RE = re.compile(r"[a-z][a-z']*")
+
+
+def score(text: str) -> tuple[int, int]:
+    """(позитивных, негативных) слов; отрицание в двух словах до слова меняет знак."""
+    pos = neg = 0
+    words = _WORD_RE.findall(text.lower())
+    for i, w in enumerate(words):
+        hit = 1 if w in POSITIVE else -1 if w in NEGATIVE else 0
+        if not hit:
+            continue
+        if any(p in _NEGATIONS for p in words[max(0, i - 2):i]):
+            hit = -hit
+        if hit > 0:
+            pos += 1
+        else:
+            neg += 1
+    return pos, neg
+
+
+def is_material(d: dict) -> bool:
+    """Заголовок о существенном событии (отчётность, сделки, суды, руководство)."""
+    return bool(_MATERIAL_RE.search(d.get("title") or ""))
+
+
+def local_sentiment(d: dict, source: str = "fallback") -> SentimentImpact:
+    """
+    SentimentImpact по словарю; confidence растёт с числом и согласием
+    совпадений. Шаблонный заголовок без слов словаря — уверенно нейтрален.
+    """
+    english = (d.get("language") or "English").lower() in ("english", "en", "eng")
+    pos, neg = score(f"{d.get('title') or ''} {d.get('snippet') or ''}") if english else (0, 0)
+    hits = pos + neg
+    polarity = max(-1.0, min(1.0, (pos - neg) / max(2, hits)))
+    boilerplate = False
+    if hits:
+        confidence = hits / (hits + 2) * abs(pos - neg) / hits
+    elif english and _BOILERPLATE_RE.search(d.get("title") or ""):
+        boilerplate = True
+        confidence = 0.8
+    else:
+        # ни одного слова словаря: скорее нейтрально, но без уверенности
+        confidence = 0.3 if english else 0.0
+    label = "positive" if polarity > 0.2 else "negative" if polarity < -0.2 else "neutral"
+    return SentimentImpact(
+        url=d.get("url"), title=d.get("title"),
+        sentiment=label, polarity=round(polarity, 2),
+        expected_impact={"positive": "up", "negative": "down"}.get(label, "neutral"),
+        confidence=round(confidence, 2),
+        rationale="lexicon: boilerplate" if boilerplate else f"lexicon: +{pos}/-{neg}",
+        source=source,
+    )
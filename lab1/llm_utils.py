@@ -1,43 +1,456 @@
+import ast
+import asyncio
+import contextvars
+import json
+import logging
 import re
+import threading
 import time
+from concurrent.futures import Future, as_completed, wait
 from typing import Type, TypeVar
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+from adaptive import is_overload, llm_limiter
+from config import LLM_RESPONSE_FORMAT, LLM_OVERLOAD_RETRIES, LLM_HEDGE_QUANTILE
+import budget
+from prompts import REASK_TEMPLATE
+from transport import retry_delay
+import metrics
 
 T = TypeVar("T", bound=BaseModel)
+log = logging.getLogger(__name__)
+
+_THINK_RE = re.compile(r"<think>.*?(</think>|$)", re.S | re.I)
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)(```|$)", re.S | re.I)
+# хвост обрезанного ответа: висящий ключ без значения, недописанный литерал;
+# число на месте обрыва могло быть длиннее ("0." из "0.85") — его тоже отбрасываем
+_DANGLING_KEY_RE = re.compile(r'([,{])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+_PARTIAL_VALUE_RE = re.compile(r":\s*(?:t|tr|tru|f|fa|fal|fals|n|nu|nul|-?\d[\d.eE+-]*|-)$")
+_PARTIAL_ITEM_RE = re.compile(r"([,\[])\s*(?:t|tr|tru|f|fa|fal|fals|n|nu|nul|-?\d[\d.eE+-]*|-)$")
+
+
+def estimate_tokens(text: str) -> int:
+    # грубая оценка без токенизатора: ~4 символа на токен
+    return len(text) // 4 + 1
+
 
-_JSON_RE = re.compile(r"\{.*\}", re.S)
+def _strip_wrappers(text: str) -> str:
+    """<think>-блоки (в т.ч. без открывающего тега) и markdown-ограждения."""
+    if "</think>" in text and "<think>" not in text:
+        text = text.split("</think>", 1)[1]
+    text = _THINK_RE.sub("", text)
+    m = _FENCE_RE.search(text)
+    return m.group(1) if m else text
 
 
 def extract_json(text: str) -> str:
-    m = _JSON_RE.search(text)
-    if not m:
+    """
+    Первый JSON-объект/массив по балансу скобок (строки учитываются), а не
+    жадным regex: хвостовой текст и второй объект не попадают в результат.
+    Незакрытый (обрезанный) объект возвращается до конца текста.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
         raise ValueError(f"No JSON object found:\n{text[:400]}")
-    return m.group(0)
+    start = min(starts)
 
+    depth, in_str, esc = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
 
-def invoke_and_parse(llm, model_cls: Type[T], prompt, tries: int = 4) -> T:
-    last_err: Exception | None = None
 
-    for i in range(tries):
-        msg = llm.invoke(prompt)
-        raw = (msg.content or "").strip()
+def repair_json(s: str) -> str:
+    """
+    Чинит типичные дефекты: висячие запятые, незакрытые строки и скобки
+    (обрезанный ответ), висящий ключ без значения.
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    in_str, esc = False, False
+
+    def drop_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ",":
+            out.pop()
 
-        if not raw:
-            last_err = ValueError("Empty LLM content")
-            time.sleep(0.4 * (2 ** i))
+    for ch in s:
+        if in_str:
+            out.append(ch)
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
             continue
+        if ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            drop_trailing_comma()
+            if stack:
+                stack.pop()
+        out.append(ch)
 
+    text = "".join(out)
+    if in_str:
+        text = (text[:-1] if esc else text) + '"'
+    if stack:
+        text = text.rstrip()
+        if stack[-1] == "}":
+            text = _DANGLING_KEY_RE.sub(r"\1", _PARTIAL_VALUE_RE.sub(":", text))
+        else:
+            text = _PARTIAL_ITEM_RE.sub(r"\1", text)
+        text = text.rstrip().rstrip(",")
+        text += "".join(reversed(stack))
+    return text
+
+
+def _loads_lenient(candidate: str):
+    err: Exception | None = None
+    for attempt in (candidate, repair_json(candidate)):
         try:
-            return model_cls.model_validate_json(raw)
+            return json.loads(attempt)
+        except ValueError as e:
+            err = err or e
+    # питоновский литерал: одинарные кавычки, True/False/None
+    try:
+        data = ast.literal_eval(candidate)
+        if isinstance(data, (dict, list)):
+            return data
+    except (ValueError, SyntaxError):
+        pass
+    raise ValueError(f"Invalid JSON: {err}")
+
+
+def _wrap_list(model_cls: Type[T], data):
+    # {"items": [...]} пришёл голым массивом
+    if isinstance(data, list):
+        fields = list(model_cls.model_fields)
+        if len(fields) == 1:
+            return {fields[0]: data}
+    return data
+
+
+def parse_model(model_cls: Type[T], raw: str) -> tuple[T, bool]:
+    """(модель, понадобилась ли локальная починка). ValueError — не спасти."""
+    if not raw or not raw.strip():
+        raise ValueError("Empty LLM content")
+
+    try:
+        return model_cls.model_validate_json(raw), False
+    except ValueError:
+        pass
+
+    data = _loads_lenient(extract_json(_strip_wrappers(raw)))
+    return model_cls.model_validate(_wrap_list(model_cls, data)), True
+
+
+def _error_text(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in err['loc']) or '<root>'}: {err['msg']}"
+            for err in e.errors()[:5]
+        )
+    return str(e)[:300]
+
+
+def _reask(prompt, raw: str, err: Exception) -> list:
+    """Диалог для перезапроса: исходный промпт, плохой ответ и ошибка разбора."""
+    from langchain_core.messages import AIMessage, HumanMessage
+    if hasattr(prompt, "to_messages"):
+        base = prompt.to_messages()
+    elif isinstance(prompt, str):
+        base = [HumanMessage(prompt)]
+    else:
+        base = list(prompt)
+    return base + [AIMessage(raw[:4000]), HumanMessage(REASK_TEMPLATE.format(error=_error_text(err)))]
+
+
+_FORMAT_MODES = ("json_schema", "json_object", "none")
+_format = {"mode": LLM_RESPONSE_FORMAT if LLM_RESPONSE_FORMAT in _FORMAT_MODES else "none"}
+_format_lock = threading.Lock()
+
+
+def _response_format(model_cls: Type[BaseModel]) -> dict | None:
+    mode = _format["mode"]
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {
+            "name": model_cls.__name__, "schema": model_cls.model_json_schema(),
+        }}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+# признаки того, что 400/422 — про response_format, а не про контекст или параметры
+_FORMAT_ERROR_RE = re.compile(r"response_format|json_schema|json_object|structured output|guided", re.I)
+
+
+def _downgrade(e: Exception, fmt: dict | None) -> bool:
+    """
+    Бэкенд отверг response_format (400/422 с упоминанием формата в теле
+    ошибки) — понижаем режим и повторяем. Прочие 400 (длина контекста,
+    битый параметр) режим не трогают.
+    """
+    if fmt is None or getattr(e, "status_code", None) not in (400, 422):
+        return False
+    if not _FORMAT_ERROR_RE.search(f"{e} {getattr(e, 'body', '')}"):
+        return False
+    with _format_lock:
+        mode = _format["mode"]
+        if mode == fmt["type"]:
+            _format["mode"] = _FORMAT_MODES[_FORMAT_MODES.index(mode) + 1]
+            metrics.llm_format_downgrade(mode, _format["mode"])
+            log.warning("response_format=%s rejected (%s), falling back to %s",
+                        mode, e.__class__.__name__, _format["mode"])
+    return True
+
+
+def _retry_after(e: Exception, fmt: dict | None, overloads: int) -> float | None:
+    """
+    Пауза перед повтором после ошибки вызова или None — пробросить.
+    Перегрузку (429/5xx/таймаут) повторяем: слот к этому моменту возвращён,
+    лимитер уже снизил лимит, так что повтор встанет в очередь. Пауза,
+    которая не влезает в остаток бюджета, — не повторяем.
+    """
+    if _downgrade(e, fmt):
+        return 0.0
+    if not is_overload(e) or overloads >= LLM_OVERLOAD_RETRIES:
+        return None
+    delay = retry_delay(overloads, getattr(getattr(e, "response", None), "headers", None))
+    left = budget.remaining()
+    if left is not None and delay >= left:
+        return None
+    metrics.llm_overload()
+    return delay
+
+
+def _bound(llm, fmt: dict | None, timeout: float):
+    kw = {"timeout": timeout}
+    if fmt:
+        kw["response_format"] = fmt
+    return llm.bind(**kw)
+
+
+def _request(llm, model_cls, messages, fmt):
+    """
+    Один запрос под адаптивным лимитом (adaptive.llm_limiter) с таймаутом из
+    бюджета прогона. Таймаут, урезанный бюджетом, — DeadlineExceeded: это не
+    перегрузка, лимит он не снижает и не повторяется.
+    """
+    try:
+        metrics.queued(llm_limiter.acquire(budget.remaining()))
+    except TimeoutError:
+        raise budget.DeadlineExceeded("run budget exhausted waiting for an LLM slot") from None
+    t0, cut = time.perf_counter(), False
+    try:
+        timeout, cut = budget.call_timeout()
+        msg = _bound(llm, fmt, timeout).invoke(messages)
+    except BaseException as e:
+        deadline = cut and budget.missed(e)
+        llm_limiter.release(model_cls.__name__, None, overloaded=is_overload(e) and not deadline)
+        if deadline:
+            raise budget.DeadlineExceeded(f"LLM call cut at {timeout:.1f}s by the run budget") from e
+        raise
+    llm_limiter.release(model_cls.__name__, time.perf_counter() - t0)
+    return msg
+
+
+async def _arequest(llm, model_cls, messages, fmt):
+    try:
+        metrics.queued(await llm_limiter.aacquire(budget.remaining()))
+    except TimeoutError:
+        raise budget.DeadlineExceeded("run budget exhausted waiting for an LLM slot") from None
+    t0, cut = time.perf_counter(), False
+    try:
+        timeout, cut = budget.call_timeout()
+        msg = await _bound(llm, fmt, timeout).ainvoke(messages)
+    except BaseException as e:
+        # и отмена задачи (проигравший hedged-запрос): слот возвращаем в любом случае
+        deadline = cut and budget.missed(e)
+        llm_limiter.release(model_cls.__name__, None, overloaded=is_overload(e) and not deadline)
+        if deadline:
+            raise budget.DeadlineExceeded(f"LLM call cut at {timeout:.1f}s by the run budget") from e
+        raise
+    llm_limiter.release(model_cls.__name__, time.perf_counter() - t0)
+    return msg
+
+
+def _hedge_after(model_cls) -> float | None:
+    """Через сколько слать дубль запроса; None — hedging выключен или мало данных."""
+    if LLM_HEDGE_QUANTILE <= 0:
+        return None
+    return llm_limiter.quantile(model_cls.__name__, LLM_HEDGE_QUANTILE)
+
+
+def _spawn(fn) -> Future:
+    # daemon-поток, а не пул: проигравший дубль не держит выход из процесса
+    fut: Future = Future()
+    ctx = contextvars.copy_context()
+
+    def run():
+        try:
+            fut.set_result(ctx.run(fn))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return fut
+
+
+def _hedged(fn, model_cls):
+    """
+    fn() с дублем после квантиля латентности: первый успешный ответ
+    выигрывает. Проигравший досчитывается в фоне (синхронный HTTP-вызов не
+    прервать), его ответ отбрасывается.
+    """
+    after = _hedge_after(model_cls)
+    if after is None:
+        return fn()
+    first = _spawn(fn)
+    # при полном лимите дубль только удлинит очередь: ждём, пока освободится
+    # слот (хвост фан-аута) или придёт ответ
+    while not wait([first], timeout=after).done:
+        if llm_limiter.has_spare():
+            break
+    else:
+        return first.result()
+    metrics.llm_hedge()
+    second = _spawn(fn)
+    for f in as_completed([first, second]):
+        if f.exception() is None:
+            metrics.llm_hedge(won=f is second)
+            return f.result()
+    return first.result()
+
+
+async def _ahedged(fn, model_cls):
+    after = _hedge_after(model_cls)
+    if after is None:
+        return await fn()
+    first = asyncio.ensure_future(fn())
+    second = None
+    try:
+        while not (await asyncio.wait({first}, timeout=after))[0]:
+            if llm_limiter.has_spare():
+                break
+        else:
+            return first.result()
+        metrics.llm_hedge()
+        second = asyncio.ensure_future(fn())
+        for fut in asyncio.as_completed([first, second]):
+            try:
+                msg = await fut
+            except Exception:
+                continue
+            metrics.llm_hedge(won=second.done() and not first.done())
+            return msg
+        return first.result()
+    finally:
+        for t in (first, second):
+            if t is not None and not t.done():
+                t.cancel()
+
+
+def _invoke(llm, model_cls, messages):
+    overloads = 0
+    while True:
+        fmt = _response_format(model_cls)
+        try:
+            return _hedged(lambda: _request(llm, model_cls, messages, fmt), model_cls)
         except Exception as e:
-            last_err = e
+            delay = _retry_after(e, fmt, overloads)
+            if delay is None:
+                raise
+            overloads += is_overload(e)
+            time.sleep(delay)
 
+
+async def _ainvoke(llm, model_cls, messages):
+    overloads = 0
+    while True:
+        fmt = _response_format(model_cls)
         try:
-            js = extract_json(raw)
-            return model_cls.model_validate_json(js)
+            return await _ahedged(lambda: _arequest(llm, model_cls, messages, fmt), model_cls)
         except Exception as e:
+            delay = _retry_after(e, fmt, overloads)
+            if delay is None:
+                raise
+            overloads += is_overload(e)
+            await asyncio.sleep(delay)
+
+
+def _tokens(prompt, msg) -> tuple[int, int]:
+    # usage от провайдера, если он его отдаёт; иначе грубая оценка
+    usage = getattr(msg, "usage_metadata", None) or {}
+    if usage.get("input_tokens") is not None:
+        return usage["input_tokens"], usage.get("output_tokens") or 0
+    return estimate_tokens(str(prompt)), estimate_tokens(msg.content or "")
+
+
+def invoke_and_parse(llm, model_cls: Type[T], prompt, tries: int = 4) -> T:
+    """
+    Вызов LLM + разбор в model_cls. Сначала ответ чинится локально
+    (parse_model); перезапрос — только если починить нельзя, и тогда модель
+    видит свою ошибку. Между перезапросами не спим: сервер ответил, ждать нечего.
+    """
+    last_err: Exception | None = None
+    messages = prompt
+    tokens = [0, 0]
+
+    for i in range(tries):
+        msg = _invoke(llm, model_cls, messages)
+        for j, n in enumerate(_tokens(messages, msg)):
+            tokens[j] += n
+        raw = (msg.content or "").strip()
+        try:
+            out, repaired = parse_model(model_cls, raw)
+            metrics.llm_call(i + 1, i, *tokens, repaired=int(repaired))
+            return out
+        except ValueError as e:
             last_err = e
+            messages = _reask(prompt, raw, e)
 
-        time.sleep(0.4 * (2 ** i))
+    metrics.llm_call(tries, tries, *tokens)
+    raise ValueError(f"Failed to parse {model_cls.__name__}. Error: {last_err}")
+
+
+async def ainvoke_and_parse(llm, model_cls: Type[T], prompt, tries: int = 4) -> T:
+    last_err: Exception | None = None
+    messages = prompt
+    tokens = [0, 0]
+
+    for i in range(tries):
+        msg = await _ainvoke(llm, model_cls, messages)
+        for j, n in enumerate(_tokens(messages, msg)):
+            tokens[j] += n
+        raw = (msg.content or "").strip()
+        try:
+            out, repaired = parse_model(model_cls, raw)
+            metrics.llm_call(i + 1, i, *tokens, repaired=int(repaired))
+            return out
+        except ValueError as e:
+            last_err = e
+            messages = _reask(prompt, raw, e)
 
+    metrics.llm_call(tries, tries, *tokens)
     raise ValueError(f"Failed to parse {model_cls.__name__}. Error: {last_err}")
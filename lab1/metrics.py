@@ -0,0 +1,329 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from config import METRICS_DIR, METRICS_PROM_PATH
+
+# границы бакетов гистограмм, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_run: contextvars.ContextVar["RunMetrics | None"] = contextvars.ContextVar("lab1_run", default=None)
+_node: contextvars.ContextVar[str] = contextvars.ContextVar("lab1_node", default="-")
+
+
+def _stats() -> dict:
+    return {
+        "calls": 0, "errors": 0, "wall_s": 0.0, "queue_s": 0.0,
+        "llm_calls": 0, "retries": 0, "parse_failures": 0, "repaired": 0,
+        "overloads": 0, "hedges": 0, "failed_items": 0, "degraded": 0,
+        "prompt_tokens": 0, "completion_tokens": 0,
+    }
+
+
+class RunMetrics:
+    """Метрики одного прогона графа: по узлам, инструментам и кэшам."""
+
+    def __init__(self, label: str = ""):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.wall_s = 0.0
+        self.nodes = defaultdict(_stats)
+        self.tools = defaultdict(lambda: {"calls": 0, "errors": 0, "wall_s": 0.0})
+        self.cache = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.agreement = defaultdict(lambda: {"compared": 0, "agreed": 0})
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        def rnd(d):
+            return {k: round(v, 4) if isinstance(v, float) else v for k, v in d.items()}
+
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                "label": self.label,
+                "started_at": self.started_at,
+                "wall_s": round(self.wall_s, 4),
+                "nodes": {k: rnd(v) for k, v in self.nodes.items()},
+                "tools": {k: rnd(v) for k, v in self.tools.items()},
+                "cache": {k: dict(v) for k, v in self.cache.items()},
+                "agreement": {k: dict(v) for k, v in self.agreement.items()},
+            }
+
+
+class _Registry:
+    """Процессные счётчики и гистограммы в формате Prometheus (text exposition)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.hists = {}
+        self.help = {}
+
+    def inc(self, name: str, labels: dict, value: float = 1.0, help: str = ""):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+            self.help.setdefault(name, (help, "counter"))
+
+    def observe(self, name: str, labels: dict, value: float, help: str = ""):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, b in enumerate(BUCKETS):
+                if value <= b:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+            self.help.setdefault(name, (help, "histogram"))
+
+    def text(self) -> str:
+        def fmt(labels, extra=()):
+            items = [*labels, *extra]
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        with self._lock:
+            by_name = defaultdict(list)
+            for (name, labels), v in sorted(self.counters.items()):
+                by_name[name].append(f"{name}{fmt(labels)} {v:g}")
+            for (name, labels), (buckets, total, count) in sorted(self.hists.items()):
+                for b, c in zip(BUCKETS, buckets):
+                    by_name[name].append(f"{name}_bucket{fmt(labels, [('le', b)])} {c}")
+                by_name[name].append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+                by_name[name].append(f"{name}_sum{fmt(labels)} {total:.6f}")
+                by_name[name].append(f"{name}_count{fmt(labels)} {count}")
+            out = []
+            for name in sorted(by_name):
+                help, kind = self.help[name]
+                out.append(f"# HELP {name} {help}")
+                out.append(f"# TYPE {name} {kind}")
+                out.extend(by_name[name])
+        return "\n".join(out) + "\n"
+
+
+registry = _Registry()
+
+
+def prometheus_text() -> str:
+    return registry.text()
+
+
+def current() -> "RunMetrics | None":
+    return _run.get()
+
+
+@contextmanager
+def run(label: str = ""):
+    """
+    Прогон графа: всё, что узлы запишут внутри блока, попадает в RunMetrics.
+    На выходе JSON пишется в METRICS_DIR/<run_id>.json, Prometheus-текст —
+    в METRICS_PROM_PATH (для textfile-коллектора), если они заданы.
+    """
+    m = RunMetrics(label)
+    token = _run.set(m)
+    t0 = time.perf_counter()
+    try:
+        yield m
+    finally:
+        m.wall_s = time.perf_counter() - t0
+        _run.reset(token)
+        registry.observe("lab1_run_seconds", {}, m.wall_s, "Wall time of a graph run")
+        _export(m)
+
+
+def _export(m: RunMetrics):
+    if METRICS_DIR:
+        d = Path(METRICS_DIR)
+        d.mkdir(parents=True, exist_ok=True)
+        (d / f"{m.run_id}.json").write_text(json.dumps(m.to_dict(), ensure_ascii=False), encoding="utf-8")
+    if METRICS_PROM_PATH:
+        p = Path(METRICS_PROM_PATH)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(p.suffix + ".tmp")
+        tmp.write_text(prometheus_text(), encoding="utf-8")
+        tmp.replace(p)
+
+
+def _node_add(**values):
+    m = _run.get()
+    if m is None:
+        return
+    with m._lock:
+        st = m.nodes[_node.get()]
+        for k, v in values.items():
+            st[k] += v
+
+
+def instrument(name: str, fn):
+    """Обёртка узла графа: wall time, ошибки, контекст узла для вложенных вызовов."""
+
+    def _done(t0: float, failed: bool):
+        dt = time.perf_counter() - t0
+        _node_add(calls=1, wall_s=dt, errors=int(failed))
+        registry.observe("lab1_node_seconds", {"node": name}, dt, "Wall time per node call")
+        if failed:
+            registry.inc("lab1_node_errors_total", {"node": name}, help="Node calls that raised")
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def awrapper(state):
+            token = _node.set(name)
+            t0, failed = time.perf_counter(), True
+            try:
+                out = await fn(state)
+                failed = False
+                return out
+            finally:
+                _done(t0, failed)
+                _node.reset(token)
+        return awrapper
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        token = _node.set(name)
+        t0, failed = time.perf_counter(), True
+        try:
+            out = fn(state)
+            failed = False
+            return out
+        finally:
+            _done(t0, failed)
+            _node.reset(token)
+    return wrapper
+
+
+@contextmanager
+def tool(name: str):
+    """Замер вызова инструмента (GDELT, Stooq, event returns)."""
+    t0, failed = time.perf_counter(), True
+    try:
+        yield
+        failed = False
+    finally:
+        dt = time.perf_counter() - t0
+        m = _run.get()
+        if m is not None:
+            with m._lock:
+                st = m.tools[name]
+                st["calls"] += 1
+                st["errors"] += int(failed)
+                st["wall_s"] += dt
+        registry.observe("lab1_tool_seconds", {"tool": name}, dt, "Wall time per tool call")
+
+
+def queued(seconds: float):
+    """Ожидание слота: лимитер, rate limit хоста, очередь пула потоков."""
+    if seconds <= 0:
+        return
+    _node_add(queue_s=seconds)
+    registry.inc("lab1_queue_seconds_total", {"node": _node.get()}, seconds,
+                 "Time spent waiting for a limiter, rate limit or worker slot")
+
+
+def llm_call(attempts: int, parse_failures: int, prompt_tokens: int, completion_tokens: int,
+             repaired: int = 0):
+    """
+    Итог одного invoke_and_parse: попытки сверх первой считаются ретраями,
+    repaired — ответ принят после локальной починки JSON.
+    """
+    node = _node.get()
+    _node_add(llm_calls=attempts, retries=attempts - 1, parse_failures=parse_failures,
+              repaired=repaired, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    if repaired:
+        registry.inc("lab1_llm_repaired_total", {"node": node}, repaired,
+                     "LLM answers accepted after local JSON repair")
+    registry.inc("lab1_llm_calls_total", {"node": node}, attempts, "LLM requests")
+    registry.inc("lab1_llm_retries_total", {"node": node}, attempts - 1, "LLM re-asks after a bad answer")
+    registry.inc("lab1_llm_parse_failures_total", {"node": node}, parse_failures,
+                 "LLM answers that failed to parse")
+    registry.inc("lab1_llm_tokens_total", {"node": node, "kind": "prompt"}, prompt_tokens, "LLM tokens")
+    registry.inc("lab1_llm_tokens_total", {"node": node, "kind": "completion"}, completion_tokens, "LLM tokens")
+
+
+def llm_overload():
+    """Ответ 429/5xx/таймаут от LLM-бэкенда, запрос будет повторён."""
+    _node_add(overloads=1)
+    registry.inc("lab1_llm_overloads_total", {"node": _node.get()},
+                 help="LLM requests retried after 429/5xx/timeout")
+
+
+def llm_hedge(won: bool | None = None):
+    """Дубль медленного LLM-запроса: won=None — отправлен, иначе чей ответ принят."""
+    if won is None:
+        _node_add(hedges=1)
+        registry.inc("lab1_llm_hedges_total", {"node": _node.get()},
+                     help="Hedged duplicates of slow LLM requests")
+    elif won:
+        registry.inc("lab1_llm_hedge_wins_total", {"node": _node.get()},
+                     help="Hedged LLM requests answered by the duplicate")
+
+
+def llm_format_downgrade(rejected: str, fallback: str):
+    """Бэкенд отверг response_format, режим понижен до конца процесса."""
+    registry.inc("lab1_llm_format_downgrades_total", {"rejected": rejected, "fallback": fallback},
+                 help="response_format modes rejected by the LLM backend")
+
+
+def degraded(n: int = 1):
+    """Результат подставлен локально: LLM не уложилась в дедлайн."""
+    _node_add(degraded=n)
+    registry.inc("lab1_degraded_total", {"node": _node.get()}, n,
+                 "Results replaced by a local fallback after a missed deadline")
+
+
+def item_failed(n: int = 1):
+    """Элемент фан-аута (статья) остался без результата; узел продолжает работу."""
+    _node_add(failed_items=n)
+    registry.inc("lab1_failed_items_total", {"node": _node.get()}, n,
+                 "Fan-out items dropped after an error")
+
+
+def cache(name: str, hits: int = 0, misses: int = 0):
+    m = _run.get()
+    if m is not None:
+        with m._lock:
+            m.cache[name]["hits"] += hits
+            m.cache[name]["misses"] += misses
+    if hits:
+        registry.inc("lab1_cache_requests_total", {"cache": name, "result": "hit"}, hits, "Cache lookups")
+    if misses:
+        registry.inc("lab1_cache_requests_total", {"cache": name, "result": "miss"}, misses, "Cache lookups")
+
+
+def agreement(name: str, compared: int, agreed: int):
+    """Сверка дешёвой оценки с эталоном (словарь каскада против LLM)."""
+    m = _run.get()
+    if m is not None:
+        with m._lock:
+            m.agreement[name]["compared"] += compared
+            m.agreement[name]["agreed"] += agreed
+    registry.inc("lab1_agreement_total", {"check": name, "result": "agreed"}, agreed,
+                 "Cheap-vs-reference comparisons")
+    registry.inc("lab1_agreement_total", {"check": name, "result": "disagreed"}, compared - agreed,
+                 "Cheap-vs-reference comparisons")
+
+
+def submit(ex, fn, *args):
+    """
+    ex.submit с контекстом текущего прогона/узла (пул потоков его не наследует)
+    и учётом времени ожидания свободного потока.
+    """
+    ctx = contextvars.copy_context()
+    t_submit = time.perf_counter()
+
+    def call():
+        queued(time.perf_counter() - t_submit)
+        return fn(*args)
+
+    return ex.submit(ctx.run, call)
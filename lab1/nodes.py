@@ -1,27 +1,84 @@
+import asyncio
+import hashlib
 import json
+import logging
+import re
+import threading
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from langchain_openai import ChatOpenAI
 
-from config import BASE_URL, API_KEY, MODEL_NAME, LLM_TEMPERATURE, MAX_ARTICLES
+from config import (
+    BASE_URL, API_KEY, MODEL_NAME, LLM_TEMPERATURE, LLM_TIMEOUT, MAX_ARTICLES, PLANNER_MODE,
+    SENTIMENT_CACHE_ENABLED, SENTIMENT_CACHE_TTL, SENTIMENT_CACHE_SIZE, SENTIMENT_CACHE_PATH,
+    SENTIMENT_BATCH_SIZE, SENTIMENT_BATCH_TOKENS, EVENT_WINDOWS,
+    DEDUP_ENABLED, DEDUP_SIMILARITY, INCREMENTAL_OVERLAP_MIN, LLM_CONCURRENCY_MAX,
+    RUN_BUDGET_RESERVE, SENTIMENT_CASCADE_ENABLED, GDELT_MAX_ARTICLES,
+)
 from schemas import (
-    GraphState, PlanSpec, FinalReport,
+    GraphState, PlanSpec, ToolCall, UserRequest, FinalReport,
     GDELTSearchIn, PricesIn, EventReturnIn,
-    SentimentImpact, ImpactSummary,
+    SentimentImpact, SentimentBatch, ImpactSummary, ReportText,
+    SearchShardEvent, ArticlesEvent, SentimentEvent, EventReturnEvent, ImpactSummaryEvent, ReportEvent,
+)
+from prompts import (
+    planner_prompt, sentiment_prompt, sentiment_batch_prompt, impact_prompt, reviewer_prompt,
+    SENTIMENT_PROMPT_VERSION,
 )
-from prompts import planner_prompt, sentiment_prompt, impact_prompt, reviewer_prompt
-from tools import gdelt_search_retry, stooq_prices, compute_event_returns
-from llm_utils import invoke_and_parse
-
-llm = ChatOpenAI(
-    model=MODEL_NAME,
-    base_url=BASE_URL,
-    api_key=API_KEY,
-    temperature=LLM_TEMPERATURE,
-    max_retries=0,
-    timeout=120,
+from tools import (
+    GDELT_TS, gdelt_search_retry, gdelt_search_delta, stooq_price_series,
+    compute_event_returns, refresh_event_returns,
+    agdelt_search_retry, agdelt_search_delta, astooq_price_series,
+)
+from llm_utils import invoke_and_parse, ainvoke_and_parse, estimate_tokens
+from lexicon import local_sentiment
+from cache import TTLCache
+from dedup import cluster_articles
+from views import ArticleTable, impact_view, writer_view
+import budget
+import cascade
+import metrics
+
+log = logging.getLogger(__name__)
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """
+    ChatOpenAI создаётся при первом вызове: импорт langchain_openai/openai —
+    основная часть времени старта, а прогону из кэша или с локальным
+    планировщиком LLM может не понадобиться вовсе.
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from langchain_openai import ChatOpenAI
+                _llm = ChatOpenAI(
+                    model=MODEL_NAME,
+                    base_url=BASE_URL,
+                    api_key=API_KEY,
+                    temperature=LLM_TEMPERATURE,
+                    max_retries=0,
+                    timeout=LLM_TIMEOUT,
+                )
+    return _llm
+
+sentiment_cache = TTLCache(
+    SENTIMENT_CACHE_SIZE, SENTIMENT_CACHE_TTL, SENTIMENT_CACHE_PATH or None
 )
 
+def emit(event) -> None:
+    """Событие для stream_mode="custom" (см. stream.py); вне графа — no-op."""
+    # внутри графа langgraph уже загружен; вне его (bench, батч-утилиты) не тянем
+    from langgraph.config import get_stream_writer
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        return
+    writer(event)
+
 def _sj(obj):
     if hasattr(obj, "model_dump"):
         obj = obj.model_dump()
@@ -36,7 +93,7 @@ def planner_view(state: GraphState) -> str:
             "articles_count": len(state.articles),
             "articles_sample_titles": [a.title for a in state.articles[:3]],
             "have_prices": state.prices is not None,
-            "prices_points": len(state.prices.prices) if state.prices else 0,
+            "prices_points": len(state.prices) if state.prices else 0,
             "have_event_returns": state.event_returns is not None,
             "event_returns_count": len(state.event_returns.event_returns)
             if state.event_returns else 0,
@@ -45,101 +102,506 @@ def planner_view(state: GraphState) -> str:
         indent=2,
     )
 
-def impact_view(state: GraphState) -> str:
-    req = state.user_request
-    return json.dumps(
-        {
-            "ticker": req.ticker if req else None,
-            "company_name": req.company_name if req else None,
-            "sentiments": [s.model_dump() for s in state.sentiments],
-            "event_returns": (
-                [er.model_dump() for er in state.event_returns.event_returns]
-                if state.event_returns else []
-            ),
-        },
-        ensure_ascii=False,
-        indent=2,
-    )
+_TICKER_RE = re.compile(r"^[A-Z0-9^][A-Z0-9^\-]*(\.[A-Z]{1,4})?$")
 
-def writer_view(state: GraphState) -> str:
-    req = state.user_request
-    return json.dumps(
-        {
-            "ticker": req.ticker if req else None,
-            "company": req.company_name if req else None,
-            "lookback_days": req.lookback_days if req else None,
-            "event_window_days": req.event_window_days if req else None,
-            "articles_analyzed": len(state.articles),
-            "impact_summary": state.impact_summary.model_dump()
-            if state.impact_summary else None,
-            "event_returns": (
-                [er.model_dump() for er in state.event_returns.event_returns]
-                if state.event_returns else []
-            ),
-            "example_headlines": [a.title for a in state.articles[:5]],
-        },
-        ensure_ascii=False,
-        indent=2,
+
+def normalize_request(req: UserRequest | None) -> UserRequest | None:
+    """
+    Локальная нормализация запроса. None — запрос неоднозначный, нужен LLM.
+    """
+    if req is None:
+        return None
+
+    ticker = (req.ticker or "").strip().upper()
+    company = " ".join((req.company_name or "").split())
+    if not ticker or not company or not _TICKER_RE.match(ticker):
+        return None
+
+    # stooq: тикер без биржевого суффикса считаем американским
+    if "." not in ticker:
+        ticker += ".US"
+
+    return UserRequest(
+        ticker=ticker,
+        company_name=company,
+        lookback_days=max(1, req.lookback_days),
+        event_window_days=max(1, req.event_window_days),
+        max_articles=min(max(1, req.max_articles), GDELT_MAX_ARTICLES),
     )
 
-def planner_node(state: GraphState) -> GraphState:
+
+def next_tool(state: GraphState) -> str:
+    # та же лестница, что в PLANNER_SYSTEM
+    if not state.articles:
+        return "gdelt_search"
+    if state.prices is None:
+        return "stooq_prices"
+    if state.event_returns is None:
+        return "compute_event_returns"
+    return "none"
+
+
+def _llm_plan(state: GraphState) -> PlanSpec:
+    prompt = planner_prompt().format(state_json=planner_view(state))
+    return invoke_and_parse(get_llm(), PlanSpec, prompt)
+
+
+async def _allm_plan(state: GraphState) -> PlanSpec:
     prompt = planner_prompt().format(state_json=planner_view(state))
-    plan = invoke_and_parse(llm, PlanSpec, prompt)
-    state.plan = plan
-    return state
+    return await ainvoke_and_parse(get_llm(), PlanSpec, prompt)
+
+
+def _known_request(state: GraphState) -> UserRequest | None:
+    if state.plan is not None:
+        return state.plan.normalized_request
+    return normalize_request(state.user_request)
+
+
+def _local_plan(state: GraphState, req: UserRequest) -> dict:
+    plan = PlanSpec(
+        normalized_request=req,
+        strategy="Fetch news, get prices, compute event returns",
+        next_call=ToolCall(tool_name=next_tool(state)),
+    )
+    return {"plan": plan}
+
+
+def planner_node(state: GraphState) -> dict:
+    if PLANNER_MODE == "llm":
+        return {"plan": _llm_plan(state)}
+
+    # local: LLM вызывается не более одного раза — только если запрос не удалось
+    # нормализовать, дальше маршрут считается по состоянию
+    req = _known_request(state) or _llm_plan(state).normalized_request
+    return _local_plan(state, req)
+
+
+async def aplanner_node(state: GraphState) -> dict:
+    if PLANNER_MODE == "llm":
+        return {"plan": await _allm_plan(state)}
+
+    req = _known_request(state) or (await _allm_plan(state)).normalized_request
+    return _local_plan(state, req)
+
+def article_payload(art) -> dict:
+    d = art.model_dump()
+
+    # слишком длинный сниппет
+    if d.get("snippet") and len(d["snippet"]) > 800:
+        d["snippet"] = d["snippet"][:800] + "..."
+    return d
+
+
+def sentiment_key(d: dict) -> str:
+    raw = json.dumps([d, MODEL_NAME, SENTIMENT_PROMPT_VERSION], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# запас на ответ модели на одну статью в батче
+SENTIMENT_ITEM_OUTPUT_TOKENS = 120
+
+
+def pack_batches(payloads: list[dict], max_items: int = SENTIMENT_BATCH_SIZE,
+                 token_budget: int = SENTIMENT_BATCH_TOKENS) -> list[list[dict]]:
+    """Жадно набивает батчи, пока вход+ожидаемый выход влезают в бюджет токенов."""
+    batches, cur, used = [], [], 0
+    for d in payloads:
+        cost = estimate_tokens(json.dumps(d, ensure_ascii=False)) + SENTIMENT_ITEM_OUTPUT_TOKENS
+        if cur and (len(cur) >= max_items or used + cost > token_budget):
+            batches.append(cur)
+            cur, used = [], 0
+        cur.append(d)
+        used += cost
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def _fill_ids(s: SentimentImpact, d: dict) -> SentimentImpact:
+    if not s.url:
+        s.url = d.get("url")
+    if not s.title:
+        s.title = d.get("title")
+    return s
+
+
+def sentiment_one(d: dict) -> SentimentImpact:
+    p = sentiment_prompt().format(article_json=_sj(d))
+    return _fill_ids(invoke_and_parse(get_llm(), SentimentImpact, p), d)
 
-def sentiment_agent_map_node(state: GraphState) -> GraphState:
+
+async def asentiment_one(d: dict) -> SentimentImpact:
+    p = sentiment_prompt().format(article_json=_sj(d))
+    return _fill_ids(await ainvoke_and_parse(get_llm(), SentimentImpact, p), d)
+
+
+def _batch_prompt(ds: list[dict]):
+    return sentiment_batch_prompt().format(articles_json=json.dumps(ds, ensure_ascii=False))
+
+
+def sentiment_batch(ds: list[dict]) -> dict[str, SentimentImpact]:
+    """
+    Один запрос на K статей. Ответ сопоставляется по url (запасной вариант — title);
+    битый элемент — перезапрос всего батча (llm_utils), пропущенные и чужие
+    элементы в результат не попадают. Упавший батч —
+    пустой результат: его статьи уйдут в следующий раунд или по одной.
+    """
+    try:
+        batch = invoke_and_parse(get_llm(), SentimentBatch, _batch_prompt(ds))
+    except Exception:
+        return {}
+    return _match_batch(ds, batch)
+
+
+async def asentiment_batch(ds: list[dict]) -> dict[str, SentimentImpact]:
+    try:
+        batch = await ainvoke_and_parse(get_llm(), SentimentBatch, _batch_prompt(ds))
+    except Exception:
+        return {}
+    return _match_batch(ds, batch)
+
+
+def _match_batch(ds: list[dict], batch: SentimentBatch) -> dict[str, SentimentImpact]:
+    by_url = {d["url"]: d for d in ds}
+    by_title = {d["title"]: d for d in ds}
+    out: dict[str, SentimentImpact] = {}
+    for s in batch.items:
+        d = by_url.get(s.url) or by_title.get(s.title)
+        if d is None:
+            continue
+        s.url, s.title = d["url"], s.title or d["title"]
+        out[d["url"]] = s
+    return out
+
+
+def _unscored(d: dict, e: Exception) -> SentimentImpact | None:
+    """
+    Статья, которую LLM не оценила и по одной. Не уложилась в дедлайн —
+    локальная оценка по словарю (source="fallback"), иначе статья пропускается.
+    """
+    if budget.missed(e):
+        metrics.degraded()
+        return local_sentiment(d)
+    metrics.item_failed()
+    log.warning("sentiment skipped %s: %s: %s", d.get("url"), e.__class__.__name__, str(e)[:200])
+    return None
+
+
+def score_articles(ex: ThreadPoolExecutor, payloads: list[dict]):
+    """
+    Генератор (index, SentimentImpact) по мере готовности.
+    Батчи -> повторный батч только для неудавшихся -> остаток по одной статье.
+    Статья, которую не удалось оценить и по одной, — _unscored: ошибка одной
+    статьи не роняет узел.
+    """
+    pending = list(range(len(payloads)))
+
+    if SENTIMENT_BATCH_SIZE > 1:
+        for _ in range(2):
+            if not pending:
+                break
+            index = {payloads[i]["url"]: i for i in pending}
+            batches = pack_batches([payloads[i] for i in pending])
+            for f in as_completed([metrics.submit(ex, sentiment_batch, b) for b in batches]):
+                for url, s in f.result().items():
+                    if url in index:
+                        yield index.pop(url), s
+            pending = sorted(index.values())
+
+    futs = {metrics.submit(ex, sentiment_one, payloads[i]): i for i in pending}
+    for f in as_completed(futs):
+        try:
+            s = f.result()
+        except Exception as e:
+            s = _unscored(payloads[futs[f]], e)
+            if s is None:
+                continue
+        yield futs[f], s
+
+
+async def ascore_articles(payloads: list[dict]):
+    """async-вариант score_articles: async-генератор (index, SentimentImpact)."""
+    pending = list(range(len(payloads)))
+
+    if SENTIMENT_BATCH_SIZE > 1:
+        for _ in range(2):
+            if not pending:
+                break
+            index = {payloads[i]["url"]: i for i in pending}
+            batches = pack_batches([payloads[i] for i in pending])
+            for coro in asyncio.as_completed([asentiment_batch(b) for b in batches]):
+                for url, s in (await coro).items():
+                    if url in index:
+                        yield index.pop(url), s
+            pending = sorted(index.values())
+
+    async def one(i):
+        try:
+            return i, await asentiment_one(payloads[i])
+        except Exception as e:
+            return i, _unscored(payloads[i], e)
+
+    for coro in asyncio.as_completed([one(i) for i in pending]):
+        i, s = await coro
+        if s is not None:
+            yield i, s
+
+
+def representatives(state: GraphState) -> list:
+    """
+    Статьи без почти-дубликатов — только они уходят в LLM. Сверх MAX_ARTICLES
+    отбор round-robin по дням: state.articles идут по времени (внутри дня — по
+    релевантности GDELT), и простой срез оставил бы самые старые новости.
     """
-    Параллельный LLM-map по новостям.
+    reps = [a for a in state.articles if a.url not in state.duplicates]
+    if len(reps) <= MAX_ARTICLES:
+        return reps
+    days: dict[str, list] = {}
+    for a in reps:
+        days.setdefault((a.datetime or "")[:10], []).append(a)
+    picked = set()
+    for i in range(max(len(d) for d in days.values())):
+        for d in days.values():
+            if i < len(d) and len(picked) < MAX_ARTICLES:
+                picked.add(d[i].url)
+    return [a for a in reps if a.url in picked]
+
+
+def _for_article(s: SentimentImpact, a, is_rep: bool) -> SentimentImpact:
+    return s if is_rep else s.model_copy(update={"url": a.url, "title": a.title})
+
+
+def fan_out(state: GraphState, reps: list, scored: list[SentimentImpact]) -> list[SentimentImpact]:
+    """Оценки представителей -> всем статьям кластера, в порядке state.articles."""
+    by_rep = dict(zip((a.url for a in reps), scored))
+    out = []
+    for a in state.articles:
+        s = by_rep.get(state.duplicates.get(a.url, a.url))
+        if s is None:
+            continue
+        out.append(_for_article(s, a, a.url in by_rep))
+    return out
+
+
+def _clusters(state: GraphState, reps: list) -> dict[str, list[int]]:
+    """url представителя -> индексы статей его кластера в state.articles."""
+    out = {a.url: [] for a in reps}
+    for i, a in enumerate(state.articles):
+        rep = state.duplicates.get(a.url, a.url)
+        if rep in out:
+            out[rep].append(i)
+    return out
+
+
+def _emit_scored(state: GraphState, clusters: dict, rep_url: str, s: SentimentImpact):
+    for i in clusters[rep_url]:
+        a = state.articles[i]
+        emit(SentimentEvent(index=i, sentiment=_for_article(s, a, a.url == rep_url)))
+
+
+def _prior_sentiments(state: GraphState) -> dict[str, SentimentImpact]:
     """
-    def one_article(art):
-        d = art.model_dump()
+    Оценки из снимка прошлого прогона (инкрементальный режим), по url;
+    локальные подмены не переносятся — такие статьи оцениваются заново.
+    """
+    if state.snapshot is None:
+        return {}
+    return {s.url: s for s in state.snapshot.sentiments if s.url and s.source == "llm"}
+
+
+def _cache_split(articles: list, prior: dict[str, SentimentImpact]):
+    """
+    (payloads, ключи кэша, уже известные оценки, индексы промахов). Сначала
+    оценки прошлого прогона, затем кэш; в LLM идут только промахи.
+    """
+    payloads = [article_payload(art) for art in articles]
+    keys = [sentiment_key(d) for d in payloads]
+    sentiments: list[SentimentImpact | None] = [prior.get(a.url) for a in articles]
+    known = sum(s is not None for s in sentiments)
+    if prior:
+        metrics.cache("incremental_sentiment", hits=known, misses=len(articles) - known)
+
+    misses = []
+    for i, k in enumerate(keys):
+        if sentiments[i] is not None:
+            continue
+        hit = sentiment_cache.get(k) if SENTIMENT_CACHE_ENABLED else None
+        if hit is not None:
+            sentiments[i] = SentimentImpact(**hit)
+        else:
+            misses.append(i)
+    if SENTIMENT_CACHE_ENABLED:
+        # выключенный кэш — не 0% попаданий, а отсутствие счётчика
+        metrics.cache("sentiment", hits=len(payloads) - known - len(misses), misses=len(misses))
+    return payloads, keys, sentiments, misses
+
+
+def _cascade_split(state: GraphState, reps: list, clusters: dict, payloads: list[dict],
+                   sentiments: list, misses: list[int]) -> tuple[list[int], dict[int, SentimentImpact]]:
+    """
+    Первая ступень каскада (cascade.py): словарь оценивает промахи кэша, в LLM
+    уходят неуверенные, важные и выборка для сверки.
+    -> (индексы для LLM, {индекс: оценка словаря} для сверки).
+    """
+    if not SENTIMENT_CASCADE_ENABLED:
+        return misses, {}
+    escalate, audits = [], {}
+    for i in misses:
+        s, up, audit = cascade.route(payloads[i], state.article_weights.get(reps[i].url, 1))
+        if up or audit:
+            escalate.append(i)
+            if audit:
+                audits[i] = s
+        else:
+            sentiments[i] = s
+            _emit_scored(state, clusters, reps[i].url, s)
+    cascade.routed(len(misses) - len(escalate) + len(audits), len(escalate) - len(audits))
+    return escalate, audits
+
+
+def _audit_done(state: GraphState, reps: list, clusters: dict, sentiments: list, audits: dict):
+    # сверка не удалась (LLM упала) — остаётся оценка словаря
+    for i, s in audits.items():
+        if sentiments[i] is None:
+            sentiments[i] = s
+            _emit_scored(state, clusters, reps[i].url, s)
+
+
+def sentiment_agent_map_node(state: GraphState) -> dict:
+    """
+    Параллельный LLM-map по новостям. В LLM уходят только представители
+    кластеров почти-дубликатов, не найденные в кэше, батчами по SENTIMENT_BATCH_SIZE;
+    дубликаты получают оценку своего представителя.
+    """
+    reps = representatives(state)
+    clusters = _clusters(state, reps)
+    payloads, keys, sentiments, misses = _cache_split(reps, _prior_sentiments(state))
+    for i, s in enumerate(sentiments):
+        if s is not None:
+            _emit_scored(state, clusters, reps[i].url, s)
+
+    misses, audits = _cascade_split(state, reps, clusters, payloads, sentiments, misses)
+
+    # потоков с запасом: сколько запросов реально летит, решает llm_limiter;
+    # дедлайн этапа оставляет часть бюджета прогона на impact и writer
+    with budget.stage(RUN_BUDGET_RESERVE), ThreadPoolExecutor(max_workers=LLM_CONCURRENCY_MAX) as ex:
+        for j, s in score_articles(ex, [payloads[i] for i in misses]):
+            i = misses[j]
+            sentiments[i] = s
+            _emit_scored(state, clusters, reps[i].url, s)
+            if i in audits:
+                cascade.record(audits[i], s)
+            if SENTIMENT_CACHE_ENABLED and s.source == "llm":
+                sentiment_cache.set(keys[i], s.model_dump())
+    _audit_done(state, reps, clusters, sentiments, audits)
+
+    return {"sentiments": fan_out(state, reps, sentiments)}
+
+
+async def asentiment_agent_map_node(state: GraphState) -> dict:
+    reps = representatives(state)
+    clusters = _clusters(state, reps)
+    # кэш — sqlite: поиск и запись в потоке, не на event loop
+    payloads, keys, sentiments, misses = await asyncio.to_thread(
+        _cache_split, reps, _prior_sentiments(state)
+    )
+    for i, s in enumerate(sentiments):
+        if s is not None:
+            _emit_scored(state, clusters, reps[i].url, s)
+
+    misses, audits = _cascade_split(state, reps, clusters, payloads, sentiments, misses)
+
+    with budget.stage(RUN_BUDGET_RESERVE):
+        async for j, s in ascore_articles([payloads[i] for i in misses]):
+            i = misses[j]
+            sentiments[i] = s
+            _emit_scored(state, clusters, reps[i].url, s)
+            if i in audits:
+                cascade.record(audits[i], s)
+            if SENTIMENT_CACHE_ENABLED and s.source == "llm":
+                await asyncio.to_thread(sentiment_cache.set, keys[i], s.model_dump())
+    _audit_done(state, reps, clusters, sentiments, audits)
+
+    return {"sentiments": fan_out(state, reps, sentiments)}
+
+def _unchanged(state: GraphState) -> bool:
+    """
+    Инкрементальный режим: те же статьи, оценки и доходности, что в прошлом
+    прогоне, — ImpactSummary и FinalReport можно взять из снимка без LLM.
+    """
+    snap = state.snapshot
+    if snap is None or snap.report is None:
+        return False
+    ers = state.event_returns.event_returns if state.event_returns else []
+    return (
+        [a.url for a in state.articles] == [a.url for a in snap.articles]
+        and state.sentiments == snap.sentiments
+        and ers == snap.event_returns
+    )
+
 
-        # слишком длинный сниппет
-        if d.get("snippet") and len(d["snippet"]) > 800:
-            d["snippet"] = d["snippet"][:800] + "..."
+def _reuse_summary(state: GraphState) -> dict:
+    summary = state.snapshot.report.impact_summary
+    emit(ImpactSummaryEvent(impact_summary=summary))
+    return {"impact_summary": summary}
 
-        p = sentiment_prompt().format(article_json=_sj(d))
-        s = invoke_and_parse(llm, SentimentImpact, p)
 
-        if not s.url:
-            s.url = d.get("url")
-        if not s.title:
-            s.title = d.get("title")
+def _reuse_report(state: GraphState) -> dict:
+    emit(ReportEvent(report=state.snapshot.report))
+    return {"report": state.snapshot.report}
 
-        return s
 
-    sentiments: list[SentimentImpact] = []
-    with ThreadPoolExecutor(max_workers=6) as ex:
-        futs = [ex.submit(one_article, art) for art in state.articles[:MAX_ARTICLES]]
-        for f in as_completed(futs):
-            sentiments.append(f.result())
+def impact_estimator_node(state: GraphState) -> dict:
+    if _unchanged(state):
+        return _reuse_summary(state)
+    table = ArticleTable(state)
+    prompt = impact_prompt().format(state_json=impact_view(state, table))
+    try:
+        summary = invoke_and_parse(get_llm(), ImpactSummary, prompt)
+    except Exception as e:
+        if not budget.missed(e):
+            raise
+        summary = _degraded(ImpactSummary)
+    return _finalize_summary(state, table, summary)
 
-    state.sentiments = sentiments
-    return state
 
-def impact_estimator_node(state: GraphState) -> GraphState:
-    prompt = impact_prompt().format(state_json=impact_view(state))
-    summary = invoke_and_parse(llm, ImpactSummary, prompt)
+async def aimpact_estimator_node(state: GraphState) -> dict:
+    if _unchanged(state):
+        return _reuse_summary(state)
+    table = ArticleTable(state)
+    prompt = impact_prompt().format(state_json=impact_view(state, table))
+    try:
+        summary = await ainvoke_and_parse(get_llm(), ImpactSummary, prompt)
+    except Exception as e:
+        if not budget.missed(e):
+            raise
+        summary = _degraded(ImpactSummary)
+    return _finalize_summary(state, table, summary)
 
-    if not summary.per_article:
-        summary.per_article = state.sentiments
+
+def _degraded(model_cls):
+    # LLM не уложилась в дедлайн: пустая модель, _finalize_summary /
+    # _finalize_report дозаполнят её локально
+    metrics.degraded()
+    return model_cls()
+
+
+def _finalize_summary(state: GraphState, table: ArticleTable, summary: ImpactSummary) -> dict:
+    """
+    LLM отдаёт только id сильнейших и вывод; per_article — локальные оценки,
+    id переводятся в url, пропуски дозаполняются локально.
+    """
+    summary.per_article = state.sentiments
+    summary.strongest_positive = table.resolve(summary.strongest_positive)
+    summary.strongest_negative = table.resolve(summary.strongest_negative)
 
     if not summary.strongest_positive:
-        # по polarity*confidence 
-        pos = sorted(
-            [s for s in state.sentiments if s.sentiment == "positive"],
-            key=lambda x: (x.polarity * x.confidence),
-            reverse=True
-        )
+        # по polarity*confidence; table.ranked — представители, копии одной истории не займут все места
+        pos = [s for s in table.ranked if s.sentiment == "positive"]
         summary.strongest_positive = [s.url for s in pos[:3] if s.url]
 
     if not summary.strongest_negative:
-        neg = sorted(
-            [s for s in state.sentiments if s.sentiment == "negative"],
-            key=lambda x: (abs(x.polarity) * x.confidence),
-            reverse=True
-        )
+        neg = [s for s in table.ranked if s.sentiment == "negative"]
         summary.strongest_negative = [s.url for s in neg[:3] if s.url]
 
     if not summary.overall_assessment:
@@ -156,15 +618,48 @@ def impact_estimator_node(state: GraphState) -> GraphState:
             "часть новостей показывает совпадение ожидаемого и фактического направления."
         )
 
-    state.impact_summary = summary
-    return state
-
-
-def reviewer_writer_node(state: GraphState) -> GraphState:
-    prompt = reviewer_prompt().format(state_json=writer_view(state))
-    report = invoke_and_parse(llm, FinalReport, prompt)
-
+    emit(ImpactSummaryEvent(impact_summary=summary))
+    return {"impact_summary": summary}
+
+
+def reviewer_writer_node(state: GraphState) -> dict:
+    if _unchanged(state):
+        return _reuse_report(state)
+    prompt = reviewer_prompt().format(state_json=writer_view(state, ArticleTable(state)))
+    try:
+        text = invoke_and_parse(get_llm(), ReportText, prompt)
+    except Exception as e:
+        if not budget.missed(e):
+            raise
+        text = _degraded(ReportText)
+    return _finalize_report(state, text)
+
+
+async def areviewer_writer_node(state: GraphState) -> dict:
+    if _unchanged(state):
+        return _reuse_report(state)
+    prompt = reviewer_prompt().format(state_json=writer_view(state, ArticleTable(state)))
+    try:
+        text = await ainvoke_and_parse(get_llm(), ReportText, prompt)
+    except Exception as e:
+        if not budget.missed(e):
+            raise
+        text = _degraded(ReportText)
+    return _finalize_report(state, text)
+
+
+def _finalize_report(state: GraphState, text: ReportText) -> dict:
+    """FinalReport собирается из state; от LLM берутся только window и conclusion."""
     req = state.user_request
+    report = FinalReport(
+        ticker=req.ticker if req else "",
+        company=req.company_name if req else "",
+        window=text.window,
+        articles_analyzed=len(state.articles),
+        impact_summary=state.impact_summary or ImpactSummary(per_article=state.sentiments),
+        event_returns=state.event_returns.event_returns if state.event_returns else [],
+        conclusion=text.conclusion,
+    )
 
     if not report.window:
         lb = req.lookback_days if req else "?"
@@ -187,49 +682,158 @@ def reviewer_writer_node(state: GraphState) -> GraphState:
             "Результаты носят исследовательский характер и не являются инвестиционной рекомендацией."
         )
 
-    state.report = report
-    return state
+    emit(ReportEvent(report=report))
+    return {"report": report}
 
 
-def gdelt_search_node(state: GraphState) -> GraphState:
+def _gdelt_request(state: GraphState) -> GDELTSearchIn:
     req = state.plan.normalized_request
     end_dt = datetime.utcnow()
     start_dt = end_dt - timedelta(days=req.lookback_days)
-
-    out = gdelt_search_retry(
-        GDELTSearchIn(
-            query=req.company_name,
-            start_datetime=start_dt.strftime("%Y%m%d%H%M%S"),
-            end_datetime=end_dt.strftime("%Y%m%d%H%M%S"),
-            max_records=req.max_articles,
-        )
+    if state.snapshot is not None and state.snapshot.searched_through:
+        # инкрементальный режим: только окно с прошлого прогона (с запасом на индексацию)
+        since = datetime.strptime(state.snapshot.searched_through, GDELT_TS)
+        start_dt = max(start_dt, since - timedelta(minutes=INCREMENTAL_OVERLAP_MIN))
+
+    return GDELTSearchIn(
+        query=req.company_name,
+        start_datetime=start_dt.strftime("%Y%m%d%H%M%S"),
+        end_datetime=end_dt.strftime("%Y%m%d%H%M%S"),
+        max_records=req.max_articles,
     )
-    state.articles = out.articles
-    return state
 
-def stooq_prices_node(state: GraphState) -> GraphState:
+def _prices_request(state: GraphState) -> PricesIn:
     req = state.plan.normalized_request
     end_dt = datetime.utcnow().date()
     start_dt = end_dt - timedelta(days=req.lookback_days + 10)
 
-    out = stooq_prices(
-        PricesIn(
-            ticker=req.ticker,
-            start_date=start_dt.strftime("%Y-%m-%d"),
-            end_date=end_dt.strftime("%Y-%m-%d"),
-        )
+    return PricesIn(
+        ticker=req.ticker,
+        start_date=start_dt.strftime("%Y-%m-%d"),
+        end_date=end_dt.strftime("%Y-%m-%d"),
     )
-    state.prices = out
-    return state
 
-def event_returns_node(state: GraphState) -> GraphState:
-    req = state.plan.normalized_request
-    out = compute_event_returns(
-        EventReturnIn(
-            prices=state.prices,
-            articles=state.articles,
-            window_days=req.event_window_days,
-        )
+def _event_request(state: GraphState) -> EventReturnIn:
+    return EventReturnIn(
+        prices=state.prices,
+        articles=state.articles,
+        window_days=state.plan.normalized_request.event_window_days,
+        windows=EVENT_WINDOWS,
     )
-    state.event_returns = out
-    return state
+
+def _dedup(state: GraphState) -> dict:
+    if not DEDUP_ENABLED:
+        return {"duplicates": {}, "article_weights": {}}
+    duplicates, weights = cluster_articles(state.articles, DEDUP_SIMILARITY)
+    return {"duplicates": duplicates, "article_weights": weights}
+
+
+def _emit_articles(state: GraphState, out: dict) -> dict:
+    unique = len(out["article_weights"]) if DEDUP_ENABLED else len(state.articles)
+    emit(ArticlesEvent(count=len(state.articles), unique=unique))
+    return out
+
+
+def dedup_node(state: GraphState) -> dict:
+    return _emit_articles(state, _dedup(state))
+
+def _rolling_articles(state: GraphState, fresh: list) -> list:
+    """
+    Статьи снимка, ещё попадающие в lookback, и за ними новые. Старые идут
+    первыми, чтобы остаться представителями кластеров (их оценки уже есть);
+    сверх max_articles отбрасываются самые ранние.
+    """
+    req = state.plan.normalized_request
+    start = (datetime.utcnow() - timedelta(days=req.lookback_days)).strftime("%Y-%m-%d")
+    kept = [a for a in state.snapshot.articles if not a.datetime or a.datetime[:10] >= start]
+    known = {a.url for a in kept}
+    new = [a for a in fresh if a.url not in known]
+    metrics.cache("incremental_articles", hits=len(kept), misses=len(new))
+    return (kept + new)[-req.max_articles:]
+
+
+def _search_result(state: GraphState, inp: GDELTSearchIn, articles: list) -> dict:
+    if state.snapshot is not None:
+        articles = _rolling_articles(state, articles)
+    return {"articles": articles, "searched_through": inp.end_datetime}
+
+
+def _shard_events():
+    """on_shard для поиска: статьи шардов в поток по мере готовности, без повторов url."""
+    seen = set()
+
+    def on_shard(piece: GDELTSearchIn, arts: list, done: int, total: int):
+        new = [a for a in arts if a.url not in seen]
+        seen.update(a.url for a in new)
+        emit(SearchShardEvent(start=piece.start_datetime, end=piece.end_datetime,
+                              articles=new, done=done, total=total))
+    return on_shard
+
+
+def gdelt_search_node(state: GraphState) -> dict:
+    inp = _gdelt_request(state)
+    with metrics.tool("gdelt_search"):
+        if state.snapshot is not None:
+            out = gdelt_search_delta(inp)
+        else:
+            out = gdelt_search_retry(inp, _shard_events())
+    return _search_result(state, inp, out.articles)
+
+def stooq_prices_node(state: GraphState) -> dict:
+    with metrics.tool("stooq_prices"):
+        return {"prices": stooq_price_series(_prices_request(state))}
+
+def _changed_from(snap, series) -> int | None:
+    """
+    С какого бара ряд мог измениться с прошлого прогона: последний бар снимка
+    (его close переписывается, пока день не закрыт). None — ряд тот же.
+    """
+    if snap.bars_through is None or series is None or not len(series):
+        return 0
+    if series.dates[-1] == snap.bars_through and series.close[-1] == snap.last_close:
+        return None
+    return snap.bars_through
+
+
+def _event_returns(state: GraphState):
+    inp = _event_request(state)
+    snap = state.snapshot
+    with metrics.tool("compute_event_returns"):
+        if snap is None:
+            return compute_event_returns(inp)
+        prev = {er.url: er for er in snap.event_returns}
+        out, n = refresh_event_returns(inp, prev, _changed_from(snap, state.prices))
+        metrics.cache("incremental_returns", hits=len(out.event_returns) - n, misses=n)
+        return out
+
+
+def _emit_event_returns(out) -> dict:
+    for er in out.event_returns:
+        emit(EventReturnEvent(event_return=er))
+    return {"event_returns": out}
+
+
+def event_returns_node(state: GraphState) -> dict:
+    return _emit_event_returns(_event_returns(state))
+
+
+async def agdelt_search_node(state: GraphState) -> dict:
+    inp = _gdelt_request(state)
+    with metrics.tool("gdelt_search"):
+        if state.snapshot is not None:
+            out = await agdelt_search_delta(inp)
+        else:
+            out = await agdelt_search_retry(inp, _shard_events())
+    return _search_result(state, inp, out.articles)
+
+async def astooq_prices_node(state: GraphState) -> dict:
+    with metrics.tool("stooq_prices"):
+        return {"prices": await astooq_price_series(_prices_request(state))}
+
+# CPU-работа — в потоке, чтобы не стоял event loop (и соседние тикеры батча);
+# события — из loop'а
+async def adedup_node(state: GraphState) -> dict:
+    return _emit_articles(state, await asyncio.to_thread(_dedup, state))
+
+async def aevent_returns_node(state: GraphState) -> dict:
+    return _emit_event_returns(await asyncio.to_thread(_event_returns, state))
@@ -0,0 +1,130 @@
+import math
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+class PriceSeries:
+    """
+    Колоночный ряд дневных цен: даты — int32 ordinal, OHLCV — float64
+    (volume=nan, если нет). Внутреннее представление для stooq_prices и
+    compute_event_returns; PricesOut собирается только на границе API.
+    """
+
+    __slots__ = ("ticker", "dates") + COLUMNS
+
+    def __init__(self, ticker: str, dates=None, open=None, high=None, low=None,
+                 close=None, volume=None):
+        self.ticker = ticker
+        self.dates = dates if dates is not None else array("i")
+        self.open = open if open is not None else array("d")
+        self.high = high if high is not None else array("d")
+        self.low = low if low is not None else array("d")
+        self.close = close if close is not None else array("d")
+        self.volume = volume if volume is not None else array("d")
+
+    @classmethod
+    def from_rows(cls, ticker: str, rows) -> "PriceSeries":
+        """rows — (ordinal, open, high, low, close, volume)."""
+        s = cls(ticker)
+        cols = (s.dates, s.open, s.high, s.low, s.close, s.volume)
+        for row in rows:
+            for col, v in zip(cols, row):
+                col.append(v)
+        return s
+
+    def append_csv(self, line: str, start: str, end: str) -> bool:
+        """
+        Одна строка CSV Stooq `Date,Open,High,Low,Close[,Volume]`.
+        Дата сравнивается строкой до разбора чисел: строки вне [start, end]
+        (ISO-даты) не материализуются. False — дальше строки только позже end.
+        """
+        d = line[:10]
+        if len(d) < 10 or d[4] != "-":
+            # заголовок или "No data"
+            return True
+        if d < start:
+            return True
+        if d > end:
+            return False
+
+        f = line.split(",")
+        # сначала разбор всей строки: битая строка не должна оставить колонки разной длины
+        row = (date.fromisoformat(d).toordinal(), float(f[1]), float(f[2]), float(f[3]),
+               float(f[4]), float(f[5]) if len(f) > 5 and f[5] else math.nan)
+        for col, v in zip((self.dates, self.open, self.high, self.low, self.close, self.volume), row):
+            col.append(v)
+        return True
+
+    @classmethod
+    def from_columns(cls, ticker: str, cols: dict) -> "PriceSeries":
+        """cols — буферы (например, mmap-срезы price_store); данные копируются."""
+        def copy(code, buf):
+            a = array(code)
+            a.frombytes(memoryview(buf).cast("B"))
+            return a
+
+        return cls(ticker, copy("i", cols["date"]), *(copy("d", cols[c]) for c in COLUMNS))
+
+    @classmethod
+    def from_prices_out(cls, p) -> "PriceSeries":
+        return cls.from_rows(p.ticker, (
+            (date.fromisoformat(x.date).toordinal(), x.open, x.high, x.low, x.close,
+             math.nan if x.volume is None else x.volume)
+            for x in p.prices
+        ))
+
+    def to_bytes(self) -> bytes:
+        """Компактный дамп для чекпойнтов графа: длина тикера, число баров, тикер, колонки подряд."""
+        t = self.ticker.encode("utf-8")
+        return struct.pack("<HI", len(t), len(self)) + t + b"".join(
+            a.tobytes() for a in (self.dates, *(getattr(self, c) for c in COLUMNS))
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PriceSeries":
+        tlen, n = struct.unpack_from("<HI", data)
+        off = struct.calcsize("<HI")
+        ticker = bytes(data[off:off + tlen]).decode("utf-8")
+        off += tlen
+        cols = []
+        for code in "i" + "d" * len(COLUMNS):
+            a = array(code)
+            size = a.itemsize * n
+            a.frombytes(data[off:off + size])
+            cols.append(a)
+            off += size
+        return cls(ticker, *cols)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.dates, *(getattr(self, c) for c in COLUMNS)))
+
+    def between(self, start_ord: int, end_ord: int) -> "PriceSeries":
+        lo = bisect_left(self.dates, start_ord)
+        hi = bisect_right(self.dates, end_ord)
+        return PriceSeries(self.ticker, self.dates[lo:hi], *(getattr(self, c)[lo:hi] for c in COLUMNS))
+
+    def to_prices_out(self):
+        # schemas импортирует этот модуль, поэтому модели — лениво
+        from schemas import PricesOut, PricePoint
+
+        return PricesOut(ticker=self.ticker, prices=[
+            PricePoint(
+                date=date.fromordinal(d).isoformat(),
+                open=o, high=h, low=lo, close=c,
+                volume=None if math.isnan(v) else v,
+            )
+            for d, o, h, lo, c, v in zip(
+                self.dates, self.open, self.high, self.low, self.close, self.volume
+            )
+        ])
+
+    def __repr__(self) -> str:
+        return f"PriceSeries({self.ticker!r}, {len(self)} bars)"
@@ -0,0 +1,112 @@
+import json
+import mmap
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+from config import PRICE_STORE_DIR
+from price_series import PriceSeries
+
+# колонка -> typecode array; даты храним как date.toordinal()
+COLUMNS = {
+    "date": "i",
+    "open": "d",
+    "high": "d",
+    "low": "d",
+    "close": "d",
+    "volume": "d",
+}
+
+
+class PriceStore:
+    """
+    Локальное колоночное хранилище дневных баров: каталог на тикер,
+    по бинарному файлу на колонку + meta.json с покрытием.
+    Чтение через mmap, без парсинга.
+    """
+
+    def __init__(self, root: str = PRICE_STORE_DIR):
+        self.root = Path(root)
+        self._lock = threading.RLock()
+
+    def _dir(self, ticker: str) -> Path:
+        return self.root / ticker.upper().replace("/", "_")
+
+    def meta(self, ticker: str) -> dict | None:
+        p = self._dir(ticker) / "meta.json"
+        if not p.exists():
+            return None
+        return json.loads(p.read_text(encoding="utf-8"))
+
+    def _write_meta(self, ticker: str, meta: dict):
+        p = self._dir(ticker) / "meta.json"
+        tmp = p.with_suffix(".tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, p)
+
+    def _load(self, ticker: str, col: str) -> memoryview:
+        p = self._dir(ticker) / f"{col}.bin"
+        if not p.exists() or p.stat().st_size == 0:
+            return memoryview(array(COLUMNS[col]))
+        with open(p, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mm).cast(COLUMNS[col])
+
+    def read(self, ticker: str, start_ord: int, end_ord: int) -> dict[str, memoryview]:
+        """Колонки за [start_ord, end_ord] — срезы mmap без копирования."""
+        with self._lock:
+            dates = self._load(ticker, "date")
+            lo = bisect_left(dates, start_ord)
+            hi = bisect_right(dates, end_ord)
+            out = {"date": dates[lo:hi]}
+            for col in COLUMNS:
+                if col != "date":
+                    out[col] = self._load(ticker, col)[lo:hi]
+            return out
+
+    def last_date(self, ticker: str) -> int | None:
+        dates = self._load(ticker, "date")
+        return dates[-1] if len(dates) else None
+
+    def write(self, ticker: str, series: PriceSeries, covered_from: int, checked_through: int,
+              replace: bool = False):
+        """
+        series — новые бары по возрастанию даты.
+        Без replace дописывает в хвост, предварительно отрезая сохранённые
+        бары с датой >= первой новой (перезапись незакрытого дня).
+        """
+        with self._lock:
+            d = self._dir(ticker)
+            d.mkdir(parents=True, exist_ok=True)
+
+            dates = self._load(ticker, "date")
+            n = len(dates)
+            keep = 0 if replace else (bisect_left(dates, series.dates[0]) if len(series) else n)
+
+            for col, code in COLUMNS.items():
+                p = d / f"{col}.bin"
+                fresh = series.dates if col == "date" else getattr(series, col)
+                if keep == n and p.exists():
+                    # чистый append: уже отданные mmap-срезы остаются валидными
+                    with open(p, "ab") as f:
+                        fresh.tofile(f)
+                    continue
+                # перезапись через новый файл: старые mmap ссылаются на старый inode
+                head = array(code, self._load(ticker, col)[:keep])
+                tmp = p.with_suffix(".tmp")
+                with open(tmp, "wb") as f:
+                    head.tofile(f)
+                    fresh.tofile(f)
+                os.replace(tmp, p)
+
+            self._write_meta(ticker, {
+                "covered_from": covered_from,
+                "checked_through": checked_through,
+                "checked_at": time.time(),
+            })
+
+
+price_store = PriceStore()
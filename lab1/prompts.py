@@ -1,4 +1,5 @@
-from langchain_core.prompts import ChatPromptTemplate
+import hashlib
+from functools import lru_cache
 
 PLANNER_SYSTEM = """
 Ты — Planner (ReAct) для системы "новости → влияние на цену".
@@ -48,97 +49,111 @@ SENTIMENT_SYSTEM = """
 /no_think
 """
 
-IMPACT_ESTIMATOR_SYSTEM = """
-Ты — ImpactEstimatorAgent.
-Тебе дают:
-- sentiments: список SentimentImpact (оценка тона и ожидаемого влияния)
-- event_returns: реальные доходности вокруг новости.
+SENTIMENT_BATCH_SYSTEM = """
+Ты — NewsSentimentAgent.
+Тебе дают JSON-массив новостей (title + url + snippet).
+Верни один JSON-объект {{"items": [...]}} и НИЧЕГО больше,
+где items — по одному SentimentImpact на КАЖДУЮ новость входа.
 
-Задача: вернуть ОДИН JSON-объект ImpactSummary и НИЧЕГО больше.
+Обязательно верни в каждом элементе поля url и title из соответствующей новости.
 
-Схема ImpactSummary:
+Схема элемента:
 {{
-  "per_article": [
-    {{
-      "url": "...",
-      "title": "...",
-      "sentiment": "positive|neutral|negative",
-      "polarity": 0.0,
-      "expected_impact": "up|neutral|down",
-      "confidence": 0.0,
-      "rationale": "..."
-    }}
-  ],
-  "strongest_positive": ["url1", "url2"],
-  "strongest_negative": ["url3", "url4"],
+  "url": "...",
+  "title": "...",
+  "sentiment": "positive|neutral|negative",
+  "polarity": 0.0,
+  "expected_impact": "up|neutral|down",
+  "confidence": 0.0,
+  "rationale": "..."
+}}
+
+Правила:
+- polarity [-1..1]
+- sentiment по polarity: < -0.2 negative, > 0.2 positive, иначе neutral
+- expected_impact: up/down/neutral — ожидаемое направление влияния на цену
+- confidence 0..1
+- rationale коротко, без выдуманных фактов.
+- каждую новость оценивай независимо от остальных.
+/no_think
+"""
+
+# входит в ключ кэша оценок: правка промпта инвалидирует старые ответы
+SENTIMENT_PROMPT_VERSION = hashlib.sha256(
+    (SENTIMENT_SYSTEM + SENTIMENT_BATCH_SYSTEM).encode("utf-8")
+).hexdigest()[:12]
+
+IMPACT_ESTIMATOR_SYSTEM = """
+Ты — ImpactEstimatorAgent.
+Тебе дают компактный JSON:
+- stats_all: агрегаты по всем новостям (n, pos, neg, avg_pol, avg_conf,
+  avg_rW — средняя событийная доходность для окна ±W дней, %,
+  hit_rW — доля совпадений ожидаемого направления и знака доходности);
+- cols + top: таблица сильнейших новостей по |polarity|*confidence
+  (sent — тон, pol — polarity, conf — confidence, impact — ожидаемое влияние,
+  rW — доходность для окна ±W, n — число почти-дубликатов);
+- stats_tail: те же агрегаты по новостям, не вошедшим в top (если есть).
+
+Задача: вернуть ОДИН JSON-объект и НИЧЕГО больше:
+{{
+  "strongest_positive": ["a1", "a4"],
+  "strongest_negative": ["a2"],
   "overall_assessment": "короткий вывод"
 }}
 
 Важно:
-- НЕ возвращай исходный state.
-- Заполняй per_article на основе входных sentiments (можно копировать и дополнять).
-- strongest_positive/negative выбери по комбинации polarity*confidence и фактической return_pct.
+- в strongest_* указывай id из таблицы top (до 3 в каждом списке).
+- strongest_positive/negative выбери по комбинации polarity*confidence и фактической доходности.
+- НЕ пересказывай таблицу и не возвращай оценки по отдельным статьям.
 - overall_assessment 3–5 предложений, академично, без инвестсоветов.
 /no_think
 """
 
 REVIEWER_SYSTEM = """
 Ты — Reviewer/Writer.
-Собери финальный отчёт по схеме FinalReport.
-Верни один JSON-объект FinalReport и ничего больше.
+Тебе дают компактный JSON: параметры запроса, overall_assessment и
+заголовки сильнейших новостей от ImpactEstimator, stats_all/stats_tail
+(агрегаты тона и событийных доходностей) и таблицу top (cols + строки).
 
-Схема FinalReport:
+Верни один JSON-объект и ничего больше:
 {{
-  "ticker": "тикер",
-  "company": "название компании",
   "window": "описание окна анализа, например: lookback 7d, event ±1d",
-  "articles_analyzed": 0,
-  "impact_summary": {{
-    "per_article": [],
-    "strongest_positive": [],
-    "strongest_negative": [],
-    "overall_assessment": ""
-  }},
-  "event_returns": [
-    {{
-      "url": "...",
-      "title": "...",
-      "event_date": "YYYY-MM-DD",
-      "pre_close": 0.0,
-      "post_close": 0.0,
-      "return_pct": 0.0
-    }}
-  ],
   "conclusion": "короткий академичный вывод без инвестсоветов"
 }}
 
 Правила:
-- НЕ возвращай исходный state.
+- НЕ возвращай исходные данные: таблицы и списки статей в отчёт добавятся без тебя.
 - window и conclusion обязательны.
 - заключение 4–6 предложений, учебная аналитика.
 /no_think
 """
 
-def planner_prompt():
+@lru_cache(maxsize=None)
+def _chat(system: str, user_var: str):
+    # langchain_core.prompts грузится ~0.3 с: импорт при первом промпте, шаблон — один на процесс
+    from langchain_core.prompts import ChatPromptTemplate
     return ChatPromptTemplate.from_messages([
-        ("system", PLANNER_SYSTEM),
-        ("user", "{state_json}")
+        ("system", system),
+        ("user", "{" + user_var + "}")
     ])
 
+def planner_prompt():
+    return _chat(PLANNER_SYSTEM, "state_json")
+
 def sentiment_prompt():
-    return ChatPromptTemplate.from_messages([
-        ("system", SENTIMENT_SYSTEM),
-        ("user", "{article_json}")
-    ])
+    return _chat(SENTIMENT_SYSTEM, "article_json")
+
+def sentiment_batch_prompt():
+    return _chat(SENTIMENT_BATCH_SYSTEM, "articles_json")
 
 def impact_prompt():
-    return ChatPromptTemplate.from_messages([
-        ("system", IMPACT_ESTIMATOR_SYSTEM),
-        ("user", "{state_json}")
-    ])
+    return _chat(IMPACT_ESTIMATOR_SYSTEM, "state_json")
 
 def reviewer_prompt():
-    return ChatPromptTemplate.from_messages([
-        ("system", REVIEWER_SYSTEM),
-        ("user", "{state_json}")
-    ])
+    return _chat(REVIEWER_SYSTEM, "state_json")
+
+# перезапрос после неразобранного ответа: ошибка валидации уходит модели
+REASK_TEMPLATE = (
+    "Предыдущий ответ не удалось разобрать: {error}\n"
+    "Верни только исправленный JSON-объект по той же схеме, без пояснений и markdown."
+)
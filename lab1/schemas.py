@@ -1,5 +1,8 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Literal, Any
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic.json_schema import SkipJsonSchema
+from typing import List, Optional, Dict, Literal, Any, Annotated, Union
+
+from price_series import PriceSeries
 
 class UserRequest(BaseModel):
     ticker: str
@@ -66,9 +69,13 @@ class PricesOut(BaseModel):
 
 
 class EventReturnIn(BaseModel):
-    prices: PricesOut
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    prices: Union[PriceSeries, PricesOut]
     articles: List[Article]
     window_days: int
+    # дополнительные окна (±N дней), считаются за тот же проход
+    windows: List[int] = []
 
 
 class EventReturn(BaseModel):
@@ -78,6 +85,7 @@ class EventReturn(BaseModel):
     pre_close: Optional[float]
     post_close: Optional[float]
     return_pct: Optional[float]
+    window_returns: Dict[int, Optional[float]] = {}
 
 
 class EventReturnOut(BaseModel):
@@ -85,6 +93,18 @@ class EventReturnOut(BaseModel):
 
 
 # outputs 
+_SENTIMENT_ALIASES = {
+    "pos": "positive", "bullish": "positive",
+    "neg": "negative", "bearish": "negative",
+    "neu": "neutral", "mixed": "neutral", "none": "neutral",
+}
+_IMPACT_ALIASES = {
+    "positive": "up", "increase": "up", "rise": "up", "bullish": "up",
+    "negative": "down", "decrease": "down", "fall": "down", "bearish": "down",
+    "none": "neutral", "flat": "neutral", "mixed": "neutral",
+}
+
+
 class SentimentImpact(BaseModel):
     url: Optional[str] = None
     title: Optional[str] = None
@@ -93,7 +113,46 @@ class SentimentImpact(BaseModel):
     polarity: float  # [-1..1]
     expected_impact: Literal["down", "neutral", "up"]
     confidence: float  # 0..1
-    rationale: str
+    rationale: str = ""
+    # кто оценил: llm, словарь на первой ступени каскада (cascade.py) или
+    # словарь как подмена после пропущенного дедлайна; в схему для LLM
+    # (response_format) поле не попадает
+    source: SkipJsonSchema[Literal["llm", "lexicon", "fallback"]] = "llm"
+
+    # типичные огрехи LLM чиним при валидации, а не перезапросом
+    @field_validator("sentiment", mode="before")
+    @classmethod
+    def _norm_sentiment(cls, v):
+        if isinstance(v, str):
+            v = v.strip().lower()
+            return _SENTIMENT_ALIASES.get(v, v)
+        return v
+
+    @field_validator("expected_impact", mode="before")
+    @classmethod
+    def _norm_impact(cls, v):
+        if isinstance(v, str):
+            v = v.strip().lower()
+            return _IMPACT_ALIASES.get(v, v)
+        return v
+
+    @field_validator("polarity")
+    @classmethod
+    def _clamp_polarity(cls, v: float) -> float:
+        return max(-1.0, min(1.0, v))
+
+    @field_validator("confidence")
+    @classmethod
+    def _clamp_confidence(cls, v: float) -> float:
+        if 1 < v <= 100:
+            v /= 100  # проценты
+        return max(0.0, min(1.0, v))
+
+
+class SentimentBatch(BaseModel):
+    # без items ответ — не батч: ошибка валидации, и llm_utils перезапросит,
+    # указав в тексте ошибки битые элементы (items.N.поле)
+    items: List[SentimentImpact]
 
 
 class ImpactSummary(BaseModel):
@@ -103,6 +162,11 @@ class ImpactSummary(BaseModel):
     overall_assessment: str = ""
 
 
+class ReportText(BaseModel):
+    # от LLM writer'а нужен только текст; данные FinalReport собираются локально
+    window: str = ""
+    conclusion: str = ""
+
 
 class FinalReport(BaseModel):
     ticker: str
@@ -111,16 +175,104 @@ class FinalReport(BaseModel):
     articles_analyzed: int
     impact_summary: ImpactSummary
     event_returns: List[EventReturn]
-    conclusion: str = ""  
+    conclusion: str = ""
+
+
+class TickerSnapshot(BaseModel):
+    """
+    Инкрементальный режим (incremental.py): что прошлый прогон по тикеру
+    уже нашёл, оценил и посчитал.
+    """
+    request: UserRequest
+    windows: List[int] = []
+    # конец прошлого окна поиска GDELT, YYYYMMDDHHMMSS
+    searched_through: str = ""
+    articles: List[Article] = []
+    sentiments: List[SentimentImpact] = []
+    event_returns: List[EventReturn] = []
+    # последний бар ряда при расчёте доходностей (ordinal) и его close
+    bars_through: Optional[int] = None
+    last_close: Optional[float] = None
+    report: Optional[FinalReport] = None
+
+
+# события стриминга (stream.py): узлы отдают их по мере готовности
+class SearchShardEvent(BaseModel):
+    type: Literal["search_shard"] = "search_shard"
+    # границы шарда в формате GDELT (%Y%m%d%H%M%S)
+    start: str
+    end: str
+    # новые статьи шарда (url ещё не встречался в других шардах)
+    articles: List[Article]
+    # total — шардов на момент события: растёт, когда обрезанный шард делится
+    done: int
+    total: int
+
+
+class ArticlesEvent(BaseModel):
+    type: Literal["articles"] = "articles"
+    count: int
+    unique: int
+
+
+class SentimentEvent(BaseModel):
+    type: Literal["sentiment"] = "sentiment"
+    # позиция статьи в state.articles
+    index: int
+    sentiment: SentimentImpact
+
+
+class EventReturnEvent(BaseModel):
+    type: Literal["event_return"] = "event_return"
+    event_return: EventReturn
+
+
+class ImpactSummaryEvent(BaseModel):
+    type: Literal["impact_summary"] = "impact_summary"
+    impact_summary: ImpactSummary
+
+
+class ReportEvent(BaseModel):
+    type: Literal["report"] = "report"
+    report: FinalReport
+
+
+StreamEvent = Annotated[
+    Union[SearchShardEvent, ArticlesEvent, SentimentEvent, EventReturnEvent, ImpactSummaryEvent, ReportEvent],
+    Field(discriminator="type"),
+]
+
+
+# редьюсеры: параллельные ветки графа пишут в state частичные обновления
+def merge_articles(left: List[Article], right: List[Article]) -> List[Article]:
+    seen = {a.url for a in left or []}
+    merged = list(left or [])
+    for a in right or []:
+        if a.url not in seen:
+            seen.add(a.url)
+            merged.append(a)
+    return merged
+
+
+def keep_latest(left, right):
+    return right if right is not None else left
 
 
 class GraphState(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     user_request: Optional[UserRequest] = None
     plan: Optional[PlanSpec] = None
-
-    articles: List[Article] = []
-    prices: Optional[PricesOut] = None
-    event_returns: Optional[EventReturnOut] = None
+    # снимок прошлого прогона — инкрементальный режим; None — полный прогон
+    snapshot: Optional[TickerSnapshot] = None
+    searched_through: str = ""
+
+    articles: Annotated[List[Article], merge_articles] = []
+    # почти-дубликаты: url дубликата -> url представителя; размер кластера представителя
+    duplicates: Dict[str, str] = {}
+    article_weights: Dict[str, int] = {}
+    prices: Annotated[Optional[PriceSeries], keep_latest] = None
+    event_returns: Annotated[Optional[EventReturnOut], keep_latest] = None
 
     sentiments: List[SentimentImpact] = []
     impact_summary: Optional[ImpactSummary] = None
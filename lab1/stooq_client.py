@@ -1,10 +1,19 @@
-import requests, csv, io
-from config import STOOQ_BASE, HTTP_TIMEOUT
+from config import STOOQ_BASE
+from transport import stream_lines, astream_lines
 
-def stooq_download_csv(ticker: str, start_date: str, end_date: str):
+def _params(ticker: str, start_date: str, end_date: str):
     # Stooq CSV download endpoint:
-    # https://stooq.com/q/d/l/?s=AAPL.US&i=d
-    params = {"s": ticker, "i": "d"}
-    r = requests.get(STOOQ_BASE, params=params, timeout=HTTP_TIMEOUT)
-    r.raise_for_status()
-    return r.text
+    # https://stooq.com/q/d/l/?s=AAPL.US&i=d&d1=20240101&d2=20241231
+    return {
+        "s": ticker,
+        "i": "d",
+        "d1": start_date.replace("-", ""),
+        "d2": end_date.replace("-", ""),
+    }
+
+def stooq_iter_lines(ticker: str, start_date: str, end_date: str):
+    """Строки CSV по мере чтения тела ответа, без буферизации всего текста."""
+    return stream_lines(STOOQ_BASE, _params(ticker, start_date, end_date))
+
+def astooq_iter_lines(ticker: str, start_date: str, end_date: str):
+    return astream_lines(STOOQ_BASE, _params(ticker, start_date, end_date))
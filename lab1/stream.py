@@ -0,0 +1,23 @@
+from typing import AsyncIterator, Iterator
+
+from schemas import GraphState, UserRequest, StreamEvent
+from graph import build_graph
+
+
+def stream_events(req: UserRequest, app=None) -> Iterator[StreamEvent]:
+    """
+    Типизированные события анализа по мере готовности:
+    SearchShardEvent (по шарду поиска GDELT, в порядке готовности) ->
+    ArticlesEvent -> SentimentEvent / EventReturnEvent (вперемешку, как
+    досчитываются) -> ImpactSummaryEvent -> ReportEvent.
+    SentimentEvent.index — позиция статьи в выдаче GDELT.
+    """
+    app = app or build_graph()
+    yield from app.stream(GraphState(user_request=req), stream_mode="custom")
+
+
+async def astream_events(req: UserRequest, app=None) -> AsyncIterator[StreamEvent]:
+    """async-вариант stream_events поверх async-графа."""
+    app = app or build_graph(use_async=True)
+    async for event in app.astream(GraphState(user_request=req), stream_mode="custom"):
+        yield event
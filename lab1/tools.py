@@ -1,29 +1,52 @@
+import asyncio
+import logging
 import time
-from datetime import datetime, timedelta
-from typing import List, Optional
-import csv, io
+from bisect import bisect_right
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
 
-from config import HTTP_RETRIES
+from config import (
+    PRICE_STORE_ENABLED, PRICE_STORE_TTL,
+    GDELT_CACHE_ENABLED, GDELT_CACHE_SLICE, GDELT_CACHE_TTL, GDELT_OPEN_SLICE_TTL,
+    GDELT_CACHE_SIZE, GDELT_CACHE_PATH, GDELT_SHARD_CONCURRENCY,
+)
 from schemas import (
     GDELTSearchIn, GDELTSearchOut, Article,
-    PricesIn, PricesOut, PricePoint,
+    PricesIn, PricesOut,
     EventReturnIn, EventReturnOut, EventReturn
 )
-from gdelt_client import gdelt_get
-from stooq_client import stooq_download_csv
+from gdelt_client import gdelt_get, agdelt_get
+from stooq_client import stooq_iter_lines, astooq_iter_lines
+from price_store import price_store
+from cache import TTLCache
+from event_engine import EventReturnEngine, event_ordinals
+from price_series import PriceSeries
+import metrics
+
+log = logging.getLogger(__name__)
+
+GDELT_TS = "%Y%m%d%H%M%S"
+SLICE_STEPS = {"day": timedelta(days=1), "hour": timedelta(hours=1), "week": timedelta(weeks=1)}
+# GDELT ArtList отдаёт не больше 250 записей на запрос
+GDELT_MAX_RECORDS = 250
+
+gdelt_cache = TTLCache(GDELT_CACHE_SIZE, GDELT_CACHE_TTL, GDELT_CACHE_PATH or None)
 
 
-def gdelt_search(inp: GDELTSearchIn) -> GDELTSearchOut:
-    params = {
+def _gdelt_params(inp: GDELTSearchIn) -> dict:
+    return {
         "query": inp.query,
         "mode": "ArtList",
         "format": "json",
         "startdatetime": inp.start_datetime,
         "enddatetime": inp.end_datetime,
-        "maxrecords": inp.max_records,
+        "maxrecords": min(inp.max_records, GDELT_MAX_RECORDS),
         "sort": "HybridRel"
     }
-    data = gdelt_get(params)
+
+
+def _parse_gdelt(data: dict) -> List[Article]:
     arts = []
 
     for a in data.get("articles", []):
@@ -49,37 +72,365 @@ def gdelt_search(inp: GDELTSearchIn) -> GDELTSearchOut:
             snippet=a.get("snippet")
         ))
 
-    return GDELTSearchOut(articles=arts)
+    return arts
 
 
-def gdelt_search_retry(inp: GDELTSearchIn) -> GDELTSearchOut:
-    last = None
-    for i in range(HTTP_RETRIES):
-        try:
-            return gdelt_search(inp)
-        except Exception as e:
-            last = e
-            time.sleep(0.5 * (2 ** i))
-    raise last
+def _gdelt_fetch(inp: GDELTSearchIn) -> List[Article]:
+    return _parse_gdelt(gdelt_get(_gdelt_params(inp)))
+
+
+async def _agdelt_fetch(inp: GDELTSearchIn) -> List[Article]:
+    return _parse_gdelt(await agdelt_get(_gdelt_params(inp)))
+
+
+def _cache_key(inp: GDELTSearchIn, start: str, end: str = "") -> str:
+    query = " ".join(inp.query.split()).lower()
+    return f"{query}|{start}|{end}|{min(inp.max_records, GDELT_MAX_RECORDS)}"
+
+
+def time_slices(start: datetime, end: datetime, step: timedelta) -> List[tuple]:
+    """Выровненные по границе step срезы, покрывающие [start, end]."""
+    cur = datetime.min + ((start - datetime.min) // step) * step
+    out = []
+    while cur < end:
+        out.append((cur, cur + step))
+        cur += step
+    return out
+
+
+def merge_slices(parts: List[List[Article]], start: str, end: str, limit: int) -> List[Article]:
+    """
+    Round-robin по срезам (чтобы лимит не съел один день), дедуп по url,
+    фильтр по дате события; результат — по времени (без даты — в конце).
+    """
+    seen = set()
+    out: List[Article] = []
+    for i in range(max((len(p) for p in parts), default=0)):
+        for p in parts:
+            if i >= len(p):
+                continue
+            a = p[i]
+            if a.url in seen or (a.datetime and not start <= a.datetime[:10] <= end):
+                continue
+            seen.add(a.url)
+            out.append(a)
+            if len(out) >= limit:
+                break
+        if len(out) >= limit:
+            break
+    # сортировка устойчивая: внутри дня остаётся порядок релевантности GDELT
+    out.sort(key=lambda a: (not a.datetime, a.datetime[:10]))
+    return out
+
+
+def _slice_requests(inp: GDELTSearchIn) -> List[tuple]:
+    """
+    [(кусок запроса, ключ кэша, ttl)] для выровненных срезов окна;
+    без нарезки — один кусок на всё окно. Куски просят полную страницу:
+    срез в кэше один на все max_articles.
+    """
+    inp = inp.model_copy(update={"max_records": GDELT_MAX_RECORDS})
+    step = SLICE_STEPS.get(GDELT_CACHE_SLICE)
+    if step is None:
+        return [(inp, _cache_key(inp, inp.start_datetime, inp.end_datetime), None)]
+
+    start = datetime.strptime(inp.start_datetime, GDELT_TS)
+    end = datetime.strptime(inp.end_datetime, GDELT_TS)
+    now = datetime.utcnow()
+
+    out = []
+    for s, e in time_slices(start, end, step):
+        is_open = e > now
+        piece = inp.model_copy(update={
+            "start_datetime": s.strftime(GDELT_TS),
+            "end_datetime": (now if is_open else e).strftime(GDELT_TS),
+        })
+        key = _cache_key(inp, piece.start_datetime, GDELT_CACHE_SLICE)
+        out.append((piece, key, GDELT_OPEN_SLICE_TTL if is_open else None))
+    return out
+
+
+def _merge_parts(inp: GDELTSearchIn, parts: List[List[Article]]) -> GDELTSearchOut:
+    start = datetime.strptime(inp.start_datetime, GDELT_TS).strftime("%Y-%m-%d")
+    end = datetime.strptime(inp.end_datetime, GDELT_TS).strftime("%Y-%m-%d")
+    return GDELTSearchOut(articles=merge_slices(parts, start, end, inp.max_records))
+
+
+def _seen_ts(a: dict) -> str:
+    # seendate "20240101T120000Z" -> "20240101120000"
+    return "".join(c for c in a.get("seendate") or "" if c.isdigit())[:14].ljust(14, "0")
+
+
+# прогресс шардированного поиска: (кусок запроса, его статьи, готово шардов, всего)
+ShardCallback = Callable[[GDELTSearchIn, List[Article], int, int], None]
+
+
+class _Shards:
+    """
+    План и сборка шардированного поиска. Шард — непрерывный прогон срезов
+    [lo, hi): подряд идущие срезы из кэша — один шард без сети, подряд идущие
+    промахи — один запрос на весь прогон, ответ раскладывается по срезам по
+    seendate и кэшируется. Только если ответ упёрся в страницу ArtList
+    (выдача обрезана), прогон делится пополам и половины идут параллельно.
+    Упавший шард — пропуск, а не весь поиск.
+    """
+
+    def __init__(self, inp: GDELTSearchIn, on_shard: ShardCallback | None):
+        # кэш — sqlite: async-поиск создаёт план в потоке
+        self.inp = inp
+        self.on_shard = on_shard
+        self.slices = _slice_requests(inp)
+        self.parts: List[List[Article]] = [[] for _ in self.slices]
+        self.cached: List[tuple] = []
+        self.pending: List[tuple] = []
+        self.done = self.ok = 0
+        self.errors: List[BaseException] = []
+
+        runs = []
+        for i, (_, key, _) in enumerate(self.slices):
+            hit = gdelt_cache.get(key) if GDELT_CACHE_ENABLED else None
+            if GDELT_CACHE_ENABLED:
+                metrics.cache("gdelt", hits=hit is not None, misses=hit is None)
+            if hit is not None:
+                self.parts[i] = [Article(**a) for a in hit]
+            if runs and runs[-1][2] == (hit is not None):
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1, hit is not None])
+        for lo, hi, cached in runs:
+            (self.cached if cached else self.pending).append((lo, hi))
+        self.total = len(runs)
+
+    def request(self, lo: int, hi: int) -> GDELTSearchIn:
+        return self.slices[lo][0].model_copy(update={"end_datetime": self.slices[hi - 1][0].end_datetime})
+
+    def fetched(self, lo: int, hi: int, data: dict) -> List[tuple]:
+        """Ответ на прогон: разложить по срезам в кэш; выдача обрезана — [две половины]."""
+        arts = data.get("articles") or []
+        if len(arts) >= GDELT_MAX_RECORDS and hi - lo > 1:
+            mid = (lo + hi) // 2
+            self.total += 1
+            return [(lo, mid), (mid, hi)]
+        starts = [self.slices[i][0].start_datetime for i in range(lo, hi)]
+        buckets = [[] for _ in starts]
+        for a in arts:
+            buckets[max(0, bisect_right(starts, _seen_ts(a)) - 1)].append(a)
+        for i, raw in zip(range(lo, hi), buckets):
+            self.parts[i] = _parse_gdelt({"articles": raw})
+            if GDELT_CACHE_ENABLED:
+                _, key, ttl = self.slices[i]
+                gdelt_cache.set(key, [a.model_dump() for a in self.parts[i]], ttl)
+        return []
+
+    def report(self, lo: int, hi: int):
+        self.done += 1
+        self.ok += 1
+        if self.on_shard is not None:
+            arts = [a for p in self.parts[lo:hi] for a in p]
+            self.on_shard(self.request(lo, hi), arts, self.done, self.total)
+
+    def failed(self, lo: int, hi: int, err: BaseException):
+        self.done += 1
+        self.errors.append(err)
+        metrics.item_failed()
+        piece = self.request(lo, hi)
+        log.warning("gdelt shard %s-%s failed: %r", piece.start_datetime, piece.end_datetime, err)
+
+    def result(self) -> GDELTSearchOut:
+        if self.errors and not self.ok:
+            raise self.errors[0]
+        return _merge_parts(self.inp, self.parts)
+
+
+def gdelt_search(inp: GDELTSearchIn, on_shard: ShardCallback | None = None) -> GDELTSearchOut:
+    """
+    ArtList-поиск, окно режется на выровненные срезы (см. _Shards). Холодное
+    окно — один запрос, длинное и насыщенное дробится, пока выдача шардов не
+    перестанет упираться в страницу; шарды идут параллельно
+    (GDELT_SHARD_CONCURRENCY, темп — лимиты хоста в transport). Пересекающиеся
+    окна разных запусков берут общие срезы из кэша; срез, который ещё не
+    закрылся, живёт GDELT_OPEN_SLICE_TTL. on_shard — по мере готовности шардов.
+    """
+    shards = _Shards(inp, on_shard)
+    for run in shards.cached:
+        shards.report(*run)
+    with ThreadPoolExecutor(max_workers=max(1, GDELT_SHARD_CONCURRENCY)) as ex:
+        def fetch(run):
+            return metrics.submit(ex, gdelt_get, _gdelt_params(shards.request(*run)))
+
+        futs = {fetch(run): run for run in shards.pending}
+        while futs:
+            done, _ = wait(futs, return_when=FIRST_COMPLETED)
+            for f in done:
+                run = futs.pop(f)
+                try:
+                    more = shards.fetched(*run, f.result())
+                except Exception as e:
+                    shards.failed(*run, e)
+                    continue
+                futs.update({fetch(r): r for r in more})
+                if not more:
+                    shards.report(*run)
+    return shards.result()
+
+
+async def agdelt_search(inp: GDELTSearchIn, on_shard: ShardCallback | None = None) -> GDELTSearchOut:
+    shards = await asyncio.to_thread(_Shards, inp, on_shard)
+    for run in shards.cached:
+        shards.report(*run)
+    sem = asyncio.Semaphore(max(1, GDELT_SHARD_CONCURRENCY))
+
+    async def fetch(run):
+        async with sem:
+            return await agdelt_get(_gdelt_params(shards.request(*run)))
+
+    tasks = {asyncio.ensure_future(fetch(run)): run for run in shards.pending}
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                run = tasks.pop(t)
+                try:
+                    more = await asyncio.to_thread(shards.fetched, *run, t.result())
+                except Exception as e:
+                    shards.failed(*run, e)
+                    continue
+                tasks.update({asyncio.ensure_future(fetch(r)): r for r in more})
+                if not more:
+                    shards.report(*run)
+    finally:
+        for t in tasks:
+            t.cancel()
+    return shards.result()
+
+
+def gdelt_search_delta(inp: GDELTSearchIn) -> GDELTSearchOut:
+    """
+    Узкое окно инкрементального режима: одним запросом мимо кэша срезов —
+    окно каждый раз новое, а нарезка расширила бы его до целого дня.
+    """
+    return _merge_parts(inp, [_gdelt_fetch(inp)])
+
+
+async def agdelt_search_delta(inp: GDELTSearchIn) -> GDELTSearchOut:
+    return _merge_parts(inp, [await _agdelt_fetch(inp)])
+
+
+def gdelt_search_retry(inp: GDELTSearchIn, on_shard: ShardCallback | None = None) -> GDELTSearchOut:
+    # ретраи с джиттером и Retry-After — в transport, здесь только имя для узлов
+    return gdelt_search(inp, on_shard)
+
+
+async def agdelt_search_retry(inp: GDELTSearchIn, on_shard: ShardCallback | None = None) -> GDELTSearchOut:
+    return await agdelt_search(inp, on_shard)
+
+
+def _ord_range(start_ord: int, end_ord: int) -> tuple[str, str]:
+    return date.fromordinal(start_ord).isoformat(), date.fromordinal(end_ord).isoformat()
+
+
+def _download_series(ticker: str, start_ord: int, end_ord: int) -> PriceSeries:
+    """Потоковый разбор ответа Stooq с отсечением строк вне диапазона."""
+    start, end = _ord_range(start_ord, end_ord)
+    series = PriceSeries(ticker)
+    for line in stooq_iter_lines(ticker, start, end):
+        if not series.append_csv(line, start, end):
+            break
+    return series
+
+
+async def _adownload_series(ticker: str, start_ord: int, end_ord: int) -> PriceSeries:
+    start, end = _ord_range(start_ord, end_ord)
+    series = PriceSeries(ticker)
+    lines = astooq_iter_lines(ticker, start, end)
+    try:
+        async for line in lines:
+            if not series.append_csv(line, start, end):
+                break
+    finally:
+        await lines.aclose()
+    return series
+
+
+def _price_store_plan(ticker: str, start_ord: int, end_ord: int) -> dict | None:
+    """
+    Что докачать в price_store (None — ничего):
+    - первый запрос или start раньше покрытия — полная перекачка диапазона;
+    - иначе — с последнего сохранённого бара (он мог быть незакрытым днём).
+    Бар текущего дня перезапрашивается не чаще раза в PRICE_STORE_TTL.
+    """
+    meta = price_store.meta(ticker)
+    today = datetime.utcnow().date().toordinal()
+
+    if meta is None or start_ord < meta["covered_from"]:
+        through = max(end_ord, meta["checked_through"]) if meta else end_ord
+        return {"frm": start_ord, "to": through, "covered_from": start_ord,
+                "checked_through": through, "replace": True}
+
+    stale = time.time() - meta["checked_at"] > PRICE_STORE_TTL
+    if end_ord > meta["checked_through"] or (end_ord >= today and stale):
+        last = price_store.last_date(ticker)
+        return {"frm": last if last is not None else meta["covered_from"], "to": end_ord,
+                "covered_from": meta["covered_from"],
+                "checked_through": max(end_ord, meta["checked_through"]), "replace": False}
+    return None
+
+
+def _store_write(ticker: str, plan: dict, series: PriceSeries):
+    price_store.write(
+        ticker, series, plan["covered_from"], plan["checked_through"], replace=plan["replace"]
+    )
+
+
+def _sync_price_store(ticker: str, start_ord: int, end_ord: int):
+    plan = _price_store_plan(ticker, start_ord, end_ord)
+    metrics.cache("price_store", hits=plan is None, misses=plan is not None)
+    if plan is not None:
+        _store_write(ticker, plan, _download_series(ticker, plan["frm"], plan["to"]))
+
+
+async def _async_price_store(ticker: str, start_ord: int, end_ord: int):
+    # price_store — файлы и sqlite: план и запись в потоке, не на event loop
+    plan = await asyncio.to_thread(_price_store_plan, ticker, start_ord, end_ord)
+    metrics.cache("price_store", hits=plan is None, misses=plan is not None)
+    if plan is not None:
+        series = await _adownload_series(ticker, plan["frm"], plan["to"])
+        await asyncio.to_thread(_store_write, ticker, plan, series)
+
+
+def _series_from_store(inp: PricesIn, start_ord: int, end_ord: int) -> PriceSeries:
+    return PriceSeries.from_columns(inp.ticker, price_store.read(inp.ticker, start_ord, end_ord))
+
+
+def _price_range(inp: PricesIn) -> tuple[int, int]:
+    return (
+        date.fromisoformat(inp.start_date).toordinal(),
+        date.fromisoformat(inp.end_date).toordinal(),
+    )
+
+
+def stooq_price_series(inp: PricesIn) -> PriceSeries:
+    start_ord, end_ord = _price_range(inp)
+    if PRICE_STORE_ENABLED:
+        _sync_price_store(inp.ticker, start_ord, end_ord)
+        return _series_from_store(inp, start_ord, end_ord)
+    return _download_series(inp.ticker, start_ord, end_ord)
+
+
+async def astooq_price_series(inp: PricesIn) -> PriceSeries:
+    start_ord, end_ord = _price_range(inp)
+    if PRICE_STORE_ENABLED:
+        await _async_price_store(inp.ticker, start_ord, end_ord)
+        return await asyncio.to_thread(_series_from_store, inp, start_ord, end_ord)
+    return await _adownload_series(inp.ticker, start_ord, end_ord)
 
 
 def stooq_prices(inp: PricesIn) -> PricesOut:
-    text = stooq_download_csv(inp.ticker, inp.start_date, inp.end_date)
-    f = io.StringIO(text)
-    reader = csv.DictReader(f)
-    prices = []
-
-    for row in reader:
-        prices.append(PricePoint(
-            date=row["Date"],
-            open=float(row["Open"]),
-            high=float(row["High"]),
-            low=float(row["Low"]),
-            close=float(row["Close"]),
-            volume=float(row["Volume"]) if row.get("Volume") else None
-        ))
+    return stooq_price_series(inp).to_prices_out()
+
 
-    return PricesOut(ticker=inp.ticker, prices=prices)
+async def astooq_prices(inp: PricesIn) -> PricesOut:
+    return (await astooq_price_series(inp)).to_prices_out()
 
 
 def compute_event_returns(inp: EventReturnIn) -> EventReturnOut:
@@ -88,47 +439,62 @@ def compute_event_returns(inp: EventReturnIn) -> EventReturnOut:
     pre_close — close за window_days ДО новости
     post_close — close за window_days ПОСЛЕ новости
     return_pct = (post / pre - 1) * 100
+    Для окон из inp.windows — return_pct в window_returns.
     """
-    price_by_date = {p.date: p for p in inp.prices.prices}
-
-    def nearest_close(d: datetime) -> Optional[float]:
-        for k in range(0, 7):
-            dd = (d - timedelta(days=k)).strftime("%Y-%m-%d")
-            if dd in price_by_date:
-                return price_by_date[dd].close
-        return None
-
-    def nearest_close_after(d: datetime) -> Optional[float]:
-        for k in range(0, 7):
-            dd = (d + timedelta(days=k)).strftime("%Y-%m-%d")
-            if dd in price_by_date:
-                return price_by_date[dd].close
-        return None
+    series = inp.prices
+    if not isinstance(series, PriceSeries):
+        series = PriceSeries.from_prices_out(series)
+    engine = EventReturnEngine(series.dates, series.close)
+    ords = event_ordinals([a.datetime for a in inp.articles])
+    table = engine.resolve(
+        (o for o in ords if o is not None), [inp.window_days, *inp.windows]
+    )
+    main = table[inp.window_days]
 
     ers: List[EventReturn] = []
-    for art in inp.articles:
-        try:
-            event_dt = datetime.fromisoformat(art.datetime)
-        except Exception:
+    for art, o in zip(inp.articles, ords):
+        if o is None:
             continue
 
-        pre_dt = event_dt - timedelta(days=inp.window_days)
-        post_dt = event_dt + timedelta(days=inp.window_days)
-
-        pre_close = nearest_close(pre_dt)
-        post_close = nearest_close_after(post_dt)
-
-        ret = None
-        if pre_close and post_close:
-            ret = (post_close / pre_close - 1) * 100
-
+        pre_close, post_close, ret = main[o]
         ers.append(EventReturn(
             url=art.url,
             title=art.title,
-            event_date=event_dt.strftime("%Y-%m-%d"),
+            event_date=date.fromordinal(o).isoformat(),
             pre_close=pre_close,
             post_close=post_close,
-            return_pct=round(ret, 3) if ret is not None else None
+            return_pct=ret,
+            window_returns={w: table[w][o][2] for w in inp.windows},
         ))
 
     return EventReturnOut(event_returns=ers)
+
+
+def refresh_event_returns(inp: EventReturnIn, prev: Dict[str, EventReturn],
+                          changed_from: Optional[int]) -> tuple[EventReturnOut, int]:
+    """
+    Инкрементальный compute_event_returns. Доходность из prev (по url)
+    берётся как есть, если её окна не задевают бары с ordinal >= changed_from
+    (None — ряд с прошлого прогона не менялся); новые статьи и задетые
+    считаются заново. Возвращает (результат в порядке статей, сколько пересчитано).
+    """
+    series = inp.prices
+    if not isinstance(series, PriceSeries):
+        series = PriceSeries.from_prices_out(series)
+    engine = EventReturnEngine(series.dates, series.close)
+    windows = [inp.window_days, *inp.windows]
+    ords = event_ordinals([a.datetime for a in inp.articles])
+
+    todo = [
+        a for a, o in zip(inp.articles, ords)
+        if o is not None and (
+            a.url not in prev
+            or (changed_from is not None and engine.touches(o, windows, changed_from))
+        )
+    ]
+    fresh = {er.url: er for er in compute_event_returns(
+        inp.model_copy(update={"prices": series, "articles": todo})
+    ).event_returns}
+
+    ers = [fresh.get(a.url) or prev[a.url] for a, o in zip(inp.articles, ords) if o is not None]
+    return EventReturnOut(event_returns=ers), len(todo)
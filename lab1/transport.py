@@ -0,0 +1,320 @@
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HTTP_TIMEOUT, HTTP_RETRIES, HTTP_POOL_SIZE, HTTP_RATE_LIMITS, HTTP_RATE_DEFAULT,
+    HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX, HTTP_CONDITIONAL_CACHE,
+)
+from aio import limiter, http_client
+from metrics import queued
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+HEADERS = {"Accept-Encoding": "gzip, deflate"}
+
+
+class TokenBucket:
+    """rate запросов/с, burst — запас. reserve() отдаёт, сколько ждать до слота."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def _parse_limits(spec: str) -> dict[str, tuple[float, float]]:
+    # "host=rate[:burst],host2=..."
+    out = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        host, val = part.split("=", 1)
+        rate, _, burst = val.partition(":")
+        out[host.strip()] = (float(rate), float(burst or 1))
+    return out
+
+
+_limits = _parse_limits(HTTP_RATE_LIMITS)
+_default_rate, _, _default_burst = HTTP_RATE_DEFAULT.partition(":")
+_buckets: dict[str, TokenBucket] = {}
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_validators: "OrderedDict[str, tuple[str | None, str | None, object]]" = OrderedDict()
+
+_metrics = {
+    "requests": 0,
+    "async_connections_opened": 0,
+    "retries": 0,
+    "throttled": 0,
+    "throttle_wait_s": 0.0,
+    "not_modified": 0,
+    "errors": 0,
+}
+
+
+def _count(key: str, value=1):
+    with _lock:
+        _metrics[key] += value
+
+
+def session() -> requests.Session:
+    """Общая keep-alive сессия с пулом соединений на хост."""
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers.update(HEADERS)
+            _session = s
+        return _session
+
+
+def _bucket(url: str) -> TokenBucket:
+    host = urlsplit(url).hostname or ""
+    with _lock:
+        b = _buckets.get(host)
+        if b is None:
+            rate, burst = _limits.get(host, (float(_default_rate), float(_default_burst or 1)))
+            b = _buckets[host] = TokenBucket(rate, burst)
+        return b
+
+
+def _throttle_wait(url: str) -> float:
+    wait = _bucket(url).reserve()
+    if wait > 0:
+        _count("throttled")
+        _count("throttle_wait_s", wait)
+        queued(wait)
+    return wait
+
+
+def retry_delay(attempt: int, headers=None) -> float:
+    """Retry-After (секунды или HTTP-дата), иначе экспонента с джиттером."""
+    ra = headers.get("Retry-After") if headers else None
+    if ra:
+        try:
+            return min(HTTP_BACKOFF_MAX, float(ra))
+        except ValueError:
+            try:
+                return min(HTTP_BACKOFF_MAX, max(0.0, parsedate_to_datetime(ra).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    # "equal jitter": половина детерминированно, половина случайно — без синхронных штормов
+    d = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt)
+    return d / 2 + random.uniform(0, d / 2)
+
+
+def _cache_key(url: str, params: dict) -> str:
+    return url + "?" + urlencode(sorted(params.items()))
+
+
+def _conditional_headers(key: str) -> dict:
+    with _lock:
+        v = _validators.get(key)
+    if v is None:
+        return {}
+    h = {}
+    if v[0]:
+        h["If-None-Match"] = v[0]
+    if v[1]:
+        h["If-Modified-Since"] = v[1]
+    return h
+
+
+def _remember(key: str, headers, data):
+    etag, lm = headers.get("ETag"), headers.get("Last-Modified")
+    if not etag and not lm:
+        return
+    with _lock:
+        _validators[key] = (etag, lm, data)
+        _validators.move_to_end(key)
+        while len(_validators) > HTTP_CONDITIONAL_CACHE:
+            _validators.popitem(last=False)
+
+
+def _cached_body(key: str):
+    with _lock:
+        return _validators[key][2]
+
+
+class RetryableError(Exception):
+    def __init__(self, msg: str, headers=None):
+        super().__init__(msg)
+        self.headers = headers
+
+
+def _check(status: int, headers, text_head: str = ""):
+    if status in RETRY_STATUSES:
+        raise RetryableError(f"HTTP {status} {text_head[:200]}", headers)
+
+
+def get_json(url: str, params: dict):
+    """GET с пулом, лимитом хоста, условными запросами и ретраями; возвращает JSON."""
+    key = _cache_key(url, params)
+    last = None
+    for attempt in range(HTTP_RETRIES + 1):
+        if attempt:
+            _count("retries")
+            time.sleep(retry_delay(attempt - 1, getattr(last, "headers", None)))
+        time.sleep(_throttle_wait(url))
+        _count("requests")
+        try:
+            r = session().get(url, params=params, timeout=HTTP_TIMEOUT,
+                              headers=_conditional_headers(key))
+            if r.status_code == 304:
+                _count("not_modified")
+                return _cached_body(key)
+            _check(r.status_code, r.headers, r.text)
+            r.raise_for_status()
+            try:
+                data = r.json()
+            except ValueError:
+                # GDELT на превышение лимита отвечает 200 с текстом вместо JSON
+                raise RetryableError(f"Non-JSON body: {r.text[:200]}", r.headers)
+            _remember(key, r.headers, data)
+            return data
+        except (RetryableError, requests.ConnectionError, requests.Timeout) as e:
+            last = e
+    _count("errors")
+    raise last
+
+
+def stream_lines(url: str, params: dict):
+    """Построчное чтение тела; ретраи только до первой отданной строки."""
+    last = None
+    for attempt in range(HTTP_RETRIES + 1):
+        if attempt:
+            _count("retries")
+            time.sleep(retry_delay(attempt - 1, getattr(last, "headers", None)))
+        time.sleep(_throttle_wait(url))
+        _count("requests")
+        started = False
+        try:
+            r = session().get(url, params=params, timeout=HTTP_TIMEOUT, stream=True)
+            if r.status_code in RETRY_STATUSES:
+                r.close()
+                raise RetryableError(f"HTTP {r.status_code}", r.headers)
+            with r:
+                r.raise_for_status()
+                r.encoding = r.encoding or "utf-8"
+                for line in r.iter_lines(decode_unicode=True):
+                    if line:
+                        started = True
+                        yield line
+            return
+        except (RetryableError, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            # обрыв, таймаут чтения, битый chunked — повтор, пока не отдана ни одна строка
+            if started:
+                raise
+            last = e
+    _count("errors")
+    raise last
+
+
+async def _trace(event_name: str, info: dict):
+    if event_name == "connection.connect_tcp.complete":
+        _count("async_connections_opened")
+
+
+async def aget_json(url: str, params: dict):
+    key = _cache_key(url, params)
+    last = None
+    for attempt in range(HTTP_RETRIES + 1):
+        if attempt:
+            _count("retries")
+            await asyncio.sleep(retry_delay(attempt - 1, getattr(last, "headers", None)))
+        # ждём лимит хоста, не занимая слот общего лимитера
+        await asyncio.sleep(_throttle_wait(url))
+        _count("requests")
+        try:
+            t0 = time.perf_counter()
+            async with limiter():
+                queued(time.perf_counter() - t0)
+                r = await http_client().get(url, params=params, headers=_conditional_headers(key),
+                                            extensions={"trace": _trace})
+            if r.status_code == 304:
+                _count("not_modified")
+                return _cached_body(key)
+            _check(r.status_code, r.headers, r.text)
+            r.raise_for_status()
+            try:
+                data = r.json()
+            except ValueError:
+                raise RetryableError(f"Non-JSON body: {r.text[:200]}", r.headers)
+            _remember(key, r.headers, data)
+            return data
+        except (RetryableError, httpx.TransportError) as e:
+            last = e
+    _count("errors")
+    raise last
+
+
+async def astream_lines(url: str, params: dict):
+    """async stream_lines: ретраи только до первой отданной строки."""
+    last = None
+    for attempt in range(HTTP_RETRIES + 1):
+        if attempt:
+            _count("retries")
+            await asyncio.sleep(retry_delay(attempt - 1, getattr(last, "headers", None)))
+        await asyncio.sleep(_throttle_wait(url))
+        _count("requests")
+        started = False
+        t0 = time.perf_counter()
+        async with limiter():
+            queued(time.perf_counter() - t0)
+            try:
+                async with http_client().stream("GET", url, params=params,
+                                                extensions={"trace": _trace}) as r:
+                    _check(r.status_code, r.headers)
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if line:
+                            started = True
+                            yield line
+                return
+            except (RetryableError, httpx.TransportError) as e:
+                # обрыв, таймаут чтения, разрыв протокола — повтор, пока не отдана ни одна строка
+                if started:
+                    raise
+                last = e
+    _count("errors")
+    raise last
+
+
+def metrics() -> dict:
+    """Счётчики транспорта: переиспользование соединений, троттлинг, ретраи."""
+    opened = 0
+    if _session is not None:
+        for adapter in _session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for k in pools.keys():
+                pool = pools.get(k)
+                if pool is not None:
+                    opened += pool.num_connections
+    with _lock:
+        m = dict(_metrics)
+    m["connections_opened"] = opened + m.pop("async_connections_opened")
+    m["connections_reused"] = max(0, m["requests"] - m["connections_opened"])
+    m["throttle_wait_s"] = round(m["throttle_wait_s"], 3)
+    return m
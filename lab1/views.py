@@ -0,0 +1,154 @@
+import json
+from typing import Dict, List, Optional
+
+from config import PROMPT_VIEW_TOKENS, PROMPT_VIEW_TOP_K
+from schemas import GraphState, EventReturn, SentimentImpact
+from llm_utils import estimate_tokens
+
+TITLE_CHARS = 90
+_IMPACT_SIGN = {"up": 1, "down": -1, "neutral": 0}
+
+
+def _mj(obj) -> str:
+    # минифицированный JSON: в промпте отступы — это токены
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _r(x: Optional[float], nd: int = 2) -> Optional[float]:
+    return None if x is None else round(x, nd)
+
+
+def strength(s: SentimentImpact) -> float:
+    return abs(s.polarity) * s.confidence
+
+
+def _returns_by_url(state: GraphState) -> Dict[str, EventReturn]:
+    if not state.event_returns:
+        return {}
+    return {er.url: er for er in state.event_returns.event_returns}
+
+
+def _windows(returns: Dict[str, EventReturn]) -> List[int]:
+    ws = set()
+    for er in returns.values():
+        ws.update(er.window_returns)
+    return sorted(ws)
+
+
+def _ret(er: Optional[EventReturn], w: Optional[int]) -> Optional[float]:
+    if er is None:
+        return None
+    if w is None:
+        return er.return_pct
+    return er.window_returns.get(w, er.return_pct)
+
+
+def _stats(items: List[SentimentImpact], weights: Dict[str, int],
+           returns: Dict[str, EventReturn], windows: List[int]) -> dict:
+    """Агрегаты по группе статей: вес — размер кластера почти-дубликатов."""
+    n = sum(weights.get(s.url, 1) for s in items)
+    out = {
+        "n": n,
+        "pos": sum(weights.get(s.url, 1) for s in items if s.sentiment == "positive"),
+        "neg": sum(weights.get(s.url, 1) for s in items if s.sentiment == "negative"),
+        "avg_pol": _r(sum(s.polarity * weights.get(s.url, 1) for s in items) / n) if n else None,
+        "avg_conf": _r(sum(s.confidence * weights.get(s.url, 1) for s in items) / n) if n else None,
+    }
+    for w in windows or [None]:
+        rets = [(s, _ret(returns.get(s.url), w)) for s in items]
+        rets = [(s, r) for s, r in rets if r is not None]
+        key = f"r{w}" if w is not None else "r"
+        out[f"avg_{key}"] = _r(sum(r for _, r in rets) / len(rets)) if rets else None
+        # совпадение ожидаемого направления с фактическим знаком доходности
+        directed = [(s, r) for s, r in rets if _IMPACT_SIGN[s.expected_impact] and r]
+        out[f"hit_{key}"] = (
+            _r(sum(1 for s, r in directed if (r > 0) == (_IMPACT_SIGN[s.expected_impact] > 0))
+               / len(directed))
+            if directed else None
+        )
+    return out
+
+
+class ArticleTable:
+    """
+    Табличное представление оценок для промпта: короткие id вместо url,
+    строки по убыванию |polarity|*confidence, сколько влезает в бюджет.
+    Остаток («хвост») описывается только агрегатами.
+    """
+
+    def __init__(self, state: GraphState, budget: int = PROMPT_VIEW_TOKENS,
+                 top_k: int = PROMPT_VIEW_TOP_K):
+        self.returns = _returns_by_url(state)
+        self.windows = _windows(self.returns)
+        self.weights = state.article_weights
+        reps = [s for s in state.sentiments if s.url not in state.duplicates]
+        self.ranked = sorted(reps, key=strength, reverse=True)
+        self.ids = {f"a{i + 1}": s.url for i, s in enumerate(self.ranked)}
+        self.budget = budget
+        self.top_k = top_k
+
+    @property
+    def cols(self) -> List[str]:
+        rets = [f"r{w}" for w in self.windows] or ["r"]
+        return ["id", "title", "sent", "pol", "conf", "impact", *rets, "n"]
+
+    def row(self, i: int, s: SentimentImpact) -> list:
+        er = self.returns.get(s.url)
+        rets = [_r(_ret(er, w)) for w in self.windows] or [_r(_ret(er, None))]
+        return [
+            f"a{i + 1}", (s.title or "")[:TITLE_CHARS], s.sentiment[:3],
+            _r(s.polarity), _r(s.confidence), s.expected_impact, *rets,
+            self.weights.get(s.url, 1),
+        ]
+
+    def build(self, header: dict) -> dict:
+        """header + top/tail; строки добавляются, пока оценка токенов <= budget."""
+        view = {**header, "stats_all": _stats(self.ranked, self.weights, self.returns, self.windows),
+                "cols": self.cols, "top": []}
+        used = estimate_tokens(_mj(view)) + 60  # запас на stats_tail
+        rows = []
+        for i, s in enumerate(self.ranked[:self.top_k]):
+            cost = estimate_tokens(_mj(self.row(i, s))) + 1
+            if used + cost > self.budget:
+                break
+            rows.append(self.row(i, s))
+            used += cost
+        view["top"] = rows
+        tail = self.ranked[len(rows):]
+        if tail:
+            view["stats_tail"] = _stats(tail, self.weights, self.returns, self.windows)
+        return view
+
+    def resolve(self, refs: List[str]) -> List[str]:
+        """id из ответа LLM -> url; url пропускаются как есть, прочее отбрасывается."""
+        urls = set(self.ids.values())
+        out = []
+        for ref in refs:
+            url = self.ids.get(ref.strip(), ref.strip())
+            if url in urls and url not in out:
+                out.append(url)
+        return out
+
+
+def impact_view(state: GraphState, table: ArticleTable) -> str:
+    req = state.user_request
+    return _mj(table.build({
+        "ticker": req.ticker if req else None,
+        "company_name": req.company_name if req else None,
+    }))
+
+
+def writer_view(state: GraphState, table: ArticleTable) -> str:
+    req = state.user_request
+    summary = state.impact_summary
+    titles = {s.url: s.title for s in table.ranked}
+    return _mj(table.build({
+        "ticker": req.ticker if req else None,
+        "company": req.company_name if req else None,
+        "lookback_days": req.lookback_days if req else None,
+        "event_window_days": req.event_window_days if req else None,
+        "articles_analyzed": len(state.articles),
+        "overall_assessment": summary.overall_assessment if summary else "",
+        "strongest_positive": [titles.get(u, u) for u in summary.strongest_positive] if summary else [],
+        "strongest_negative": [titles.get(u, u) for u in summary.strongest_negative] if summary else [],
+    }))